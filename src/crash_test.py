@@ -5,6 +5,8 @@ import json
 import logging
 import random
 
+from ring_inspect import report, wait_for_convergence
+
 # Set up logging
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
@@ -95,12 +97,15 @@ def main():
             logging.error("No more nodes to crash or error in crashing. Ending test.")
             break
 
-        # Wait for some time to let the network adjust
-        time.sleep(200)
+        # Poll the remaining nodes concurrently until they have repaired the ring, instead of a fixed wait
+        remaining_nodes = [node for node in nodes if node not in crashed_nodes]
+        converged, elapsed, diffs = wait_for_convergence(remaining_nodes, timeout=200)
+        if not converged:
+            report(diffs)
 
         # Check if the network is still stable with the remaining nodes
         logging.info(f"Checking network stability after crashing {burst_size} nodes...")
-        stable = check_network_stability([node for node in nodes if node not in crashed_nodes])
+        stable = converged and check_network_stability(remaining_nodes)
 
         if stable:
             logging.info(f"Network stabilized after crashing {burst_size} node(s).")
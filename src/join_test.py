@@ -4,6 +4,8 @@ import http.client
 import json
 import logging
 
+from ring_inspect import fetch_snapshot, report, wait_for_convergence
+
 
 
 # Set up logging
@@ -71,55 +73,6 @@ def verify_ring_structure(nodes_info):
 
 
 
-def check_others_change(nodes, length ,required_stable_duration=15, interval=4):
-    """
-    Check if the 'others' field in the node-info changes.
-    The function runs indefinitely until all nodes have no changes in their 'others' field for the required duration.
-    """
-    # print(f'length: {length}\n')
-    if length >= 4 and length < 16:
-        required_stable_duration = 20
-    elif length >= 16 and length < 24: 
-        required_stable_duration = 40
-        interval = 7
-    elif length >= 24: 
-        required_stable_duration = 60 
-        interval = 10
-
-    last_others = {node: get_node_info(node)['others'] for node in nodes}
-    unchanged_time = {node: 0 for node in nodes}
-
-    while True:
-        change_detected = False
-
-        for node in nodes:
-            current_info = get_node_info(node)
-            if current_info:
-                current_others = current_info['others']
-
-                # If the 'others' field has changed for any node, set change_detected to True
-                if current_others != last_others[node]:
-                    logging.info(f"'others' for node {node} changed.")
-                    last_others[node] = current_others
-                    change_detected = True
-
-        if change_detected:
-            # Reset the unchanged time for all nodes if any change is detected
-            logging.info(f"Resetting time for all nodes due to a change.")
-            unchanged_time = {node: 0 for node in nodes}
-        else:
-            # Increment the time since the last change for all nodes
-            for node in nodes:
-                unchanged_time[node] += interval
-
-            # Check if all nodes have had no changes for the required_stable_duration
-            if all(unchanged_time[node] >= required_stable_duration for node in nodes):
-                logging.info(f"No change in 'others' for any node in the last {required_stable_duration} seconds.")
-                return True  # The test is considered complete
-
-        # Sleep for the interval before checking again
-        time.sleep(interval)
-
 def main():
     parser = argparse.ArgumentParser(
         description="Connect nodes and verify the ring structure.")
@@ -144,56 +97,29 @@ def main():
     for node in nodes[1:]:
         join_node(node, bootstrap_node)
     
-    length_list_node = len(nodes)
-    # Verify connections and the ring structure
-    nodes_info = []
-    for node in nodes:
-        node_info = get_node_info(node)
-        if node_info:
-            nodes_info.append(node_info)
+    # Poll every node concurrently until successors, predecessors and fingers all match the ideal ring.
+    converged, elapsed, diffs = wait_for_convergence(nodes, timeout=60 + 10 * len(nodes))
 
+    # Verify the correct ring structure
+    nodes_info = [info for info in fetch_snapshot(nodes).values() if info]
     if len(nodes_info) != len(nodes):
         logging.error("Not all nodes returned valid information.")
         return
-
-    # Wait until all nodes have proper predecessor and successor
-    all_connected = False
-    while not all_connected:
-        all_connected = all(
-            node['predecessor'] is not None and node['successor'] is not None for node in nodes_info)
-
-        if all_connected:
-            logging.info("All nodes have valid predecessors and successors.")
-        else:
-            logging.info(
-                "Waiting for all nodes to have predecessors and successors...")
-            time.sleep(2)
-            nodes_info = [get_node_info(node) for node in nodes]
-
-    # Verify the correct ring structure
     ring_correct = verify_ring_structure(nodes_info)
 
-    if ring_correct:
+    if ring_correct and converged:
         logging.info("Ring structure verification passed.")
         logging.info(
                 f"All nodes successfully connected via bootstrap {bootstrap_node}.") 
-        logging.info("Next test: finger table entries updating (Fix finger action).")
-
-
-        # Check for changes in 'others' field for each node
-        others_test_passed = check_others_change(nodes, length_list_node)
-
-        if others_test_passed:
-            logging.info("Others field test passed")
-            # Measure the total time
-            end_time_e = time.time()
-            total_time_e = end_time_e - start_time_e
-            logging.info("Now use ./get.sh, and next test to run is ./put_test")
-            logging.info(
+        logging.info("Finger tables converged (Fix finger action).")
+        # Measure the total time
+        end_time_e = time.time()
+        total_time_e = end_time_e - start_time_e
+        logging.info("Now use ./get.sh, and next test to run is ./put_test")
+        logging.info(
                 f"Total time for startup: {total_time_e:.2f} seconds. Amount nodes {len(nodes)}")
-            
-
     else:
+        report(diffs)
         logging.error("Ring structure verification failed.")
         print("Remember only this can be executed once, kill all server and rerun\n")
 
@@ -5,6 +5,8 @@ import json
 import logging
 import random
 
+from ring_inspect import report, wait_for_convergence
+
 # Set up logging
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s - %(levelname)s - %(message)s')
@@ -40,50 +42,6 @@ def get_node_info(node_address):
         logging.error(f"Error fetching node info from {node_address}: {e}")
         return None
 
-def check_others_change(nodes, length, required_stable_duration=15, interval=4):
-    """
-    Check if the 'others' field in the node-info changes.
-    The function runs indefinitely until all nodes have no changes in their 'others' field for the required duration.
-    """
-    if length >= 4 and length < 16:
-        required_stable_duration = 20
-    elif length >= 16 and length < 24: 
-        required_stable_duration = 40
-        interval = 7
-    elif length >= 24: 
-        required_stable_duration = 60 
-        interval = 10
-
-    last_others = {node: get_node_info(node)['others'] for node in nodes}
-    unchanged_time = {node: 0 for node in nodes}
-
-    while True:
-        change_detected = False
-
-        for node in nodes:
-            current_info = get_node_info(node)
-            if current_info:
-                current_others = current_info['others']
-
-                if current_others != last_others[node]:
-                    logging.info(f"'others' for node {node} changed.")
-                    last_others[node] = current_others
-                    change_detected = True
-
-        if change_detected:
-            logging.info(f"Resetting time for all nodes due to a change.")
-            unchanged_time = {node: 0 for node in nodes}
-        else:
-            for node in nodes:
-                unchanged_time[node] += interval
-
-            if all(unchanged_time[node] >= required_stable_duration for node in nodes):
-                logging.info(f"No change in 'others' for any node in the last {required_stable_duration} seconds.")
-                return True  
-
-        time.sleep(interval)
-
-
 def main():
     parser = argparse.ArgumentParser(
         description="Remove nodes."
@@ -111,16 +69,18 @@ def main():
         leave_node(node)
         time.sleep(4)# Not to overflow the requests with leaves. 
     
-    # Check for changes in 'others' field for the remaining nodes
-    length_list_node = len(nodes)
-    others_test_passed = check_others_change(nodes, length_list_node)
+    # Poll the remaining nodes concurrently until they form the ideal ring without the nodes that left
+    remaining_nodes = [node for node in nodes if node not in nodes_to_leave]
+    converged, _, diffs = wait_for_convergence(remaining_nodes, timeout=60 + 10 * len(nodes))
 
-    if others_test_passed:
-        logging.info("Others field test passed.")
+    if converged:
+        logging.info("Ring converged without the nodes that left.")
         # Measure the total time
         end_time_e = time.time()
         total_time_e = end_time_e - start_time_e
         logging.info(f"Total time for stable leave operation: {total_time_e:.2f} seconds")
+    else:
+        report(diffs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,232 @@
+import argparse
+import bisect
+import http.client
+import logging
+import queue
+import random
+import string
+import threading
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(message)s')
+
+OPERATIONS = ("get", "put", "batch")
+
+
+class ZipfKeys:
+    """Draws keys from a fixed key space with Zipfian popularity, s=0 gives uniform keys."""
+
+    def __init__(self, num_keys, s):
+        self.keys = [f"key-{i}" for i in range(num_keys)]
+        # Shuffle so the hot keys are spread around the ring and not next to each other in hash order.
+        random.shuffle(self.keys)
+        self.cdf = []
+        total = 0.0
+        for rank in range(1, num_keys + 1):
+            total += 1.0 / rank**s
+            self.cdf.append(total)
+
+    def sample(self):
+        return self.keys[bisect.bisect_left(self.cdf, random.random() * self.cdf[-1])]
+
+
+def parse_mix(text):
+    """Parse an operation mix like 'get=0.7,put=0.25,batch=0.05' into (operations, cumulative weights)."""
+    weights = {}
+    for part in text.split(","):
+        name, weight = part.split("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation {name}, use one of {OPERATIONS}")
+        weights[name] = float(weight)
+    operations = list(weights)
+    cumulative = []
+    total = 0.0
+    for name in operations:
+        total += weights[name]
+        cumulative.append(total)
+    return operations, cumulative
+
+
+def percentile(sorted_samples, p):
+    if not sorted_samples:
+        return 0.0
+    index = min(int(p / 100.0 * len(sorted_samples)), len(sorted_samples) - 1)
+    return sorted_samples[index]
+
+
+class Recorder:
+    """Collects latencies per operation, for the current interval and for the whole run."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.interval = {name: [] for name in OPERATIONS}
+        self.total = {name: [] for name in OPERATIONS}
+        self.errors = 0
+        self.interval_errors = 0
+
+    def record(self, operation, latency, ok):
+        with self.lock:
+            self.interval[operation].append(latency)
+            self.total[operation].append(latency)
+            if not ok:
+                self.errors += 1
+                self.interval_errors += 1
+
+    def take_interval(self):
+        with self.lock:
+            samples, errors = self.interval, self.interval_errors
+            self.interval = {name: [] for name in OPERATIONS}
+            self.interval_errors = 0
+        return samples, errors
+
+
+def summarize(samples, seconds):
+    """One line per operation with throughput and p50/p99/p999 latency in milliseconds."""
+    lines = []
+    for name in OPERATIONS:
+        latencies = sorted(samples[name])
+        if not latencies:
+            continue
+        lines.append(
+            f"{name:>5}: {len(latencies) / seconds:8.1f} ops/s  "
+            f"p50 {percentile(latencies, 50) * 1000:7.1f} ms  "
+            f"p99 {percentile(latencies, 99) * 1000:7.1f} ms  "
+            f"p999 {percentile(latencies, 99.9) * 1000:7.1f} ms")
+    return lines
+
+
+class Worker(threading.Thread):
+    """One client connection per entry node, reused across requests (keep-alive when the server allows it)."""
+
+    def __init__(self, args, nodes, arrivals, recorder):
+        super().__init__(daemon=True)
+        self.args = args
+        self.nodes = nodes
+        self.arrivals = arrivals
+        self.recorder = recorder
+        self.connections = {}
+        # The ring sheds work past this deadline and answers 504, counted as an error.
+        self.headers = {"X-Timeout-Ms": str(args.deadline_ms)} if args.deadline_ms else {}
+
+    def _request(self, node, method, path, body=None):
+        connection = self.connections.get(node)
+        if connection is None:
+            connection = http.client.HTTPConnection(node, timeout=self.args.timeout)
+            self.connections[node] = connection
+        try:
+            connection.request(method, path, body=body, headers=self.headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            del self.connections[node]
+            raise
+
+    def _value(self):
+        return ''.join(random.choices(string.ascii_lowercase, k=self.args.value_size)).encode()
+
+    def run(self):
+        while True:
+            item = self.arrivals.get()
+            if item is None:
+                return
+            scheduled, operation, key = item
+            node = random.choice(self.nodes)
+            try:
+                if operation == "get":
+                    # A miss (404) is a valid answer for a key that hasn't been written yet.
+                    ok = self._request(node, "GET", f"/storage/{key}") in (200, 404)
+                elif operation == "put":
+                    ok = self._request(node, "PUT", f"/storage/{key}", self._value()) == 200
+                else:
+                    ok = all(self._request(node, "PUT", f"/storage/{key}-{i}", self._value()) == 200
+                             for i in range(self.args.batch_size))
+            except (http.client.HTTPException, OSError) as e:
+                logging.debug(f"{operation} on {node} failed: {e}")
+                ok = False
+            # Latency counts from the scheduled arrival, so time spent queued behind slow requests is included.
+            self.recorder.record(operation, time.monotonic() - scheduled, ok)
+
+
+def generate_arrivals(args, keys, mix, arrivals, stop_at):
+    """Open-loop arrivals: Poisson process at the target rate, independent of how fast the ring answers."""
+    operations, cumulative = mix
+    next_arrival = time.monotonic()
+    while next_arrival < stop_at:
+        delay = next_arrival - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        operation = operations[bisect.bisect_left(cumulative, random.random() * cumulative[-1])]
+        arrivals.put((next_arrival, operation, keys.sample()))
+        next_arrival += random.expovariate(args.rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Open-loop load generator for the DHT, reports throughput and latency percentiles.")
+    parser.add_argument("nodes", type=str, nargs='*', help="List of node addresses, defaults to nodes.txt")
+    parser.add_argument("--nodes-file", default="nodes.txt", help="File with node addresses")
+    parser.add_argument("--rate", type=float, default=200, help="Target arrival rate in operations per second")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to generate load")
+    parser.add_argument("--connections", type=int, default=32, help="Concurrent client connections")
+    parser.add_argument("--mix", type=parse_mix, default="get=0.7,put=0.25,batch=0.05",
+                        help="Operation mix, e.g. get=0.7,put=0.25,batch=0.05")
+    parser.add_argument("--keys", type=int, default=10000, help="Number of distinct keys")
+    parser.add_argument("--zipf", type=float, default=0.99, help="Zipf exponent for key popularity, 0 is uniform")
+    parser.add_argument("--value-size", type=int, default=100, help="Bytes per PUT value")
+    parser.add_argument("--batch-size", type=int, default=10, help="PUTs per batch operation")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds between progress reports")
+    parser.add_argument("--timeout", type=float, default=10, help="Per-request timeout in seconds")
+    parser.add_argument("--deadline-ms", type=int, default=None,
+                        help="Send this budget in X-Timeout-Ms, the ring gives up on requests past it")
+    args = parser.parse_args()
+
+    nodes = args.nodes
+    if not nodes:
+        with open(args.nodes_file) as f:
+            nodes = f.read().split()
+    if not nodes:
+        logging.error("No nodes given.")
+        return
+
+    keys = ZipfKeys(args.keys, args.zipf)
+    recorder = Recorder()
+    arrivals = queue.Queue()
+    workers = [Worker(args, nodes, arrivals, recorder) for _ in range(args.connections)]
+    for worker in workers:
+        worker.start()
+
+    start = time.monotonic()
+    generator = threading.Thread(target=generate_arrivals,
+                                 args=(args, keys, args.mix, arrivals, start + args.duration), daemon=True)
+    generator.start()
+    logging.info(f"Load: {args.rate} ops/s for {args.duration}s over {len(nodes)} entry nodes, "
+                 f"{args.connections} connections")
+
+    # Progress reports while the load runs and until the backlog is drained.
+    last = start
+    while generator.is_alive() or not arrivals.empty():
+        time.sleep(args.interval)
+        now = time.monotonic()
+        samples, errors = recorder.take_interval()
+        logging.info(f"t={now - start:6.1f}s backlog={arrivals.qsize()} errors={errors}")
+        for line in summarize(samples, now - last):
+            logging.info(line)
+        last = now
+
+    for _ in workers:
+        arrivals.put(None)
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - start
+
+    logging.info(f"Total over {elapsed:.1f}s, errors={recorder.errors}")
+    for line in summarize(recorder.total, elapsed):
+        logging.info(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+#!/bin/bash
+
+# Check if nodes.txt exists
+if [ ! -f nodes.txt ]; then
+  echo "nodes.txt not found! Please run the server start script first."
+  exit 1
+fi
+
+# Run the load generator against all node addresses, extra arguments are passed on (e.g. --rate 500 --duration 60)
+python3 load_test.py --nodes-file nodes.txt "$@"
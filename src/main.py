@@ -1,20 +1,1214 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import json
 import threading
 import time
 import argparse
-import http.client
 import hashlib
 import requests
+import math
+import zlib
+import base64
+import functools
+import itertools
+import heapq
+import io
+import selectors
+import http.client
+import urllib3
+import signal
 import socket
+import struct
+from multiprocessing import shared_memory
+import secrets
+import hmac
+import os
+import sys
+import traceback
+import bisect
+import random
+from collections import deque
+from urllib.parse import urlsplit, parse_qs, urlencode
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import concurrent.futures
 
 M = 16  # Indentifier.
 HASH_SPACE = 2**M
+RTT_ALPHA = 0.3  # Weight of a new RTT sample in the moving average.
+WHEEL_SLOTS = 512  # Slots in the TTL timer wheel, one per WHEEL_RESOLUTION seconds.
+WHEEL_RESOLUTION = 1.0
+IDENTITY = 'identity'  # Value encodings, names as in the HTTP Content-Encoding header.
+DEFLATE = 'deflate'
+INFLATE_CHUNK = 1 << 16  # Bytes inflated at a time when a client's deflated body is checked.
+MERKLE_DEPTH = 8  # The Merkle tree has 2^MERKLE_DEPTH leaves, each covering an equal slice of the ID space.
+IDLE_TIMEOUT = 30  # Seconds an idle keep-alive connection is kept open.
+MAX_CONNECTIONS = 256  # Open connections above this are closed after their current response.
+MAX_REQUESTS_PER_CONNECTION = 1000  # Requests served on one keep-alive connection before it is closed.
+TRACE_BUFFER = 4096  # Spans kept per node for /debug/traces, oldest are dropped first.
+PROFILE_MAX_SECONDS = 60  # Longest sampling profile /debug/profile will run.
+PROFILE_INTERVAL = 0.005  # Seconds between stack samples.
+ANTI_ENTROPY_INTERVAL = 30  # Seconds between anti-entropy rounds with the successor.
+MIN_CALL_BUDGET = 0.001  # Seconds of a deadline that must be left to call another node, X-Timeout-Ms is in whole ms.
+HANDOFF_BATCH = 500  # Most misplaced keys handed to their owners per anti-entropy round.
+MEMBERSHIP_INTERVAL = 1.0  # Seconds between membership gossip rounds.
+GOSSIP_FANOUT = 3  # Members gossiped with per round.
+GOSSIP_MAX_EVENTS = 64  # Most membership events piggybacked on one gossip message.
+RETRANSMIT_MULT = 3  # Each event is sent RETRANSMIT_MULT * log2(N) times by every node that learns it.
+SUSPECT_TIMEOUT = 5  # Seconds a suspected member has to refute before it is declared dead.
+DEAD_RETENTION = 60  # Seconds dead and left members are remembered, so old gossip can't revive them.
+MEMBERSHIP_SYNC_INTERVAL = 30  # Seconds between full membership table exchanges, which repair lost events.
+MEMBERSHIP_STALE = 5  # One-hop lookups fall back to the fingers when the last gossip round is older than this.
+HEDGE_PERCENTILE = 95  # Forwarded reads slower than this percentile of recent ones get a hedge request.
+HEDGE_WINDOW = 1000  # Recent read latencies the percentile is taken over.
+HEDGE_DEFAULT_DELAY = 0.05  # Seconds before hedging until there are enough latency samples.
+HEDGE_MIN_DELAY = 0.002  # Never hedge sooner than this.
+HEDGE_BUDGET = 0.05  # Hedges allowed per forwarded read, on average.
+HEDGE_BURST = 10  # Hedges that can be spent at once from saved up budget.
+STABILIZE_INTERVAL = 30  # Seconds between stabilize rounds, the fallback for pushed neighbour updates.
+CHECK_PREDECESSOR_INTERVAL = 30  # Seconds between predecessor checks, the fallback for pushed updates and gossip.
+SUBSCRIPTION_LEASE = 90  # Seconds a neighbour subscription lasts unless renewed by the fallback rounds.
+LOAD_WINDOW = 30  # Request rates per range are counted over the current and the previous window of this many seconds.
+MIGRATION_WINDOW = 60  # Seconds after a relocation that local read misses are looked up at the successor.
+SCAN_PAGE = 1000  # Keys per page of a /storage scan, unless the client asks for fewer.
+SCAN_MAX_PAGE = 10000  # Largest page a client can ask for.
+SCAN_CHUNK = 100  # Scan results written per chunk of the streamed response.
+FIX_FINGERS_INTERVAL = 3  # Seconds between fix_fingers rounds, each fixes one finger.
+HOST_POOL_SIZE = 256  # Threads that handle the calls between nodes in one process, in host mode.
+LOOPBACK_MAX_DEPTH = 48  # Calls between nodes in one process nested deeper than this are a routing loop, in host mode.
+HOST_MAINTENANCE_WORKERS = 8  # Threads that run the maintenance tasks of all nodes in one process, in host mode.
+ROUTING_SHM_BYTES = 1 << 20  # Shared memory for the routing state of a node in worker mode.
+ROUTING_SYNC_INTERVAL = 0.2  # Seconds between routing state publishes by the primary worker, and reloads by the others.
+WORKER_LOCAL = {'X-Worker-Local': '1'}  # Marks calls between the workers of a node, answered from the worker's own keys.
+# Worker mode: headers not passed between a client and the primary worker. Hop-by-hop headers belong to one
+# connection, the others are set again by the worker that passes the request on, or are its own to send.
+PROXY_REQUEST_SKIP = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'proxy-connection',
+                      'te', 'trailer', 'transfer-encoding', 'upgrade', 'host', 'content-length', 'x-worker-local'}
+PROXY_RESPONSE_SKIP = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-connection', 'te', 'trailer',
+                       'transfer-encoding', 'upgrade', 'content-length', 'content-type', 'content-encoding', 'date',
+                       'server', 'x-trace-id', 'x-routing-hint'}
+# Worker mode: the calls any worker answers. All others change or need the routing state and go to the primary.
+WORKER_PATHS = {'/find_successor', '/ping', '/node-info', '/predecessor', '/stats', '/load', '/merkle',
+                '/merkle/leaves', '/fetch', '/release', '/transfer', '/scan', '/storage', '/snapshot', '/import'}
+RATE_LIMITS = "storage=1000,scan=10,bulk=20,control=1,info=50"  # Requests per second per client, by endpoint class.
+RATE_BURST = 2  # A client's bucket holds this many seconds of its rate, at least one request.
+RATE_LIMIT_CLIENTS = 10000  # Token buckets kept, the least recently used are dropped first.
+MAX_CLIENT_INFLIGHT = 64  # Client requests in flight, above this new ones are shed with 503.
+MAX_NODE_INFLIGHT = 256  # Storage requests forwarded by other nodes in flight, above this new ones are shed.
+SNAPSHOT_MAGIC = b'DHTSNAP1'  # First bytes of a snapshot file, and of every /snapshot and /import body.
+# Snapshot record header: key length, encoding, version, expiry (wall clock, 0 for none), value length.
+SNAPSHOT_RECORD = struct.Struct('<HBddI')
+SNAPSHOT_ENCODINGS = (IDENTITY, DEFLATE)  # Encodings by their number in a snapshot record.
+SNAPSHOT_CHUNK = 1 << 16  # Bytes read at a time from a streamed snapshot.
+INDEX_BLOCK = 512  # Items per block of the sorted key indexes, a block is split when it grows to twice this.
+ALIVE, SUSPECT, DEAD, LEFT = 'alive', 'suspect', 'dead', 'left'  # Member states.
+STATE_RANK = {ALIVE: 0, SUSPECT: 1, DEAD: 2, LEFT: 2}  # At the same incarnation the higher rank wins.
+CLIENT, FORWARDED, MAINTENANCE = 'client', 'forwarded', 'maintenance'  # Admission lanes.
+ENDPOINT_CLASSES = ('storage', 'scan', 'bulk', 'control', 'info')  # Client endpoints, each with its own rate limit.
+# Calls between nodes that keep the ring together. They are never rate limited or shed.
+MAINTENANCE_PATHS = {'/find_successor', '/notify', '/update_successor', '/update_predecessor', '/subscribe',
+                     '/neighbours', '/gossip', '/membership', '/ping', '/predecessor', '/node-info', '/merkle',
+                     '/merkle/leaves', '/fetch', '/release', '/transfer'}
 
 
 # SHA1 hashing, for consistent hashing. Used for hashing nodes and keys.
 def hash_sha1(value: str) -> int:
-    return int(hashlib.sha1(value.encode()).hexdigest(), 16) % HASH_SPACE
+    return int.from_bytes(hashlib.sha1(value.encode()).digest(), 'big') % HASH_SPACE
+
+
+# The IP addresses a node's host name resolves to, cached. A name that doesn't resolve has none.
+@functools.lru_cache(maxsize=4096)
+def host_addresses(host):
+    try:
+        return frozenset(info[4][0] for info in socket.getaddrinfo(host, None))
+    except (socket.gaierror, UnicodeError):
+        return frozenset()
+
+
+# True if an Accept-Encoding header takes the encoding. Codings are matched as whole tokens, a q-value of 0
+# refuses one, and '*' stands for every coding the header doesn't name.
+def accepts_encoding(header, encoding):
+    wildcard = False
+    for part in (header or '').split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding == encoding:
+            return q > 0
+        if coding == '*':
+            wildcard = q > 0
+    return wildcard
+
+
+# True if the payload is one complete zlib stream. Inflated INFLATE_CHUNK bytes at a time and thrown away,
+# so checking a client's deflated body never holds more than that much of it.
+def valid_deflate(payload):
+    inflater = zlib.decompressobj()
+    data = payload
+    try:
+        while not inflater.eof:
+            if not inflater.decompress(data, INFLATE_CHUNK) and not inflater.unconsumed_tail:
+                break
+            data = inflater.unconsumed_tail
+    except zlib.error:
+        return False
+    return inflater.eof and not inflater.unused_data
+
+
+# Signs a call between nodes with the cluster secret, over the sender, method and path.
+def node_signature(secret, sender, method, path):
+    return hmac.new(secret.encode(), f"{sender} {method} {path}".encode(), hashlib.sha256).hexdigest()
+
+
+# Node ID of every node this process has heard of, by address. A node starts at hash_sha1(address),
+# but the rebalancer can move it to another ID, which then spreads with the membership events.
+NODE_IDS = {}
+
+
+def node_id_of(address):
+    node_id = NODE_IDS.get(address)
+    return hash_sha1(address) if node_id is None else node_id
+
+
+# True if value lies in the half-open ring interval [start, end), walking clockwise.
+def in_range(value, start, end):
+    if start == end:
+        return True
+    if start < end:
+        return start <= value < end
+    return value >= start or value < end
+
+
+# True if the entry (payload, encoding, version) was written after the other one. Unknown versions are never newer.
+def newer(entry, other):
+    return entry[2] is not None and other[2] is not None and entry[2] > other[2]
+
+
+# One connection pool shared by all outgoing calls, so calls between nodes reuse keep-alive connections.
+SESSION = requests.Session()
+SESSION.mount('http://', requests.adapters.HTTPAdapter(pool_connections=64, pool_maxsize=32))
+
+# Runs both reads of hedged GETs, the owner's and the hedge, while the handler thread waits for the first answer.
+# Sized for two reads of every storage request admitted with the default limits.
+HEDGE_POOL = ThreadPoolExecutor(max_workers=2 * (MAX_CLIENT_INFLIGHT + MAX_NODE_INFLIGHT), thread_name_prefix="hedge")
+
+# Host mode: handles the calls between nodes that run in the same process, see LoopbackAdapter.
+HOST_POOL = ThreadPoolExecutor(max_workers=HOST_POOL_SIZE, thread_name_prefix="loopback")
+
+# The trace the current thread is working on, set by the HTTP handler and read by outgoing calls.
+_trace = threading.local()
+
+
+def new_span_id():
+    return secrets.token_hex(8)
+
+
+def current_trace():
+    return getattr(_trace, 'trace_id', None), getattr(_trace, 'span_id', None)
+
+
+# The deadline of the request the current thread is working on (time.monotonic()), None without one.
+_deadline = threading.local()
+
+# Marks threads that handle a request. Host mode runs loopback calls made from them inline, see LoopbackAdapter.
+_serving = threading.local()
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """The request's time budget ran out before a call to another node could be made."""
+
+
+class RoutingLoop(requests.exceptions.ConnectionError):
+    """A call came back to the thread that is still waiting for its answer, in host mode where calls run inline."""
+
+
+# Seconds left until the current request's deadline, None if it has none.
+def remaining_budget():
+    at = getattr(_deadline, 'at', None)
+    return None if at is None else at - time.monotonic()
+
+
+# True once too little of the deadline is left for another call, the same point where Node._request stops calling.
+def deadline_passed():
+    budget = remaining_budget()
+    return budget is not None and budget < MIN_CALL_BUDGET
+
+
+# Wraps fn to run on another thread inside the current thread's trace and deadline.
+def in_context(fn):
+    trace_id, span_id = current_trace()
+    at = getattr(_deadline, 'at', None)
+
+    def run():
+        _trace.trace_id, _trace.span_id, _deadline.at = trace_id, span_id, at
+        try:
+            return fn()
+        finally:
+            _trace.trace_id, _trace.span_id, _deadline.at = None, None, None
+    return run
+
+
+# Sampling profiler. Takes the stack of every thread every PROFILE_INTERVAL seconds and counts
+# identical stacks, which is cheap enough to run on a live node.
+def sample_stacks(seconds):
+    own = threading.get_ident()
+    counts = {}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            # Walked by hand, traceback would read every source line through linecache on each sample.
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            key = (names.get(ident, str(ident)),) + tuple(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+        time.sleep(PROFILE_INTERVAL)
+    return counts
+
+
+# Profile in the collapsed stack format (thread;outer;...;inner count), the input of flame graph tools.
+def format_collapsed(counts):
+    return "".join(f"{';'.join(stack)} {count}\n"
+                   for stack, count in sorted(counts.items(), key=lambda item: -item[1]))
+
+
+# Profile as a table of functions by samples where they were running (self) or on the stack (total).
+def format_top(counts):
+    own, total = {}, {}
+    for stack, count in counts.items():
+        functions = [frame.rsplit(':', 1)[0] for frame in stack[1:]]
+        if functions:
+            own[functions[-1]] = own.get(functions[-1], 0) + count
+        for function in set(functions):
+            total[function] = total.get(function, 0) + count
+    samples = sum(counts.values()) or 1
+    lines = [f"{'self%':>7} {'total%':>7}  function"]
+    for function in sorted(total, key=lambda f: (-own.get(f, 0), -total[f])):
+        lines.append(f"{100 * own.get(function, 0) / samples:7.1f} {100 * total[function] / samples:7.1f}  {function}")
+    return "\n".join(lines) + "\n"
+
+
+# Live dump of what every thread is doing right now.
+def thread_dump():
+    frames = sys._current_frames()
+    sections = []
+    for thread in threading.enumerate():
+        frame = frames.get(thread.ident)
+        stack = "".join(traceback.format_stack(frame)) if frame else "  (no frame)\n"
+        sections.append(f"Thread {thread.name} (ident {thread.ident}, daemon {thread.daemon}):\n{stack}")
+    return "\n".join(sections)
+
+
+# Coalesces concurrent calls that share a key, so only one of them does the work.
+class SingleFlight:
+    """
+    Deduplicates in-flight operations. The first caller for a key runs the
+    operation, every concurrent caller with the same key waits for it and
+    gets the same result (or the same exception).
+
+    Callers can have different deadlines. A waiting caller gives up when its
+    own deadline passes, and when the first caller's deadline ran out during
+    the operation, its result says nothing about the key: a waiting caller
+    with budget left runs the operation again.
+
+    Attributes:
+        calls (dict): Key -> in-flight call (event, result, error, expired, thread of the first caller).
+        lock (threading.Lock): Guards the calls dict.
+        coalesced (int): How many callers were served by another caller's call.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'done': threading.Event(), 'result': None, 'error': None, 'expired': False,
+                        'thread': threading.get_ident()}
+                self.calls[key] = call
+            elif call['thread'] == threading.get_ident():
+                raise RoutingLoop(f"The call for {key} came back to the caller")
+            else:
+                self.coalesced += 1
+
+        # Someone else is already doing this, wait for it and share the answer.
+        if not leader:
+            budget = remaining_budget()
+            if not call['done'].wait(None if budget is None else max(budget, 0)):
+                raise DeadlineExceeded(f"Deadline passed waiting for the call in flight for {key}")
+            if call['expired'] and not deadline_passed():
+                return self.do(key, fn)
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            call['expired'] = deadline_passed()
+            with self.lock:
+                del self.calls[key]
+            call['done'].set()
+
+
+# Adaptive hedging of slow reads, see Node._hedged_get.
+class HedgePolicy:
+    """
+    Decides when a forwarded read gets a hedge request. The delay is a high percentile of recent read
+    latencies, so only the slowest few reads are duplicated. A token bucket caps the hedges at a fraction
+    of the reads: every read adds `budget` tokens, up to HEDGE_BURST, and every hedge takes one.
+    """
+
+    def __init__(self, budget=HEDGE_BUDGET, percentile=HEDGE_PERCENTILE):
+        self.lock = threading.Lock()
+        self.budget = budget
+        self.percentile = percentile
+        self.latencies = deque(maxlen=HEDGE_WINDOW)
+        self.delay = HEDGE_DEFAULT_DELAY
+        self.tokens = HEDGE_BURST
+        self.stats = {"reads": 0, "hedged": 0, "hedge_wins": 0, "stale_wins": 0, "over_budget": 0}
+
+    def on_read(self):
+        with self.lock:
+            self.stats["reads"] += 1
+            self.tokens = min(HEDGE_BURST, self.tokens + self.budget)
+
+    # Latency of a primary read. The delay is recomputed every few samples, sorting the window is not free.
+    def record(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+            if len(self.latencies) >= 20 and len(self.latencies) % 16 == 0:
+                ordered = sorted(self.latencies)
+                index = min(int(self.percentile / 100 * len(ordered)), len(ordered) - 1)
+                self.delay = max(HEDGE_MIN_DELAY, ordered[index])
+
+    def try_hedge(self):
+        with self.lock:
+            if self.tokens < 1:
+                self.stats["over_budget"] += 1
+                return False
+            self.tokens -= 1
+            self.stats["hedged"] += 1
+            return True
+
+    def hedge_won(self):
+        with self.lock:
+            self.stats["hedge_wins"] += 1
+
+    # The owner answered after a hedge won. Counts the win as stale if the owner had a newer version.
+    def owner_answered(self, hedged_entry, owner_result):
+        status, entry = owner_result
+        if status == 200 and newer(entry, hedged_entry):
+            with self.lock:
+                self.stats["stale_wins"] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, delay_ms=self.delay * 1000)
+
+
+# The rate limit class of a client request.
+def endpoint_class(path):
+    path = urlsplit(path).path
+    if path.startswith('/storage/'):
+        return 'storage'
+    if path in ('/storage', '/scan'):
+        return 'scan'
+    if path in ('/snapshot', '/import'):
+        return 'bulk'
+    if path in ('/join', '/leave', '/relocate', '/sim-crash', '/sim-recover'):
+        return 'control'
+    return 'info'
+
+
+# Parses rate limits like 'storage=1000,scan=10' into endpoint class -> requests per second.
+def parse_rates(text):
+    rates = dict.fromkeys(ENDPOINT_CLASSES, 0)
+    for part in text.split(","):
+        name, _, rate = part.partition("=")
+        if name not in ENDPOINT_CLASSES:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint class {name}, use one of {ENDPOINT_CLASSES}")
+        try:
+            rates[name] = float(rate)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Rate of {name} must be a number")
+    return rates
+
+
+# Admission control for the node API, so a storm of client requests is pushed back at the entry node
+# instead of spreading as lookups over the ring.
+class Admission:
+    """
+    Client requests take a token from the client's bucket for the endpoint class. The bucket refills at the
+    class rate and holds RATE_BURST seconds of it. Requests in flight are counted per lane: clients, storage
+    requests forwarded by other nodes, and maintenance calls. A lane at its limit sheds new requests.
+
+    Attributes:
+        rates (dict): Endpoint class -> requests per second allowed per client, 0 for no limit.
+        buckets (OrderedDict): (client, endpoint class) -> [tokens, time of the last refill], least recently used first.
+        lane_limits (dict): Lane -> most requests in flight, None for no limit.
+        inflight (dict): Lane -> requests in flight.
+    """
+
+    def __init__(self, rates=None, lane_limits=None):
+        self.lock = threading.Lock()
+        self.rates = rates if rates is not None else parse_rates(RATE_LIMITS)
+        self.buckets = OrderedDict()
+        self.lane_limits = lane_limits or {CLIENT: MAX_CLIENT_INFLIGHT, FORWARDED: MAX_NODE_INFLIGHT, MAINTENANCE: None}
+        self.inflight = dict.fromkeys(self.lane_limits, 0)
+        self.stats = {"rate_limited": dict.fromkeys(ENDPOINT_CLASSES, 0), "shed": dict.fromkeys(self.lane_limits, 0)}
+
+    # Takes a token for a client request. Returns None if there was one, else the seconds until there is.
+    def take(self, client, endpoint):
+        rate = self.rates.get(endpoint, 0)
+        if not rate:
+            return None
+        burst = max(rate * RATE_BURST, 1)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get((client, endpoint))
+            if bucket is None:
+                bucket = self.buckets[(client, endpoint)] = [burst, now]
+                if len(self.buckets) > RATE_LIMIT_CLIENTS:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end((client, endpoint))
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return None
+            self.stats["rate_limited"][endpoint] += 1
+            return (1 - bucket[0]) / rate
+
+    # Counts a request in flight on the lane, False if the lane is full.
+    def enter(self, lane):
+        with self.lock:
+            limit = self.lane_limits.get(lane)
+            if limit is not None and self.inflight[lane] >= limit:
+                self.stats["shed"][lane] += 1
+                return False
+            self.inflight[lane] += 1
+            return True
+
+    def leave(self, lane):
+        with self.lock:
+            self.inflight[lane] -= 1
+
+    def get_stats(self):
+        with self.lock:
+            return {"rates": dict(self.rates), "limits": dict(self.lane_limits), "inflight": dict(self.inflight),
+                    "rate_limited": dict(self.stats["rate_limited"]), "shed": dict(self.stats["shed"]),
+                    "clients": len(self.buckets)}
+
+
+# Hashed timer wheel for key expiry. Scheduling and cancelling is O(1), and each
+# tick only looks at the keys in one slot instead of scanning the whole store.
+class TimerWheel:
+    """
+    Tracks key deadlines in WHEEL_SLOTS buckets of WHEEL_RESOLUTION seconds.
+    Deadlines further away than one revolution stay in their slot and are
+    skipped until the wheel comes around to the right tick.
+
+    Attributes:
+        slots (list): One set of keys per slot.
+        deadlines (dict): Key -> tick when it expires.
+        cursor (int): The next tick to be processed.
+    """
+
+    def __init__(self):
+        self.slots = [set() for _ in range(WHEEL_SLOTS)]
+        self.deadlines = {}
+        self.cursor = self._tick(time.monotonic())
+
+    def _tick(self, when):
+        return int(when / WHEEL_RESOLUTION)
+
+    def schedule(self, key, expires_at):
+        self.cancel(key)
+        tick = max(self._tick(expires_at), self.cursor)
+        self.deadlines[key] = tick
+        self.slots[tick % WHEEL_SLOTS].add(key)
+
+    def cancel(self, key):
+        tick = self.deadlines.pop(key, None)
+        if tick is not None:
+            self.slots[tick % WHEEL_SLOTS].discard(key)
+
+    def is_expired(self, key, now):
+        tick = self.deadlines.get(key)
+        return tick is not None and tick < self._tick(now)
+
+    # Moves the wheel up to now and returns the keys whose deadline has passed.
+    def advance(self, now):
+        now_tick = self._tick(now)
+        expired = []
+        # A full revolution visits every slot, no need to spin more than once.
+        first = max(self.cursor, now_tick - WHEEL_SLOTS)
+        for tick in range(first, now_tick):
+            slot = self.slots[tick % WHEEL_SLOTS]
+            for key in [k for k in slot if self.deadlines[k] <= tick]:
+                slot.discard(key)
+                del self.deadlines[key]
+                expired.append(key)
+        self.cursor = max(self.cursor, now_tick)
+        return expired
+
+
+# Digest of one stored key, changes whenever the value, encoding or version changes.
+def key_digest(key, entry):
+    payload, encoding, version = entry
+    digest = hashlib.sha1(f"{key}\0{encoding}\0{version!r}\0".encode('utf-8') + payload).digest()
+    return int.from_bytes(digest, 'big')
+
+
+# Snapshot format: a record header, then the key and the value as stored. The expiry is wall clock time, so a
+# restored key keeps the deadline it had.
+def pack_entry(key, payload, encoding, version, expires_at=None):
+    key = key.encode('utf-8')
+    return SNAPSHOT_RECORD.pack(len(key), SNAPSHOT_ENCODINGS.index(encoding), version, expires_at or 0,
+                                len(payload)) + key + payload
+
+
+# The entries in a stream of snapshot records, as (key, payload, encoding, version, expires_at or None).
+def unpack_entries(stream):
+    while True:
+        header = stream.read(SNAPSHOT_RECORD.size)
+        if not header:
+            return
+        if len(header) < SNAPSHOT_RECORD.size:
+            raise ValueError("Snapshot ends inside a record")
+        key_length, encoding, version, expires_at, length = SNAPSHOT_RECORD.unpack(header)
+        key = stream.read(key_length).decode('utf-8')
+        payload = stream.read(length)
+        if len(payload) < length:
+            raise ValueError("Snapshot ends inside a record")
+        yield key, payload, SNAPSHOT_ENCODINGS[encoding], version, expires_at or None
+
+
+# Merkle tree over the ID space, updated incrementally as keys are written and removed.
+class MerkleTree:
+    """
+    Fixed-depth Merkle tree. Leaf b covers the IDs whose top MERKLE_DEPTH bits are b,
+    and holds the XOR of the digests of its keys, so adding or removing a key touches
+    one leaf and the MERKLE_DEPTH hashes above it.
+
+    Attributes:
+        buckets (list): Per leaf, key -> digest of the keys in that leaf.
+        leaves (list): Per leaf, XOR of the key digests.
+        levels (list): levels[d][i] is the hash of node i on depth d, levels[0][0] is the root.
+    """
+
+    def __init__(self):
+        self.buckets = [{} for _ in range(2**MERKLE_DEPTH)]
+        self.leaves = [0] * 2**MERKLE_DEPTH
+        self.levels = [[b''] * 2**d for d in range(MERKLE_DEPTH + 1)]
+        self.levels[MERKLE_DEPTH] = [self._leaf_hash(0)] * 2**MERKLE_DEPTH
+        for d in reversed(range(MERKLE_DEPTH)):
+            for i in range(2**d):
+                self.levels[d][i] = self._node_hash(d, i)
+
+    # A tree with the given leaf values and no keys. Used to combine the trees of the workers of a node.
+    @classmethod
+    def from_leaves(cls, leaves):
+        tree = cls()
+        tree.leaves = list(leaves)
+        tree.levels[MERKLE_DEPTH] = [tree._leaf_hash(value) for value in leaves]
+        for d in reversed(range(MERKLE_DEPTH)):
+            for i in range(2**d):
+                tree.levels[d][i] = tree._node_hash(d, i)
+        return tree
+
+    def _leaf_hash(self, value):
+        return value.to_bytes(20, 'big')
+
+    def _node_hash(self, d, i):
+        return hashlib.sha1(self.levels[d + 1][2 * i] + self.levels[d + 1][2 * i + 1]).digest()
+
+    def bucket_of(self, hashed_id):
+        return hashed_id >> (M - MERKLE_DEPTH)
+
+    # The IDs [lo, hi) covered by node i on depth d.
+    def span(self, d, i):
+        width = HASH_SPACE >> d
+        return i * width, (i + 1) * width
+
+    def add(self, key, digest):
+        b = self.bucket_of(hash_sha1(key))
+        self.buckets[b][key] = digest
+        self.leaves[b] ^= digest
+        self._update(b)
+
+    def remove(self, key):
+        b = self.bucket_of(hash_sha1(key))
+        digest = self.buckets[b].pop(key, None)
+        if digest is not None:
+            self.leaves[b] ^= digest
+            self._update(b)
+
+    # Recomputes the path from leaf b up to the root.
+    def _update(self, b):
+        self.levels[MERKLE_DEPTH][b] = self._leaf_hash(self.leaves[b])
+        i = b
+        for d in reversed(range(MERKLE_DEPTH)):
+            i //= 2
+            self.levels[d][i] = self._node_hash(d, i)
+
+    def hashes(self, d, indices):
+        return [self.levels[d][i].hex() for i in indices]
+
+    # Digests of the keys in the given leaves whose ID lies in the ring range (start, end].
+    def leaf_digests(self, leaves, start, end):
+        digests = {}
+        for b in leaves:
+            for key, digest in self.buckets[b].items():
+                if in_range(hash_sha1(key), (start + 1) % HASH_SPACE, (end + 1) % HASH_SPACE):
+                    digests[key] = format(digest, 'x')
+        return digests
+
+
+# Sorted list for the key indexes. A single sorted Python list moves half of its items on every insert,
+# which dominates writes once a node holds a few hundred thousand keys.
+class SortedIndex:
+    """
+    Sorted items kept in blocks of at most 2 * INDEX_BLOCK, with the largest item of every block in `maxes`.
+    Finding the block is a binary search over `maxes`, inserting and removing only move items inside one block.
+    """
+
+    def __init__(self):
+        self.blocks = []
+        self.maxes = []
+        self.size = 0
+
+    def add(self, item):
+        self.size += 1
+        if not self.blocks:
+            self.blocks.append([item])
+            self.maxes.append(item)
+            return
+        i = min(bisect.bisect_left(self.maxes, item), len(self.blocks) - 1)
+        block = self.blocks[i]
+        bisect.insort(block, item)
+        self.maxes[i] = block[-1]
+        if len(block) >= 2 * INDEX_BLOCK:
+            self.blocks[i:i + 1] = [block[:INDEX_BLOCK], block[INDEX_BLOCK:]]
+            self.maxes[i:i + 1] = [block[INDEX_BLOCK - 1], block[-1]]
+
+    def remove(self, item):
+        i = bisect.bisect_left(self.maxes, item)
+        if i == len(self.blocks):
+            return
+        block = self.blocks[i]
+        j = bisect.bisect_left(block, item)
+        if j == len(block) or block[j] != item:
+            return
+        del block[j]
+        self.size -= 1
+        if block:
+            self.maxes[i] = block[-1]
+        else:
+            del self.blocks[i], self.maxes[i]
+
+    # The items from the first one >= item (> item with after), in order.
+    def iter_from(self, item, after=False):
+        find = bisect.bisect_right if after else bisect.bisect_left
+        i = find(self.maxes, item)
+        if i == len(self.blocks):
+            return
+        yield from self.blocks[i][find(self.blocks[i], item):]
+        for block in self.blocks[i + 1:]:
+            yield from block
+
+    def __len__(self):
+        return self.size
+
+
+# The nodes key-value store. Keeps track of memory use, evicts the least recently
+# used keys when over quota and drops keys when their TTL runs out.
+class Storage:
+    """
+    Key-value store with a byte quota, LRU eviction and per-key TTLs. Values are
+    kept as (payload bytes, encoding, version) so compressed values stay compressed
+    at rest. The version is the write time, the newest write wins when nodes repair.
+
+    Attributes:
+        items (OrderedDict): Key -> (payload, encoding, version), least recently used first.
+        max_bytes (int): Quota for keys + values, None means unlimited.
+        used_bytes (int): Bytes currently stored.
+        wheel (TimerWheel): Expiry deadlines of keys with a TTL.
+        tree (MerkleTree): Merkle tree over the stored keys, used by anti-entropy.
+        id_index (SortedIndex): (hashed ID, key) of the stored keys, for scans in ring order.
+        key_index (SortedIndex): The stored keys, for prefix scans.
+        stats (dict): Counters for hits, misses, evictions, expirations and refused writes.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.items = OrderedDict()
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.wheel = TimerWheel()
+        self.tree = MerkleTree()
+        self.id_index = SortedIndex()
+        self.key_index = SortedIndex()
+        self.lock = threading.RLock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "evicted_bytes": 0,
+            "expirations": 0,
+            "refused_writes": 0,
+        }
+
+    def _size(self, key, entry):
+        return len(key.encode('utf-8')) + len(entry[0])
+
+    def get(self, key):
+        with self.lock:
+            if self.wheel.is_expired(key, time.monotonic()):
+                self.delete(key)
+                self.stats["expirations"] += 1
+            entry = self.items.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.items.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry
+
+    # The full (payload, encoding, version) entry, without touching LRU order or hit counters.
+    def get_entry(self, key):
+        with self.lock:
+            return self.items.get(key)
+
+    # Seconds left before the key expires, None if it has no TTL.
+    def ttl_remaining(self, key):
+        with self.lock:
+            tick = self.wheel.deadlines.get(key)
+            if tick is None:
+                return None
+            return max(tick * WHEEL_RESOLUTION - time.monotonic(), 0)
+
+    # Stores the value, evicting least recently used keys to make room. Returns False if the write is refused.
+    def put(self, key, payload, encoding=IDENTITY, ttl=None, version=None):
+        entry = (payload, encoding, time.time() if version is None else version)
+        size = self._size(key, entry)
+        with self.lock:
+            if self.max_bytes is not None and size > self.max_bytes:
+                self.stats["refused_writes"] += 1
+                return False
+            # An overwritten key keeps its place in the sorted indexes.
+            replaced = self._remove(key)
+            while self.max_bytes is not None and self.used_bytes + size > self.max_bytes:
+                evicted_key = next(iter(self.items))
+                self.stats["evicted_bytes"] += self._size(evicted_key, self.items[evicted_key])
+                self.stats["evictions"] += 1
+                self.delete(evicted_key)
+            self.items[key] = entry
+            self.used_bytes += size
+            self.tree.add(key, key_digest(key, entry))
+            if replaced is None:
+                self.id_index.add((hash_sha1(key), key))
+                self.key_index.add(key)
+            if ttl is not None:
+                self.wheel.schedule(key, time.monotonic() + ttl)
+            return True
+
+    # Stores a copy received from another node, unless the copy we have is newer.
+    def merge(self, key, payload, encoding, version, ttl=None):
+        with self.lock:
+            current = self.items.get(key)
+            if current is not None and current[2] >= version:
+                return False
+            return self.put(key, payload, encoding, ttl, version)
+
+    def delete(self, key):
+        with self.lock:
+            entry = self._remove(key)
+            if entry is not None:
+                self.id_index.remove((hash_sha1(key), key))
+                self.key_index.remove(key)
+            return entry
+
+    # Drops the entry, its TTL and its Merkle digest, but leaves the sorted indexes to the caller.
+    def _remove(self, key):
+        entry = self.items.pop(key, None)
+        self.wheel.cancel(key)
+        if entry is not None:
+            self.used_bytes -= self._size(key, entry)
+            self.tree.remove(key)
+        return entry
+
+    # Up to limit keys with a hashed ID in the ring range [start, end), in ring order from start (the whole
+    # ring when start == end). Continues after the key `after`, the last key of the previous page.
+    def scan_ids(self, start, end, after=None, limit=SCAN_PAGE):
+        segments = [(start, end)] if start < end else [(start, HASH_SPACE), (0, end)]
+        cursor = (hash_sha1(after), after) if after is not None else None
+        keys = []
+        with self.lock:
+            for lo, hi in segments:
+                if cursor is not None:
+                    # Segments before the one the cursor is in were done on earlier pages.
+                    if not lo <= cursor[0] < hi:
+                        continue
+                    items, cursor = self.id_index.iter_from(cursor, after=True), None
+                else:
+                    items = self.id_index.iter_from((lo, ''))
+                for hashed_id, key in items:
+                    if hashed_id >= hi or len(keys) >= limit:
+                        break
+                    keys.append(key)
+                if len(keys) >= limit:
+                    break
+        return keys
+
+    # Up to limit keys starting with prefix, in key order, with a hashed ID in the ring range [start, end).
+    # Continues after the key `after`.
+    def scan_prefix(self, prefix, start=0, end=0, after=None, limit=SCAN_PAGE):
+        keys = []
+        with self.lock:
+            if after is not None and after >= prefix:
+                items = self.key_index.iter_from(after, after=True)
+            else:
+                items = self.key_index.iter_from(prefix)
+            for key in items:
+                if not key.startswith(prefix) or len(keys) >= limit:
+                    break
+                if in_range(hash_sha1(key), start, end):
+                    keys.append(key)
+        return keys
+
+    # Called periodically to drop keys whose TTL has run out.
+    def expire(self):
+        with self.lock:
+            for key in self.wheel.advance(time.monotonic()):
+                if self.delete(key) is not None:
+                    self.stats["expirations"] += 1
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, keys=len(self.items), bytes=self.used_bytes,
+                        max_bytes=self.max_bytes, ttl_keys=len(self.wheel.deadlines))
+
+
+# Where in its range a node's requests land, so a rebalancer can tell a hot range from a large one.
+class RangeLoad:
+    """
+    Requests per Merkle leaf of the ID space, the same slices the anti-entropy tree uses for keys.
+    Counts go into the current window, which becomes the previous one every LOAD_WINDOW seconds,
+    so rates cover the last one to two windows.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = [0] * 2**MERKLE_DEPTH
+        self.previous = [0] * 2**MERKLE_DEPTH
+        self.started = time.monotonic()
+
+    def _rotate(self, now):
+        if now - self.started >= 2 * LOAD_WINDOW:
+            self.previous, self.current = [0] * 2**MERKLE_DEPTH, [0] * 2**MERKLE_DEPTH
+            self.started = now
+        elif now - self.started >= LOAD_WINDOW:
+            self.previous, self.current = self.current, [0] * 2**MERKLE_DEPTH
+            self.started += LOAD_WINDOW
+
+    def record(self, hashed_id):
+        with self.lock:
+            self._rotate(time.monotonic())
+            self.current[hashed_id >> (M - MERKLE_DEPTH)] += 1
+
+    # Requests per second per leaf.
+    def rates(self):
+        with self.lock:
+            now = time.monotonic()
+            self._rotate(now)
+            elapsed = LOAD_WINDOW + now - self.started
+            return [(p + c) / elapsed for p, c in zip(self.previous, self.current)]
+
+
+class Membership:
+    """
+    The full membership of the ring, sorted by node ID, kept current by SWIM style epidemic gossip.
+    Every member has an incarnation number and a state: alive, suspect, dead or left. A change is an event
+    that is piggybacked on the next gossip messages, a few times per node, so it reaches every node in
+    O(log N) rounds. The higher incarnation wins, at the same incarnation the worse state wins. Only a
+    member itself raises its incarnation, to refute a suspicion or to come back after leaving.
+    """
+
+    def __init__(self, address, node_id):
+        self.lock = threading.Lock()
+        self.address = address
+        # Address -> {'node_id', 'incarnation', 'state', 'updated' (local time of the last change)}.
+        self.members = {address: {'node_id': node_id, 'incarnation': 0, 'state': ALIVE, 'updated': time.monotonic()}}
+        self.ring = [(node_id, address)]  # Sorted (node_id, address) of the alive members.
+        self.events = {}  # Address -> [event, times sent], the events still being disseminated.
+        self.last_exchange = None
+        # Called with (address, state) after every change, outside the lock.
+        self.on_change = None
+        self.stats = {"events_sent": 0, "events_applied": 0}
+
+    def _rebuild(self):
+        self.ring = sorted((m['node_id'], address) for address, m in self.members.items() if m['state'] == ALIVE)
+
+    def _event(self, address):
+        m = self.members[address]
+        return {'address': address, 'node_id': m['node_id'], 'incarnation': m['incarnation'], 'state': m['state']}
+
+    # Sets a member and queues the change for gossip. Called with the lock held, returns the change.
+    def _set(self, address, node_id, incarnation, state):
+        self.members[address] = {'node_id': node_id, 'incarnation': incarnation, 'state': state,
+                                 'updated': time.monotonic()}
+        NODE_IDS[address] = node_id
+        self.events[address] = [self._event(address), 0]
+        self._rebuild()
+        return address, state
+
+    def _notify(self, changes):
+        if self.on_change:
+            for address, state in changes:
+                self.on_change(address, state)
+
+    # Our own state changes, announced with a new incarnation so it overrides everything said about us before.
+    # A node that was moved to another ID announces the new one.
+    def _announce(self, state, node_id=None):
+        with self.lock:
+            me = self.members[self.address]
+            node_id = me['node_id'] if node_id is None else node_id
+            change = self._set(self.address, node_id, me['incarnation'] + 1, state)
+            if state == LEFT:
+                self.last_exchange = None
+        self._notify([change])
+
+    def join(self, node_id=None):
+        self._announce(ALIVE, node_id)
+
+    def leave(self):
+        self._announce(LEFT)
+
+    # Applies events or a full table from another node, returns how many members changed.
+    def merge(self, entries):
+        changes = []
+        with self.lock:
+            for entry in entries:
+                address = entry['address']
+                known = self.members.get(address)
+                if address == self.address:
+                    # Someone suspects us or thinks we are dead: refute it with a higher incarnation.
+                    if known['state'] == ALIVE and entry['state'] != ALIVE and entry['incarnation'] >= known['incarnation']:
+                        changes.append(self._set(address, known['node_id'], entry['incarnation'] + 1, ALIVE))
+                    continue
+                if known is not None and (entry['incarnation'], STATE_RANK[entry['state']]) <= (
+                        known['incarnation'], STATE_RANK[known['state']]):
+                    continue
+                changes.append(self._set(address, entry['node_id'], entry['incarnation'], entry['state']))
+            self.stats["events_applied"] += len(changes)
+        self._notify(changes)
+        return len(changes)
+
+    # A member that didn't answer. Returns True if it was thought to be alive.
+    def suspect(self, address):
+        with self.lock:
+            member = self.members.get(address)
+            if address == self.address or member is None or member['state'] != ALIVE:
+                return False
+            change = self._set(address, member['node_id'], member['incarnation'], SUSPECT)
+        self._notify([change])
+        return True
+
+    # Suspects that haven't refuted within the timeout are dead. Dead and left members are forgotten
+    # after DEAD_RETENTION, when the events about them have long stopped circulating.
+    def expire(self, timeout=SUSPECT_TIMEOUT):
+        now = time.monotonic()
+        changes = []
+        with self.lock:
+            for address, member in list(self.members.items()):
+                if address == self.address:
+                    continue
+                if member['state'] == SUSPECT and now - member['updated'] >= timeout:
+                    changes.append(self._set(address, member['node_id'], member['incarnation'], DEAD))
+                elif member['state'] in (DEAD, LEFT) and now - member['updated'] >= DEAD_RETENTION:
+                    del self.members[address]
+                    self.events.pop(address, None)
+        self._notify(changes)
+
+    # The events to piggyback on one message, least sent first. Each is sent RETRANSMIT_MULT * log2(N) times.
+    def take_events(self, limit=GOSSIP_MAX_EVENTS):
+        with self.lock:
+            retransmits = RETRANSMIT_MULT * max(1, math.ceil(math.log2(len(self.members) + 1)))
+            queued = sorted(self.events.items(), key=lambda item: item[1][1])[:limit]
+            for address, item in queued:
+                item[1] += 1
+                if item[1] >= retransmits:
+                    del self.events[address]
+            self.stats["events_sent"] += len(queued)
+            return [event for _, (event, _) in queued]
+
+    def entries(self):
+        with self.lock:
+            return [self._event(address) for address in self.members]
+
+    # Gossip targets, suspects included so they hear about the suspicion and can refute it.
+    def reachable(self):
+        with self.lock:
+            return [address for address, m in self.members.items()
+                    if address != self.address and m['state'] in (ALIVE, SUSPECT)]
+
+    # The alive member that owns the ID: the first with a node ID >= the ID, wrapping around the ring.
+    def successor_of(self, hashed_id):
+        ring = self.ring
+        i = bisect.bisect_left(ring, (hashed_id, ''))
+        return ring[i % len(ring)][1]
+
+    # The node ID of the alive member before the ID, wrapping around the ring.
+    def predecessor_of(self, hashed_id):
+        ring = self.ring
+        i = bisect.bisect_left(ring, (hashed_id, ''))
+        return ring[i - 1][0]
+
+    # False if the table knows the member as not alive or with another node ID.
+    def agrees(self, node_id, address):
+        m = self.members.get(address)
+        return m is None or (m['state'] == ALIVE and m['node_id'] == node_id)
+
+    def record_exchange(self):
+        self.last_exchange = time.monotonic()
+
+    def is_fresh(self, max_age=MEMBERSHIP_STALE):
+        return self.last_exchange is not None and time.monotonic() - self.last_exchange < max_age
+
+    def get_stats(self):
+        with self.lock:
+            counts = {state: 0 for state in STATE_RANK}
+            for m in self.members.values():
+                counts[m['state']] += 1
+            return dict(counts, queued_events=len(self.events), fresh=self.is_fresh(), **self.stats)
+
+
+# Worker mode: the routing state of a node, written by its primary worker into shared memory and read by the others.
+class SharedRouting:
+    """
+    Seqlock over a shared memory block: an 8 byte version, an 8 byte length and the JSON of the state.
+    The version is odd while the primary writes, a reader retries if it was odd or changed while it read.
+
+    Attributes:
+        memory (SharedMemory): The block, created before the workers are forked so they all map it.
+        version (int): The last version this process wrote or read.
+    """
+    HEADER = struct.Struct('QQ')
+
+    def __init__(self, size=ROUTING_SHM_BYTES):
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+        self.HEADER.pack_into(self.memory.buf, 0, 0, 0)
+        self.version = 0
+        self.published = None
+
+    # Writes the state, unless it is the same as last time.
+    def publish(self, state):
+        data = json.dumps(state).encode('utf-8')
+        if data == self.published:
+            return
+        if self.HEADER.size + len(data) > self.memory.size:
+            print(f"Routing state of {len(data)} bytes doesn't fit in shared memory")
+            return
+        buf = self.memory.buf
+        struct.pack_into('Q', buf, 0, self.version + 1)
+        buf[self.HEADER.size:self.HEADER.size + len(data)] = data
+        struct.pack_into('Q', buf, 8, len(data))
+        self.version += 2
+        struct.pack_into('Q', buf, 0, self.version)
+        self.published = data
+
+    # The state if a new version was published since the last read, else None.
+    def read(self):
+        buf = self.memory.buf
+        while True:
+            version, length = self.HEADER.unpack_from(buf, 0)
+            if version == self.version:
+                return None
+            if version % 2:
+                time.sleep(0.001)
+                continue
+            data = bytes(buf[self.HEADER.size:self.HEADER.size + length])
+            if struct.unpack_from('Q', buf, 0)[0] == version:
+                self.version = version
+                return json.loads(data)
+
+
+# Worker mode: the processes that serve one node address together. Keys are partitioned over them by a hash of
+# the key, and each worker also listens on a private address where the others reach it directly.
+class WorkerGroup:
+    """
+    Attributes:
+        index (int): This worker. Worker 0 is the primary, it runs the routing, membership and maintenance.
+        addresses (list): Private address of every worker.
+        routing (SharedRouting): The routing state the primary publishes.
+    """
+
+    def __init__(self, index, addresses, routing):
+        self.index = index
+        self.addresses = addresses
+        self.routing = routing
+
+    def is_primary(self):
+        return self.index == 0
+
+    def partition_of(self, key):
+        return zlib.crc32(key.encode('utf-8')) % len(self.addresses)
+
+    # The private address of the worker that stores the key, None if it is this one.
+    def holder_of(self, key):
+        index = self.partition_of(key)
+        return None if index == self.index else self.addresses[index]
+
+    def others(self):
+        return [address for i, address in enumerate(self.addresses) if i != self.index]
+
+
+# Another node, as the routing state of a node refers to it.
+class Peer:
+    """
+    A reference to a remote node in the successor, predecessor and finger table. Only the local node is a Node,
+    which holds the store and everything else, so references to other nodes stay cheap to make on every lookup.
+
+    Attributes:
+        address (str): The node's address.
+        node_id (int): The node's ID on the ring.
+        crashed (bool): Always False, a remote node's state is only known from its answers.
+        has_left (bool): Always False, as crashed.
+    """
+    __slots__ = ('address', 'node_id')
+    crashed = False
+    has_left = False
+
+    def __init__(self, address, node_id=None):
+        self.address = address
+        self.node_id = node_id_of(address) if node_id is None else node_id
 
 
 # The node class.
@@ -26,7 +1220,7 @@ class Node:
         address (str): The address of the node.
         finger_table (list): The finger table for routing.
         node_id (int): The unique identifier of the node.
-        data (dict): The data stored in the nodes hash table.
+        data (Storage): The data stored in the nodes hash table.
         successor (Node): The successor node.
         predecessor (Node): The predecessor node.
         next (int): The next index for stabilization.
@@ -34,13 +1228,45 @@ class Node:
         has_left (bool): Marks if the node has left the network.
         joined_via_node(int): Address of the bootstrap node it joined via
         backup(int): Backup of the predecessor address. 
+        lookup_flights (SingleFlight): Coalesces concurrent remote lookups for the same ID.
+        get_flights (SingleFlight): Coalesces concurrent GETs for the same key.
+        rtt (dict): Address -> moving average round trip time in seconds.
+        traces (deque): Ring buffer of the latest trace spans recorded on this node.
+        debug_token (str): Bearer token for the /debug/profile and /debug/stacks calls, None disables them.
+        cluster_secret (str): Shared by all nodes, signs their calls to each other. None trusts the sender's host.
+        compress_min_bytes (int): Values at least this large are deflated, None disables compression.
+        compression_stats (dict): Bytes in and out of the compressor and CPU time spent.
+        compression_lock (threading.Lock): Guards compression_stats, updated from every handler thread.
+        anti_entropy_stats (dict): Rounds run, hashes compared and keys repaired by anti-entropy.
+        deadline_stats (dict): Calls skipped and requests failed because their deadline passed.
+        subscribers (dict): Address -> lease expiry of the neighbours that get our neighbour changes pushed.
+        subscribers_lock (threading.Lock): Guards subscribers, changed by handler threads and the push worker.
+        push_ready (threading.Condition): Wakes the push worker. Changes that come in while a push is under way
+            are coalesced into the next one, which sends the neighbours as they are then.
+        push_due (bool): A neighbour change hasn't been pushed yet.
+        push_subscribe (dict): New neighbours to subscribe to in the next push, in order of arrival.
+        push_worker (threading.Thread): Pushes our neighbour changes, started with the first change.
+        neighbour_stats (dict): Neighbour updates pushed and received, and fallback polls made.
+        hedge (bool): Hedge slow forwarded reads with a second request to the owner's successor.
+        hedge_policy (HedgePolicy): The adaptive hedge delay and the hedge budget.
+        membership (Membership): Every node in the ring, kept current by gossip of membership events.
+        one_hop (bool): Route lookups straight to the owner from the membership table instead of the fingers.
+        load (RangeLoad): Requests served as owner, per slice of the ID space.
+        migrating_until (float): Until then (time.monotonic()) local read misses are looked up at the successor,
+            which still holds keys of our range after a relocation. None when not migrating.
+        handover (Peer): During a relocation, from leaving until a successor is known again, the old successor.
+            It holds our keys then, so every lookup is answered with it. None otherwise.
+        rebalance_stats (dict): Relocations done, keys moved out and pulled in, and reads served during migration.
+        workers (WorkerGroup): The processes serving this node in worker mode, None when it runs in one process.
+        admission (Admission): Rate limits per client and endpoint, and limits of requests in flight per lane.
+        hint_stats (dict): Routing hints received, and fingers and successors they updated.
     """
 
-    def __init__(self, address):
+    def __init__(self, address, max_bytes=None, compress_min_bytes=None, node_id=None):
         self.address = address
         self.finger_table = [self] * M
-        self.node_id = hash_sha1(address)
-        self.data = {}
+        self.node_id = node_id_of(address) if node_id is None else node_id
+        self.data = Storage(max_bytes)
         self.successor = self
         self.predecessor = None
         self.next = 0
@@ -48,6 +1274,67 @@ class Node:
         self.has_left = False
         self.joined_via_node = None
         self.backup = None 
+        self.lookup_flights = SingleFlight()
+        self.get_flights = SingleFlight()
+        self.rtt = {}
+        self.traces = deque(maxlen=TRACE_BUFFER)
+        self.debug_token = None
+        self.cluster_secret = None
+        self.compress_min_bytes = compress_min_bytes
+        self.compression_lock = threading.Lock()
+        self.compression_stats = {
+            "compressed_values": 0,
+            "raw_bytes": 0,
+            "compressed_bytes": 0,
+            "compress_cpu_seconds": 0.0,
+            "decompress_cpu_seconds": 0.0,
+        }
+        self.anti_entropy_stats = {
+            "rounds": 0,
+            "hashes_compared": 0,
+            "keys_compared": 0,
+            "keys_repaired": 0,
+            "bytes_repaired": 0,
+            "keys_handed_off": 0,
+        }
+        self.deadline_stats = {
+            "expired_calls": 0,
+            "timed_out": 0,
+        }
+        self.hedge = False
+        self.hedge_policy = HedgePolicy()
+        self.subscribers = {}
+        self.subscribers_lock = threading.Lock()
+        self.push_ready = threading.Condition()
+        self.push_due = False
+        self.push_subscribe = {}
+        self.push_worker = None
+        self.neighbour_stats = {
+            "pushed": 0,
+            "received": 0,
+            "polls": 0,
+        }
+        self.membership = Membership(self.address, self.node_id)
+        self.membership.on_change = self._on_member_change
+        self.one_hop = False
+        self.last_membership_sync = time.monotonic()
+        self.load = RangeLoad()
+        self.migrating_until = None
+        self.handover = None
+        self.rebalance_stats = {
+            "relocations": 0,
+            "keys_moved_out": 0,
+            "keys_pulled": 0,
+            "migration_reads": 0,
+        }
+        self.workers = None
+        self.view_nodes = {}
+        self.admission = Admission()
+        self.hint_stats = {
+            "received": 0,
+            "fingers_updated": 0,
+            "successor_updates": 0,
+        }
 
     def create(self):
         self.successor = self
@@ -55,19 +1342,173 @@ class Node:
 
     # Initializing the finger table
     def init_finger_table(self):
-        for i in range(M):
-        # finger[k] logic from Chord paper (n + 2^K-1) mod 2^m and 1<= k <= m.
-            if 1 <= i <= M:
-                s = (self.node_id + 2**(i-1)) % HASH_SPACE
-                # Find successor and append to the nodes finger table.
-                successor = self.find_successor(s)
-                self.finger_table[i] = successor
-                print(
-                    f"Entry: {i} Node + s: {self.address} + {s}, Successor: {successor.address}, Node_ID: {successor.node_id}\n")
+        for k in range(M):
+            # finger[k] logic from Chord paper (n + 2^k) mod 2^m, same indexing as fix_fingers.
+            successor = self._select_finger(k, self.find_successor(self._finger_start(k)))
+            self.finger_table[k] = successor
+            print(
+                f"Entry: {k} Node + s: {self.address} + {self._finger_start(k)}, Successor: {successor.address}, Node_ID: {successor.node_id}\n")
+
+    def _finger_start(self, k):
+        return (self.node_id + 2**k) % HASH_SPACE
+
+    # Proximity neighbor selection. Any node in [n + 2^k, n + 2^(k+1)) is a valid finger k,
+    # so prefer the one with the lowest measured RTT over the exact successor of the start.
+    def _select_finger(self, k, exact):
+        start = self._finger_start(k)
+        end = self._finger_start(k + 1) if k + 1 < M else self.node_id
+        # No node in the interval, then the exact successor is the only correct finger.
+        if exact.node_id == self.node_id or not in_range(exact.node_id, start, end):
+            return exact
+
+        best = exact
+        best_rtt = self.rtt.get(exact.address, float('inf'))
+        for candidate in self.finger_table + [self.successor, self.predecessor]:
+            if candidate is None or candidate.node_id == self.node_id:
+                continue
+            if not in_range(candidate.node_id, start, end):
+                continue
+            candidate_rtt = self.rtt.get(candidate.address, float('inf'))
+            if candidate_rtt < best_rtt:
+                best, best_rtt = candidate, candidate_rtt
+        return best
+
+    def _record_rtt(self, address, seconds):
+        if address == self.address:
+            return
+        previous = self.rtt.get(address)
+        if previous is None:
+            self.rtt[address] = seconds
+        else:
+            self.rtt[address] = (1 - RTT_ALPHA) * previous + RTT_ALPHA * seconds
+
+    # Every call to another node goes through here. Inside a trace, the trace ID and the span of
+    # the call are passed on in headers, and the call is recorded as a span.
+    # Under a deadline the timeout is cut to the budget that is left, which is passed on in X-Timeout-Ms.
+    def _request(self, method, address, path, headers=None, timeout=10, **kwargs):
+        # Tells the receiver the call comes from a node, not a client, for admission control.
+        headers = dict(headers or {}, **{'X-From-Node': self.address})
+        if self.cluster_secret is not None:
+            headers['X-Node-Signature'] = node_signature(self.cluster_secret, self.address, method, path)
+        budget = remaining_budget()
+        if budget is not None:
+            # The receiver takes whole milliseconds and refuses a budget of 0, under one the call would be too late.
+            if deadline_passed():
+                self.deadline_stats["expired_calls"] += 1
+                raise DeadlineExceeded(f"Deadline passed before {method} {address}{path}")
+            timeout = min(timeout, budget)
+            headers['X-Timeout-Ms'] = str(int(budget * 1000))
+        trace_id, parent_id = current_trace()
+        if trace_id is None:
+            response = SESSION.request(method, f'http://{address}{path}', headers=headers, timeout=timeout, **kwargs)
+            self.absorb_hint(response.headers.get('X-Routing-Hint'))
+            return response
+
+        span_id = new_span_id()
+        headers['X-Trace-Id'] = trace_id
+        headers['X-Parent-Span'] = span_id
+        started_wall, started = time.time(), time.monotonic()
+        status = None
+        try:
+            response = SESSION.request(method, f'http://{address}{path}', headers=headers, timeout=timeout, **kwargs)
+            status = response.status_code
+            self.absorb_hint(response.headers.get('X-Routing-Hint'))
+            return response
+        except requests.exceptions.RequestException as e:
+            status = type(e).__name__
+            raise
+        finally:
+            self.record_span(trace_id, span_id, parent_id, f"call {method} {address}{path}",
+                             started_wall, time.monotonic() - started, status)
+
+    # The routing hint sent back with every response to another node: our ID and address, and those of our
+    # successor and predecessor, as 'self=<id>@<address>;successor=...;predecessor=...'.
+    def routing_hint(self):
+        hint = f"self={self.node_id}@{self.address};successor={self.successor.node_id}@{self.successor.address}"
+        if self.predecessor is not None:
+            hint += f";predecessor={self.predecessor.node_id}@{self.predecessor.address}"
+        return hint
+
+    # Refreshes the routing state from the hint on a response, without extra calls. A hinted node between
+    # the start of a finger and the finger it replaces, when no node was known in the finger's interval, is a closer
+    # successor of that start. And when the responder is our successor and its predecessor lies between us,
+    # that node is our successor now, as in stabilize.
+    def absorb_hint(self, hint):
+        if not hint or self.crashed or self.has_left or (self.workers is not None and not self.workers.is_primary()):
+            return
+        try:
+            hinted = {}
+            for part in hint.split(';'):
+                name, _, value = part.partition('=')
+                node_id, _, address = value.partition('@')
+                hinted[name] = (int(node_id) % HASH_SPACE, address)
+        except ValueError:
+            return
+        self.hint_stats["received"] += 1
+        # Membership events are the authority. A hint about a member that has left, failed or moved to another ID
+        # is older than what we know, and is left out. Nodes we haven't heard of yet are new.
+        hinted = {name: node for name, node in hinted.items() if self.membership.agrees(*node)}
+        for node_id, address in hinted.values():
+            NODE_IDS.setdefault(address, node_id)
+        nodes = [(node_id, address) for node_id, address in hinted.values() if address and address != self.address]
+
+        for k in range(M):
+            start = self._finger_start(k)
+            end = self._finger_start(k + 1) if k + 1 < M else self.node_id
+            finger = self.finger_table[k]
+            # A finger in its interval is a proximity choice, keep it.
+            if finger.node_id != self.node_id and in_range(finger.node_id, start, end):
+                continue
+            # Distances clockwise from the start, the successor of the start is the nearest node.
+            closest, distance = None, (finger.node_id - start) % HASH_SPACE
+            for node_id, address in nodes:
+                if (node_id - start) % HASH_SPACE < distance:
+                    closest, distance = (node_id, address), (node_id - start) % HASH_SPACE
+            if closest is not None:
+                self.finger_table[k] = Peer(closest[1], node_id=closest[0])
+                self.hint_stats["fingers_updated"] += 1
+
+        responder, predecessor = hinted.get('self'), hinted.get('predecessor')
+        if (responder is not None and predecessor is not None and responder[1] == self.successor.address
+                and predecessor[1] != self.address and self.successor.address != self.address
+                and in_range(predecessor[0], (self.node_id + 1) % HASH_SPACE, self.successor.node_id)):
+            self._set_successor(Peer(predecessor[1], node_id=predecessor[0]))
+            self.hint_stats["successor_updates"] += 1
+
+    def record_span(self, trace_id, span_id, parent_id, name, started, duration, status):
+        self.traces.append({
+            'trace_id': trace_id,
+            'span_id': span_id,
+            'parent_id': parent_id,
+            'node': self.address,
+            'name': name,
+            'start': started,
+            'duration_ms': duration * 1000,
+            'status': status,
+        })
+
+    def get_traces(self, trace_id=None, limit=None):
+        spans = [span for span in list(self.traces) if trace_id is None or span['trace_id'] == trace_id]
+        return spans[-limit:] if limit else spans
 
     # Finding the successor node based on the given hashed key(ID).
     def find_successor(self, hashed_key):
+        # Relocating: we have left and hold nothing, the old successor owns our old range and routes the rest.
+        handover = self.handover
+        if handover is not None:
+            return handover
+        # One-hop mode: the owner comes straight from the membership table, as long as gossip keeps it current.
+        if self.one_hop and self.membership.is_fresh():
+            return Peer(self.membership.successor_of(hashed_key))
 
+        # A key with our own ID is ours, the range (predecessor, node_id] ends with it.
+        if hashed_key == self.node_id:
+            return self
+        # So is the rest of the range, once we know where it starts. Otherwise, right after a relocation, we and
+        # our new successor could each route the keys of our new range to the other.
+        start = self._range_start()
+        if start is not None and in_range(hashed_key, (start + 1) % HASH_SPACE, (self.node_id + 1) % HASH_SPACE):
+            return self
         # If the hashed_key is in the range (node_id, successor.node_id], this is the successor and return it
         if self.node_id < hashed_key <= self.successor.node_id:
             return self.successor
@@ -85,79 +1526,240 @@ class Node:
             if closest_preceding == self:
                 return self.successor
 
-            # Sending POST request to the closest preceding node to find the successor with the id.
-            response = requests.post(
-                f'http://{closest_preceding.address}/find_successor',
-                json={'hashed_key': hashed_key}, timeout=10
-            )
-            if response.status_code == 200:
-                successor_data = response.json()
-                print(
-                    f"POST Successor found: {successor_data['node_address']}")
-                return Node(successor_data['node_address'])
-            else:
-                return self.successor
+            # Concurrent lookups for the same ID share one request to the closest preceding node.
+            return self.lookup_flights.do(
+                hashed_key, lambda: self._remote_find_successor(closest_preceding, hashed_key))
+
+    # Where our range (start, node_id] starts: the predecessor's ID. Right after a relocation, until the new
+    # predecessor has notified us, the member before us in the membership table. None if not known.
+    def _range_start(self):
+        predecessor = self.predecessor
+        if predecessor is not None:
+            return predecessor.node_id
+        if self._migrating():
+            return self.membership.predecessor_of(self.node_id)
+        return None
+
+    def _remote_find_successor(self, closest_preceding, hashed_key):
+        # Sending POST request to the closest preceding node to find the successor with the id.
+        started = time.monotonic()
+        response = self._request(
+            'POST', closest_preceding.address, '/find_successor',
+            json={'hashed_key': hashed_key}, timeout=10
+        )
+        self._record_rtt(closest_preceding.address, time.monotonic() - started)
+        if response.status_code == 200:
+            successor_data = response.json()
+            print(
+                f"POST Successor found: {successor_data['node_address']}")
+            return Peer(successor_data['node_address'], node_id=successor_data['node_id'])
+        elif response.status_code == 504:
+            raise DeadlineExceeded(f"Lookup at {closest_preceding.address} ran out of time")
+        else:
+            return self.successor
 
     def _closest_preceding_node(self, hashed_key):
-        # Searches in the finger table in reverse for the highest node that precedes hashed_key
-        # print(f"Finding closest preceding node for key: {hashed_key}")
+        # Searches in the finger table in reverse for the nodes that precede hashed_key, highest first
+        candidates = []
         for finger in reversed(self.finger_table):
-            # print(
-            #     f"Checking finger: {finger.address} with ID: {finger.node_id}")
             if self.node_id < finger.node_id < hashed_key:
-                # print(
-                #     f"Finger {finger.address} is between {self.node_id} and {hashed_key}")
-                return finger
+                candidates.append(finger)
             elif self.node_id > hashed_key and (finger.node_id > self.node_id or finger.node_id < hashed_key):
-                # print(
-                #     f"Finger {finger.address} wraps around and is between {self.node_id} and {hashed_key}")
-                return finger
-        print("No suitable finger found, returning self")
-        return self
+                candidates.append(finger)
+        if not candidates:
+            print("No suitable finger found, returning self")
+            return self
+        # Without latency measurements the highest preceding finger is the best guess (plain Chord).
+        if not self.rtt:
+            return candidates[0]
+
+        # Weigh progress against latency: cost is the RTT to the finger plus the hops still left
+        # from it, estimated from the distance to the key and the average gap between nodes.
+        mean_rtt = sum(self.rtt.values()) / len(self.rtt)
+        gap = max((self.successor.node_id - self.node_id) % HASH_SPACE, 1)
+
+        def cost(finger):
+            remaining = (hashed_key - finger.node_id) % HASH_SPACE
+            hops_left = math.log2(1 + remaining / gap)
+            return self.rtt.get(finger.address, mean_rtt) + hops_left * mean_rtt
+
+        return min(candidates, key=cost)
 
     # Join when node joins network.
+    # Returns True if the node joined the ring.
     def join(self, join_address):
         self.has_left = False
         self.joined_via_node = join_address
         # Not smart to join itself.
         if self.address == join_address:
             print("Node is attempting to join itself; no action taken.")
-            return
+            return False
 
         # Get the node object and use it for joining to the correct network.
         try:
-            connection = http.client.HTTPConnection(join_address)
-            connection.request("GET", "/node-info")
-            response = connection.getresponse()
+            response = self._request('GET', join_address, '/node-info')
 
-            if response.status == 200:
-                data = json.loads(response.read().decode("utf-8"))
-                joined_node = Node(data['node_address'])
-                self.successor = joined_node.find_successor(self.node_id)
-                self.predecessor = None
+            if response.status_code == 200:
+                data = response.json()
+                joined_node = Peer(data['node_address'], node_id=data['node_hash'])
+                self._set_predecessor(None)
+                # The bootstrap node is the first successor, stabilize and the membership events move it into place.
+                self._set_successor(joined_node)
+                # From now on lookups go through the new successor, no longer through the one we handed over to.
+                self.handover = None
 
                 if self.successor.node_id == self.node_id:
                     print("Successor cannot be the same as current node.")
-                    return
+                    return False
+
+                # Announce the join with a new incarnation and take the full membership from the bootstrap node.
+                self.membership.join(self.node_id)
+                self._exchange_membership(join_address)
 
-                # Notify successor and stabilize and intialize finger table. Node has now joined network. Populates finger table with correct entries.
+                # Notify successor and intialize finger table. Node has now joined network. Populates finger table with correct entries.
+                # The successor pushes its new predecessor (us) to its subscribers, so our predecessor learns about us right away.
                 self._notify_successor()
-                self.stabilize()
                 self.init_finger_table()
-            else:
-                print(f"Join request failed with status {response.status}")
+                return True
+            print(f"Join request failed with status {response.status_code}")
         except Exception as e:
             print(f"Error during join: {str(e)}")
+        return False
 
     def _notify_successor(self):
-        requests.post(f'http://{self.successor.address}/notify', json={
+        self._notify(self.successor.address)
+
+    def _notify(self, address):
+        self._request('POST', address, '/notify', json={
             'node': {'node_id': self.node_id, 'node_address': self.address}
         }, timeout=10)
 
+    # Every change of successor or predecessor goes through these two. The change is pushed to our
+    # subscribers, and we subscribe to the new neighbour, so nobody has to poll to notice it.
+    def _set_successor(self, node):
+        previous = self.successor
+        self.successor = node
+        if previous is None or previous.address != node.address:
+            self._neighbours_changed(node)
+
+    def _set_predecessor(self, node):
+        previous = self.predecessor
+        self.predecessor = node
+        if (previous.address if previous else None) != (node.address if node else None):
+            self._neighbours_changed(node)
+
+    def _neighbours_changed(self, new_neighbour):
+        # A crashed or left node tells nobody anything.
+        if self.crashed or self.has_left:
+            return
+        with self.push_ready:
+            if new_neighbour is not None and new_neighbour.address != self.address:
+                self.push_subscribe[new_neighbour.address] = True
+            self.push_due = True
+            if self.push_worker is None:
+                self.push_worker = threading.Thread(target=self._push_loop, name="push_neighbours", daemon=True)
+                self.push_worker.start()
+            self.push_ready.notify()
+
+    # The push worker: one push at a time, of all the changes made since the last one.
+    def _push_loop(self):
+        while True:
+            with self.push_ready:
+                while not self.push_due:
+                    self.push_ready.wait()
+                subscribe, self.push_due, self.push_subscribe = list(self.push_subscribe), False, {}
+            try:
+                self._push_neighbours(subscribe)
+            except Exception as e:
+                print(f"Pushing neighbours failed: {e}")
+
+    def _neighbours(self):
+        return {
+            'node': self.address,
+            'predecessor': self.predecessor.address if self.predecessor else None,
+            'successor': self.successor.address,
+        }
+
+    def _push_neighbours(self, subscribe):
+        if self.crashed or self.has_left:
+            return
+        update = self._neighbours()
+        now = time.monotonic()
+        with self.subscribers_lock:
+            for address in [address for address, expires in self.subscribers.items() if expires < now]:
+                del self.subscribers[address]
+            targets = list(self.subscribers)
+        for address in targets:
+            try:
+                response = self._request('POST', address, '/neighbours', json=update, timeout=5)
+                self.neighbour_stats["pushed"] += 1
+                # No longer one of its neighbours, it doesn't want our updates any more.
+                if response.status_code == 200 and not response.json()['subscribed']:
+                    with self.subscribers_lock:
+                        self.subscribers.pop(address, None)
+            except requests.exceptions.RequestException as e:
+                print(f"Pushing neighbours to {address} failed: {e}")
+        # Subscribe to the new neighbours that still are, their answers are handled like pushed updates.
+        for address in subscribe:
+            if address not in (self.successor.address, self.predecessor.address if self.predecessor else None):
+                continue
+            neighbours = self._subscribe(address)
+            if neighbours is not None:
+                self.on_neighbours(neighbours)
+
+    # Subscribes to a node's neighbour changes, or renews the lease. Returns its current neighbours,
+    # None if it doesn't answer.
+    def _subscribe(self, address):
+        try:
+            started = time.monotonic()
+            response = self._request('POST', address, '/subscribe', json={'node': self.address}, timeout=10)
+            if response.status_code == 200:
+                self._record_rtt(address, time.monotonic() - started)
+                return response.json()
+            return None
+        except requests.exceptions.RequestException:
+            self.rtt.pop(address, None)
+            return None
+
+    # Another node subscribes to our neighbour changes.
+    def subscribe(self, address):
+        with self.subscribers_lock:
+            self.subscribers[address] = time.monotonic() + SUBSCRIPTION_LEASE
+        return self._neighbours()
+
+    # The neighbours of our successor or predecessor, pushed by it or in answer to a subscription.
+    # Does what stabilize does with the polled predecessor of the successor, without the polling.
+    # Returns False if the sender is neither, then we are no longer interested in its updates.
+    def on_neighbours(self, update):
+        if self.crashed or self.has_left:
+            return False
+        self.neighbour_stats["received"] += 1
+        try:
+            if update['node'] == self.successor.address:
+                x = update['predecessor']
+                # A node joined between us and our successor: it is our successor now.
+                if x is not None and x != self.address and in_range(
+                        node_id_of(x), (self.node_id + 1) % HASH_SPACE, self.successor.node_id):
+                    self._set_successor(Peer(x))
+                # Our successor has no or the wrong predecessor, tell it about us.
+                elif x != self.address:
+                    self._notify_successor()
+            elif self.predecessor is not None and update['node'] == self.predecessor.address:
+                y = update['successor']
+                # Our predecessor skips us, tell it about us. A node between it and us will notify us itself.
+                if y != self.address and not in_range(
+                        node_id_of(y), (self.predecessor.node_id + 1) % HASH_SPACE, self.node_id):
+                    self._notify(self.predecessor.address)
+            else:
+                return False
+        except requests.exceptions.RequestException as e:
+            print(f"Error handling neighbour update from {update['node']}: {e}")
+        return True
+
     # This is called periodcally for checking if the predecessor or the successor is the right one for the node.
     # And then updates it to correct successor and predecessor. It keeps the chord ring circular.
     def notify(self, node):
-        incoming_node = Node(node['node_address'])
+        incoming_node = Peer(node['node_address'], node_id=node.get('node_id'))
         # print(f"Notify called with node: {incoming_node.address}")
 
         # Check and update predecessor (also checks wrap-around case)
@@ -167,7 +1769,7 @@ class Node:
              (incoming_node.node_id < self.node_id or incoming_node.node_id > self.predecessor.node_id))
         ):
             # print(f"Updating predecessor to: {incoming_node.address}")
-            self.predecessor = incoming_node
+            self._set_predecessor(incoming_node)
 
         # Updates successor if necessary (also checks wrap-around case)
         if self.successor.node_id == self.node_id or (
@@ -178,37 +1780,23 @@ class Node:
                 incoming_node.node_id > self.node_id or incoming_node.node_id < self.successor.node_id)
         ):
             # print(f"Updating successor to: {incoming_node.address}")
-            self.successor = incoming_node
+            self._set_successor(incoming_node)
 
-    # This is called periodcally and manually to update the sucessor for each node with information.
+    # This is called periodcally to update the sucessor for each node with information. Neighbour changes are pushed
+    # (see on_neighbours), so this is only the slow fallback: it renews our subscription at the successor, which answers
+    # with its neighbours, and handles them like a pushed update.
     def stabilize(self):
-        try:
-            # Checking if the current successor is alive or if it has left network.
-            if not self._ping_alive(self.successor.address) or self.successor.has_left is True:
-                print(
-                    f"Successor {self.successor.address} is not responding, updating successor.")
-                # Find the next available node in the finger table or reset to itself
-                self.successor = self._find_next_active_node()
-
-            if self.successor.address != self.address:
-                # Get details from the sucessor predecessor its id and address to determiner if close neighbour
-                response = requests.get(
-                    f'http://{self.successor.address}/predecessor', timeout=10)
-                if response.status_code == 200:
-                    pred_data = response.json()
-                    if pred_data:
-                        x = Node(pred_data['node_address'])
-                        # Check if the predecessor of the successor is closer
-                        if (self.node_id < x.node_id < self.successor.node_id) or (
-                            self.node_id > self.successor.node_id and (
-                                x.node_id > self.node_id or x.node_id < self.successor.node_id)
-                        ):  
-                            # Set it as the successor when passed.
-                            self.successor = x
-                # Notify the successor
-                self._notify_successor()
-        except requests.exceptions.RequestException as e:
-            print(f"Error during stabilization: {e}")
+        if self.crashed or self.has_left or self.successor.address == self.address:
+            return
+        self.neighbour_stats["polls"] += 1
+        neighbours = self._subscribe(self.successor.address)
+        if neighbours is None:
+            print(
+                f"Successor {self.successor.address} is not responding, updating successor.")
+            # Find the next available node in the finger table or reset to itself
+            self._set_successor(self._find_next_active_node())
+            return
+        self.on_neighbours(neighbours)
 
     def _find_next_active_node(self):
         # Attempt to find the next active node from the finger table
@@ -218,47 +1806,455 @@ class Node:
         # If no active node is found, the node points to itself
         return self
 
-    # Follows chord paper
-    # This method is called periodcally by every node to fix their finger tables entries. 
-    # This is because when node join or leave network they should update their finger table for correct routing. 
-    def fix_fingers(self):
-        # If node is crashed, we cant do anything with that. 
-        if self.crashed is not True:
-            self.next += 1
-            if self.next > (M):
-                self.next = 1
-            finger_index = (self.node_id + 2 ** (self.next-1)) % HASH_SPACE # finding the correct index in the finger table
-            new_successor = self.find_successor(finger_index) # Find the correct sucessor 
-            # If the new sucessor is a node that has left or is crshed we need to remove it from entries, we don't want other nodes to have it in the finger table. 
-            if new_successor.has_left or new_successor.crashed:
+    # Follows chord paper
+    # This method is called periodcally by every node to fix their finger tables entries. 
+    # This is because when node join or leave network they should update their finger table for correct routing. 
+    def fix_fingers(self):
+        # If node is crashed, we cant do anything with that. 
+        # Fingers found while relocating would all be the old successor, join sets them afterwards.
+        if self.crashed is not True and self.handover is None:
+            self.next += 1
+            if self.next > (M):
+                self.next = 1
+            finger_index = self._finger_start(self.next - 1) # finding the correct index in the finger table
+            new_successor = self.find_successor(finger_index) # Find the correct sucessor 
+            # If the new sucessor is a node that has left or is crshed we need to remove it from entries, we don't want other nodes to have it in the finger table. 
+            if new_successor.has_left or new_successor.crashed:
+                return
+            # print(
+            #     f"Node {self.address} updating finger table entry {self.next - 1} with successor: {new_successor.address}")
+            # Inserting it to finger table. Successor changes are pushed, no need to stabilize here.
+            self.finger_table[self.next - 1] = self._select_finger(self.next - 1, new_successor)
+    
+    # Follows chord paper. 
+    # This method is called periodcally by every node to check if their predecessor is alive, if not it should be set to none. 
+    # Gossip clears a failed predecessor much sooner, this is the fallback. It also renews our subscription there.
+    def check_predecessor(self):
+        if self.predecessor is None or self.crashed or self.has_left:
+            return
+        self.neighbour_stats["polls"] += 1
+        neighbours = self._subscribe(self.predecessor.address)
+        if neighbours is None:
+            print(
+                f"Predecessor {self.predecessor.address} is not responding, clearing predecessor.")
+            self._set_predecessor(None)
+        else:
+            self.on_neighbours(neighbours)
+
+    # Follows the Dynamo style anti-entropy. Called periodically to compare the keys in our range (predecessor, self]
+    # with the successor, which holds them while a node joins or recovers. Only the subtrees whose hashes differ are
+    # walked, and only the keys that differ are pulled, so the traffic follows the amount of divergence.
+    # Keys we hold outside our range are then handed to their owners.
+    def anti_entropy(self):
+        if self.crashed or self.has_left or self.predecessor is None or self.successor.address == self.address:
+            return
+        # In worker mode the primary syncs the keys of all workers, and each worker hands off its own misplaced keys.
+        if self.workers is None or self.workers.is_primary():
+            self._sync_with_successor()
+        self._hand_off_misplaced()
+
+    # Pulls the keys in our range that differ from the successor's copy. Returns how many keys differed.
+    def _sync_with_successor(self):
+        peer = self.successor.address
+        start, end = self.predecessor.node_id, self.node_id
+        try:
+            leaves = self._merkle_diff(peer, start, end)
+            self.anti_entropy_stats["rounds"] += 1
+            if not leaves:
+                return 0
+            response = self._request('POST', peer, '/merkle/leaves', json={
+                'start': start, 'end': end, 'leaves': leaves}, timeout=10)
+            response.raise_for_status()
+            remote = response.json()['digests']
+            local = self.leaf_digests(leaves, start, end)
+            self.anti_entropy_stats["keys_compared"] += len(remote) + len(local)
+            wanted = [key for key, digest in remote.items() if local.get(key) != digest]
+            if not wanted:
+                return 0
+            # The keys belong to us. Once we have stored them, the successor drops the versions we took.
+            for i in range(0, len(wanted), HANDOFF_BATCH):
+                response = self._request('POST', peer, '/fetch', json={'keys': wanted[i:i + HANDOFF_BATCH]}, timeout=10)
+                response.raise_for_status()
+                items = response.json()['items']
+                stored, stored_bytes = self.import_items(items)
+                self.anti_entropy_stats["keys_repaired"] += stored
+                self.anti_entropy_stats["bytes_repaired"] += stored_bytes
+                response = self._request('POST', peer, '/release', json={
+                    'versions': {item['key']: item['version'] for item in items}, 'taken_by': self.address},
+                    timeout=10)
+                if response.status_code != 200:
+                    print(f"Release of handed over keys on {peer} failed with status {response.status_code}")
+            print(f"Anti-entropy with {peer}: {len(wanted)} keys differed")
+            return len(wanted)
+        # A crashed or overloaded successor can answer with an error body instead of failing the call.
+        except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+            print(f"Error during anti-entropy: {e!r}")
+            return 0
+
+    # Sends keys outside our range (predecessor, self] to the node that owns them, and drops our copy once it has them.
+    def _hand_off_misplaced(self):
+        arc_start, arc_end = (self.predecessor.node_id + 1) % HASH_SPACE, (self.node_id + 1) % HASH_SPACE
+        misplaced = []
+        with self.data.lock:
+            # Only leaves that are not fully inside our range can hold misplaced keys.
+            for b in range(2**MERKLE_DEPTH):
+                if len(misplaced) >= HANDOFF_BATCH:
+                    break
+                if self._span_relation(MERKLE_DEPTH, b, arc_start, arc_end) == 'inside':
+                    continue
+                misplaced += [key for key in self.data.tree.buckets[b]
+                              if not in_range(hash_sha1(key), arc_start, arc_end)]
+
+        by_owner = {}
+        for key in misplaced[:HANDOFF_BATCH]:
+            try:
+                owner = self.find_successor(hash_sha1(key))
+            except requests.exceptions.RequestException as e:
+                print(f"Error finding owner of misplaced key {key}: {e}")
+                continue
+            if owner.node_id != self.node_id:
+                by_owner.setdefault(owner.address, []).append(key)
+
+        for owner, keys in by_owner.items():
+            try:
+                handed_off = self._transfer_keys(owner, keys)
+            except requests.exceptions.RequestException as e:
+                print(f"Error handing off keys to {owner}: {e}")
+                continue
+            self.anti_entropy_stats["keys_handed_off"] += len(handed_off)
+            print(f"Handed off {len(handed_off)} misplaced keys to {owner}")
+
+    # Sends keys to another node with /transfer, HANDOFF_BATCH at a time. With drop, our copies are deleted once
+    # it has them. Returns key -> version of the entries it took.
+    def _transfer_keys(self, address, keys, drop=True):
+        sent = {}
+        for i in range(0, len(keys), HANDOFF_BATCH):
+            items = self._export_items(keys[i:i + HANDOFF_BATCH])
+            response = self._request('POST', address, '/transfer', json={'items': items}, timeout=10)
+            if response.status_code != 200:
+                print(f"Transfer to {address} failed with status {response.status_code}")
+                break
+            batch = {item['key']: item['version'] for item in items}
+            if drop:
+                self._drop_copies(batch)
+            sent.update(batch)
+        return sent
+
+    # Deletes keys another node has taken over, unless they were overwritten while they were on the way.
+    # Returns how many were deleted.
+    def _drop_copies(self, versions):
+        dropped = 0
+        with self.data.lock:
+            for key, version in versions.items():
+                entry = self.data.get_entry(key)
+                if entry is not None and entry[2] == version:
+                    self.data.delete(key)
+                    dropped += 1
+        return dropped
+
+    # Stored entries as JSON items, the format of the fetch and transfer calls.
+    def _export_items(self, keys):
+        items = []
+        for key in keys:
+            entry = self.data.get_entry(key)
+            if entry is None:
+                continue
+            items.append({
+                'key': key,
+                'value': base64.b64encode(entry[0]).decode('ascii'),
+                'encoding': entry[1],
+                'version': entry[2],
+                'ttl': self.data.ttl_remaining(key),
+            })
+        return items
+
+    # Stores items from the fetch and transfer calls, the newest version of a key wins. In worker mode each item
+    # goes to the worker that holds its key, own only stores in this worker. Returns how many keys and payload bytes
+    # were stored.
+    def import_items(self, items, own=False):
+        if self.workers is not None and not own:
+            stored, stored_bytes = 0, 0
+            for address, part in self._by_worker(items, lambda item: item['key']).items():
+                if address is None:
+                    counts = self.import_items(part, own=True)
+                else:
+                    answer = self._worker_call(address, '/transfer', {'items': part})
+                    counts = answer['stored'], answer['bytes']
+                stored, stored_bytes = stored + counts[0], stored_bytes + counts[1]
+            return stored, stored_bytes
+        stored, stored_bytes = 0, 0
+        for item in items:
+            payload = base64.b64decode(item['value'])
+            if self.data.merge(item['key'], payload, item['encoding'], item['version'], item['ttl']):
+                stored += 1
+                stored_bytes += len(payload)
+        return stored, stored_bytes
+
+    # Snapshot records of the entries with IDs in [start, end), SCAN_MAX_PAGE keys per chunk. In worker mode the
+    # records of the other workers follow, streamed from them. Own only reads this worker.
+    def snapshot_chunks(self, start, end, own=False):
+        yield SNAPSHOT_MAGIC
+        after = None
+        while True:
+            keys, after = self.scan_local(start, end, None, after, SCAN_MAX_PAGE)
+            records = []
+            for key in keys:
+                entry, ttl = self.data.get_entry(key), self.data.ttl_remaining(key)
+                if entry is not None:
+                    records.append(pack_entry(key, *entry, time.time() + ttl if ttl is not None else None))
+            yield b''.join(records)
+            if after is None:
+                break
+        if self.workers is None or own:
+            return
+        for address in self.workers.others():
+            response = self._request('GET', address, f"/snapshot?start={start}&end={end}", headers=WORKER_LOCAL,
+                                     timeout=30, stream=True)
+            response.raise_for_status()
+            # Leave out the other worker's magic, the records follow ours.
+            body = response.iter_content(SNAPSHOT_CHUNK)
+            head = b''
+            for chunk in body:
+                head += chunk
+                if len(head) >= len(SNAPSHOT_MAGIC):
+                    break
+            yield head[len(SNAPSHOT_MAGIC):]
+            yield from body
+
+    # Merges snapshot records, the newest version of a key wins and keys that expired meanwhile are skipped.
+    # In worker mode each record goes to the worker that holds its key, own only stores in this worker.
+    # Returns how many keys and payload bytes were stored, and how many records were skipped.
+    def import_snapshot(self, records, own=False):
+        stored, stored_bytes, skipped = 0, 0, 0
+        parts = {}
+        now = time.time()
+        for key, payload, encoding, version, expires_at in records:
+            holder = self.workers.holder_of(key) if self.workers is not None and not own else None
+            if holder is not None:
+                parts.setdefault(holder, [SNAPSHOT_MAGIC]).append(pack_entry(key, payload, encoding, version, expires_at))
+            elif expires_at is not None and expires_at <= now:
+                skipped += 1
+            elif self.data.merge(key, payload, encoding, version, expires_at - now if expires_at else None):
+                stored += 1
+                stored_bytes += len(payload)
+            else:
+                skipped += 1
+        for address, part in parts.items():
+            response = self._request('POST', address, '/import', headers=WORKER_LOCAL, data=b''.join(part), timeout=60)
+            response.raise_for_status()
+            counts = response.json()
+            stored, stored_bytes, skipped = (stored + counts['stored'], stored_bytes + counts['bytes'],
+                                             skipped + counts['skipped'])
+        return stored, stored_bytes, skipped
+
+    # Reads stored entries for the fetch call. In worker mode each key is read from the worker that holds it,
+    # own only reads this worker.
+    def fetch_items(self, keys, own=False):
+        if self.workers is not None and not own:
+            items = []
+            for address, part in self._by_worker(keys, lambda key: key).items():
+                if address is None:
+                    items += self.fetch_items(part, own=True)
+                else:
+                    items += self._worker_call(address, '/fetch', {'keys': part})['items']
+            return items
+        return self._export_items(keys)
+
+    # Drops the copies our predecessor taken_by has fetched and stored, key -> version it took. Keys in our own
+    # range, and keys written since, are kept. In worker mode each key is dropped by the worker that holds it, own
+    # only drops in this worker. Returns how many copies were dropped.
+    def release_items(self, versions, taken_by, own=False):
+        if self.workers is not None and not own:
+            dropped = 0
+            for address, part in self._by_worker(list(versions), lambda key: key).items():
+                part = {key: versions[key] for key in part}
+                if address is None:
+                    dropped += self.release_items(part, taken_by, own=True)
+                else:
+                    dropped += self._worker_call(address, '/release', {'versions': part, 'taken_by': taken_by})['dropped']
+            return dropped
+        if self.predecessor is None or self.predecessor.address != taken_by:
+            return 0
+        arc_start, arc_end = (self.predecessor.node_id + 1) % HASH_SPACE, (self.node_id + 1) % HASH_SPACE
+        return self._drop_copies({key: version for key, version in versions.items()
+                                  if not in_range(hash_sha1(key), arc_start, arc_end)})
+
+    # Merkle tree hashes on a level. In worker mode the leaves of all workers are combined, as XOR of their key
+    # digests they add up to the leaves of one tree over all keys. Own only hashes this worker's tree.
+    def tree_hashes(self, level, indices, own=False):
+        with self.data.lock:
+            if self.workers is None or own:
+                return self.data.tree.hashes(level, indices)
+            leaves = list(self.data.tree.leaves)
+        every_leaf = list(range(2**MERKLE_DEPTH))
+        for address in self.workers.others():
+            hashes = self._worker_call(address, '/merkle', {'level': MERKLE_DEPTH, 'indices': every_leaf})['hashes']
+            for b, value in enumerate(hashes):
+                leaves[b] ^= int(value, 16)
+        return MerkleTree.from_leaves(leaves).hashes(level, indices)
+
+    # Key digests in the given Merkle leaves, limited to (start, end]. Of all workers, unless own.
+    def leaf_digests(self, leaves, start, end, own=False):
+        with self.data.lock:
+            digests = self.data.tree.leaf_digests(leaves, start, end)
+        if self.workers is not None and not own:
+            for address in self.workers.others():
+                digests.update(self._worker_call(address, '/merkle/leaves', {
+                    'start': start, 'end': end, 'leaves': leaves})['digests'])
+        return digests
+
+    # Worker mode: groups items by the private address of the worker that holds their key, None for this worker.
+    def _by_worker(self, items, key_of):
+        groups = {}
+        for item in items:
+            groups.setdefault(self.workers.holder_of(key_of(item)), []).append(item)
+        return groups
+
+    # Worker mode: a call to another worker of this node, answered from that worker's own keys.
+    def _worker_call(self, address, path, body=None):
+        if body is None:
+            response = self._request('GET', address, path, headers=WORKER_LOCAL, timeout=10)
+        else:
+            response = self._request('POST', address, path, headers=WORKER_LOCAL, json=body, timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+    # Walks the Merkle tree top down, level by level, and returns the leaves that differ from the peer in (start, end].
+    def _merkle_diff(self, peer, start, end):
+        arc_start, arc_end = (start + 1) % HASH_SPACE, (end + 1) % HASH_SPACE
+        frontier = [0]
+        for depth in range(MERKLE_DEPTH + 1):
+            inside, differing = [], []
+            for i in frontier:
+                relation = self._span_relation(depth, i, arc_start, arc_end)
+                if relation == 'inside':
+                    inside.append(i)
+                elif relation == 'partial':
+                    # Nodes that cut the range boundary hash keys outside it too, so always look closer.
+                    differing.append(i)
+            if inside:
+                response = self._request('POST', peer, '/merkle', json={
+                    'level': depth, 'indices': inside}, timeout=10)
+                response.raise_for_status()
+                remote = response.json()['hashes']
+                local = self.tree_hashes(depth, inside)
+                self.anti_entropy_stats["hashes_compared"] += len(inside)
+                differing += [i for i, r, l in zip(inside, remote, local) if r != l]
+            if depth == MERKLE_DEPTH:
+                return sorted(differing)
+            frontier = [child for i in differing for child in (2 * i, 2 * i + 1)]
+        return []
+
+    # How the span of tree node i on the given depth relates to the ring range [arc_start, arc_end).
+    def _span_relation(self, depth, i, arc_start, arc_end):
+        lo, hi = self.data.tree.span(depth, i)
+        arc_len = (arc_end - arc_start) % HASH_SPACE or HASH_SPACE
+        if arc_len == HASH_SPACE:
+            return 'inside'
+        if lo <= arc_start < hi:
+            return 'inside' if lo == arc_start and hi - lo <= arc_len else 'partial'
+        # The span doesn't contain the start of the arc, so its offsets from it don't wrap.
+        offset_lo = (lo - arc_start) % HASH_SPACE
+        offset_hi = (hi - 1 - arc_start) % HASH_SPACE
+        if offset_lo >= arc_len:
+            return 'outside'
+        return 'inside' if offset_hi < arc_len else 'partial'
+
+    # SWIM style gossip, called periodically. Sends the pending membership events to a few random members and merges
+    # the events they answer with. A member that doesn't answer is suspected. Neighbours are used as seeds until
+    # the table has other members. Now and then the full tables are swapped, to repair any events that were lost.
+    def gossip_membership(self):
+        if self.crashed or self.has_left:
+            return
+        self.membership.expire()
+        peers = self.membership.reachable() or [n.address for n in (self.successor, self.predecessor)
+                                                if n is not None and n.address != self.address]
+        if not peers:
+            return
+        if time.monotonic() - self.last_membership_sync >= MEMBERSHIP_SYNC_INTERVAL:
+            self.last_membership_sync = time.monotonic()
+            self._exchange_membership(random.choice(peers))
+        for address in random.sample(peers, min(GOSSIP_FANOUT, len(peers))):
+            self._gossip_to(address)
+
+    def _gossip_to(self, address):
+        try:
+            response = self._request('POST', address, '/gossip',
+                                     json={'events': self.membership.take_events()}, timeout=2)
+            if response.status_code == 200:
+                self.membership.merge(response.json()['events'])
+                self.membership.record_exchange()
                 return
-            # print(
-            #     f"Node {self.address} updating finger table entry {self.next - 1} with successor: {new_successor.address}")
-            # Inserting it to finger table and calling to stabilize. 
-            self.finger_table[self.next - 1] = new_successor
-            self.stabilize()
-    
-    # Follows chord paper. 
-    # This method is called periodcally by every node to check if their predecessor is alive, if not it should be set to none. 
-    def check_predecessor(self):
-        if self.predecessor is None:
+            print(f"Gossip to {address} failed with status {response.status_code}")
+        except requests.exceptions.RequestException as e:
+            print(f"Gossip to {address} failed: {e}")
+        self.membership.suspect(address)
+
+    # Membership events update the routing state right away, instead of waiting for the next stabilize
+    # or fix_fingers probe to run into the change.
+    def _on_member_change(self, address, state):
+        if address == self.address or self.crashed or self.has_left:
             return
-        if not self._ping_alive(self.predecessor.address):
-            print(
-                f"Predecessor {self.predecessor.address} is not responding, clearing predecessor.")
-            self.predecessor = None
+        if state == ALIVE:
+            node = Peer(address)
+            # A node that was moved to another ID: first route around it at its old position.
+            if any(n is not None and n.address == address and n.node_id != node.node_id
+                   for n in self.finger_table + [self.successor, self.predecessor]):
+                self._route_around(address)
+            # A node that joined between us and our successor is our new successor, and between our
+            # predecessor and us our new predecessor.
+            if in_range(node.node_id, (self.node_id + 1) % HASH_SPACE, self.successor.node_id):
+                self._set_successor(node)
+            if self.predecessor is not None and in_range(node.node_id, (self.predecessor.node_id + 1) % HASH_SPACE,
+                                                         self.node_id):
+                self._set_predecessor(node)
+            # Every finger the new node is closer to the start of.
+            for k in range(M):
+                if in_range(node.node_id, self._finger_start(k), (self.finger_table[k].node_id + 1) % HASH_SPACE):
+                    self.finger_table[k] = self._select_finger(k, node)
+            return
+        # Suspected, dead or left.
+        self._route_around(address)
+
+    # Replaces a node in our routing state with the next alive member.
+    def _route_around(self, address):
+        if self.predecessor is not None and self.predecessor.address == address:
+            self._set_predecessor(None)
+        if self.successor.address == address:
+            self._set_successor(self._member_node(self.membership.successor_of((self.node_id + 1) % HASH_SPACE)))
+        for k in range(M):
+            if self.finger_table[k].address == address:
+                self.finger_table[k] = self._member_node(self.membership.successor_of(self._finger_start(k)))
+
+    def _member_node(self, address):
+        return self if address == self.address else Peer(address)
+
+    # Push-pull: send our table and merge the one we get back.
+    def _exchange_membership(self, address):
+        try:
+            response = self._request('POST', address, '/membership',
+                                     json={'members': self.membership.entries()}, timeout=5)
+            if response.status_code == 200:
+                self.membership.merge(response.json()['members'])
+                self.membership.record_exchange()
+        except requests.exceptions.RequestException as e:
+            print(f"Membership exchange with {address} failed: {e}")
 
     # Used for checking if the node is alive. 
     def _ping_alive(self, address):
         try:
             print(f"Ping check {address} if online")
-            response = requests.get(f'http://{address}/ping', timeout=10)
+            started = time.monotonic()
+            response = self._request('GET', address, '/ping', timeout=10)
             if response.status_code == 200:
+                # Pings double as latency probes for finger selection.
+                self._record_rtt(address, time.monotonic() - started)
                 return True
             else:
                 return False
 
         except requests.ConnectionError:
+            self.rtt.pop(address, None)
             return False
     # Updates info about the node in node-info call 
     def _set_others(self):
@@ -277,24 +2273,101 @@ class Node:
             "others": self._set_others(),
             "predecessor": self.predecessor.address if self.predecessor else None,
             "successor": self.successor.address if self.successor else None,
+            "fingers": [finger.address for finger in self.finger_table],
         }
         return node_info
 
+    # Worker mode: the routing state the primary worker shares with the others.
+    def routing_state(self):
+        return {
+            'node_id': self.node_id,
+            'successor': [self.successor.address, self.successor.node_id],
+            'predecessor': [self.predecessor.address, self.predecessor.node_id] if self.predecessor else None,
+            'fingers': [[finger.address, finger.node_id] for finger in self.finger_table],
+            'ring': self.membership.ring,
+            'last_exchange': self.membership.last_exchange,
+            'crashed': self.crashed,
+            'has_left': self.has_left,
+        }
+
+    def publish_routing(self):
+        self.workers.routing.publish(self.routing_state())
+
+    # Worker mode: takes over the routing state the primary published, if it changed since the last call.
+    def load_routing(self):
+        state = self.workers.routing.read()
+        if state is None:
+            return
+        self.node_id = state['node_id']
+        self.successor = self._view_node(*state['successor'])
+        self.predecessor = self._view_node(*state['predecessor']) if state['predecessor'] else None
+        self.finger_table = [self._view_node(*finger) for finger in state['fingers']]
+        ring = [tuple(entry) for entry in state['ring']]
+        for node_id, address in ring:
+            NODE_IDS[address] = node_id
+        self.membership.ring = ring
+        # Monotonic time is the same clock in all processes.
+        self.membership.last_exchange = state['last_exchange']
+        self.crashed, self.has_left = state['crashed'], state['has_left']
+
+    # The node object for a neighbour or finger in the loaded routing state, reused while it keeps its ID.
+    def _view_node(self, address, node_id):
+        if address == self.address:
+            return self
+        node = self.view_nodes.get((address, node_id))
+        if node is None:
+            node = self.view_nodes[(address, node_id)] = Peer(address, node_id=node_id)
+        return node
+
+    # Statistics the node provides in the stats call.
+    def get_stats(self):
+        return {
+            "node_address": self.address,
+            "storage": self.data.get_stats(),
+            "coalesced_lookups": self.lookup_flights.coalesced,
+            "coalesced_gets": self.get_flights.coalesced,
+            "compression": self.get_compression_stats(),
+            "anti_entropy": dict(self.anti_entropy_stats, merkle_root=self.data.tree.hashes(0, [0])[0]),
+            "membership": dict(self.membership.get_stats(), one_hop=self.one_hop),
+            "deadlines": dict(self.deadline_stats),
+            "hedging": dict(self.hedge_policy.get_stats(), enabled=self.hedge),
+            "neighbours": dict(self.neighbour_stats, subscribers=len(self.subscribers)),
+            "rebalance": dict(self.rebalance_stats, migrating=self._migrating()),
+            "admission": self.admission.get_stats(),
+            "routing_hints": dict(self.hint_stats),
+            "worker": {"index": self.workers.index, "count": len(self.workers.addresses)} if self.workers else None,
+        }
+
+    def get_compression_stats(self):
+        with self.compression_lock:
+            stats = dict(self.compression_stats)
+        stats["ratio"] = (stats["raw_bytes"] / stats["compressed_bytes"]) if stats["compressed_bytes"] else None
+        return stats
+
     # Node leaves network and goes to loner state, before doing so it notifies its predecessor and sucessor to update their neighbours. 
     def leave(self):
-        self.backup = self.predecessor.address # In case a left node did crash. And wanna rejoin to network.  
+        if self.predecessor:
+            self.backup = self.predecessor.address # In case a left node did crash. And wanna rejoin to network.  
         self.has_left = True
         print(f"Node {self.address} is leaving the network.")
 
+        # Announce the leave to the neighbours and a few random members, they gossip it on to the rest of the ring.
+        peers = self.membership.reachable()
+        self.membership.leave()
+        targets = {self.predecessor.address if self.predecessor else None, self.successor.address}
+        targets.update(random.sample(peers, min(GOSSIP_FANOUT, len(peers))))
+        for address in targets - {None, self.address}:
+            self._gossip_to(address)
+
         # Tell predecessor to update its successor
         if self.predecessor:
-            requests.post(f'http://{self.predecessor.address}/update_successor', json={
+            self._request('POST', self.predecessor.address, '/update_successor', json={
                 'successor': self.successor.address if self.successor != self else None
             }, timeout=10)
            
         # Tell successor to update its predecessor
         if self.successor:
-            requests.post(f'http://{self.successor.address}/update_predecessor', json={
+            self._request('POST', self.successor.address, '/update_predecessor', json={
                 'predecessor': self.predecessor.address if self.predecessor else None
             },  timeout=10)
          
@@ -304,6 +2377,119 @@ class Node:
         print(
             f"Node {self.address} has left the network and reset its state.")
 
+    # Load of our range (predecessor, self] for the rebalancer: keys, bytes and request rate in total and
+    # for every Merkle leaf that holds keys or got requests. In worker mode summed over the workers, unless own.
+    def get_load(self, own=False):
+        if self.workers is not None and not own:
+            load = self.get_load(own=True)
+            buckets = {bucket['bucket']: bucket for bucket in load['buckets']}
+            for address in self.workers.others():
+                other = self._worker_call(address, '/load')
+                for name in ('keys', 'bytes', 'request_rate'):
+                    load[name] += other[name]
+                for bucket in other['buckets']:
+                    mine = buckets.setdefault(bucket['bucket'], dict(bucket, keys=0, bytes=0, request_rate=0))
+                    for name in ('keys', 'bytes', 'request_rate'):
+                        mine[name] += bucket[name]
+            load['buckets'] = [buckets[b] for b in sorted(buckets)]
+            return load
+        rates = self.load.rates()
+        buckets = []
+        with self.data.lock:
+            for b, keys in enumerate(self.data.tree.buckets):
+                if not keys and not rates[b]:
+                    continue
+                size = sum(self.data._size(key, self.data.items[key]) for key in keys)
+                buckets.append({'bucket': b, 'keys': len(keys), 'bytes': size, 'request_rate': rates[b]})
+            total_keys, total_bytes = len(self.data), self.data.used_bytes
+        return {
+            'node': self.address,
+            'node_id': self.node_id,
+            'predecessor_id': self.predecessor.node_id if self.predecessor else None,
+            'bucket_width': HASH_SPACE >> MERKLE_DEPTH,
+            'keys': total_keys,
+            'bytes': total_bytes,
+            'request_rate': sum(rates),
+            'buckets': buckets,
+        }
+
+    # Moves the node to another ID, to take over part of a hot range. Our keys are copied to the successor before
+    # we leave, so they stay readable, and the ones written meanwhile follow after. Until we have left, we answer
+    # for our old range ourselves. From then until we have a successor again, every lookup is handed over to the
+    # old successor, so requests that other nodes still route to us reach the keys. Then the node joins at the new ID,
+    # through the member that owns it, and pulls its new range from there. For MIGRATION_WINDOW, reads that miss
+    # are looked up at the successor, in case it still has the key. Returns a summary, with complete False and the
+    # error when a step failed part way. None if the node is alone or runs in worker mode, where the keys are spread
+    # over the workers.
+    def relocate(self, node_id):
+        if self.has_left or self.successor.address == self.address or self.workers is not None:
+            return None
+        old_id, successor = self.node_id, self.successor.address
+        print(f"Node {self.address} relocating from ID {old_id} to {node_id}")
+        with self.data.lock:
+            keys = list(self.data.items)
+        copied = self._transfer_keys(successor, keys, drop=False)
+
+        summary = {'node': self.address, 'old_id': old_id, 'node_id': node_id, 'moved_out': 0, 'pulled': 0,
+                   'complete': True}
+        handover = self.successor
+        self.migrating_until = time.monotonic() + MIGRATION_WINDOW
+        try:
+            self.leave()
+            self.handover = handover
+        except requests.exceptions.RequestException as e:
+            # Some neighbours may not know we left. Our keys are all still here, so we come back at the old ID.
+            print(f"Error leaving for the relocation: {e}, rejoining at ID {old_id}")
+            joined = self.join(successor)
+            summary.update(node_id=old_id, complete=False, error=f"Leaving failed: {e}",
+                           rejoined=joined, successor=self.successor.address)
+            return summary
+        with self.data.lock:
+            changed = [key for key, entry in self.data.items.items() if copied.get(key) != entry[2]]
+        try:
+            moved = self._transfer_keys(successor, changed)
+        except requests.exceptions.RequestException as e:
+            # Whatever is left is outside our new range, anti-entropy hands it off later.
+            print(f"Error moving keys written during the relocation: {e}")
+            moved = {}
+        self._drop_copies(copied)
+
+        self.node_id = node_id
+        self.next = 0
+        summary['moved_out'] = moved_out = len(copied.keys() | moved.keys())
+        self.rebalance_stats["keys_moved_out"] += moved_out
+        # Our keys went to the old successor, so the node rejoins at the new ID, through the old successor if the
+        # owner of the new ID can't take it.
+        via = self.membership.successor_of(node_id)
+        try:
+            joined = any(self.join(address) for address in dict.fromkeys((via, successor)))
+        finally:
+            self.handover = None
+        if not joined:
+            print(f"Node {self.address} could not rejoin at ID {node_id}")
+            summary.update(complete=False, error=f"Joining at ID {node_id} failed", successor=self.successor.address)
+            return summary
+        # The new predecessor notifies us as soon as it gets our join pushed, then our new range is known.
+        waited = time.monotonic() + 5
+        while self.predecessor is None and time.monotonic() < waited:
+            time.sleep(0.1)
+        if self.predecessor is None:
+            # Anti-entropy pulls the range once a predecessor is known, until then reads fall back to the successor.
+            summary.update(complete=False, error="No predecessor yet, the new range was not pulled")
+        else:
+            summary['pulled'] = self._sync_with_successor()
+
+        self.rebalance_stats["relocations"] += 1
+        self.rebalance_stats["keys_pulled"] += summary['pulled']
+        print(f"Node {self.address} relocated to ID {node_id}: {moved_out} keys moved out, "
+              f"{summary['pulled']} pulled in")
+        summary['successor'] = self.successor.address
+        return summary
+
+    def _migrating(self):
+        return (self.migrating_until is not None and time.monotonic() < self.migrating_until
+                and self.successor.address != self.address)
+
     # Crashes node and sets it to loner state. Doesn't notify anyone,since it cant perform any calls to fix finger or stabilize itself it will be unreachable also in the api calls. 
     def crash_node(self):
         print(f"Simulating crash for node: {self.address}")
@@ -333,93 +2519,635 @@ class Node:
                 return False
              
 
-    # Inserting value based of its hashed id to the correct node id
-    def put_action(self, key, value):
+    # Deflates the payload if compression is on and it is large enough to be worth it.
+    def compress(self, payload, encoding):
+        if encoding != IDENTITY or self.compress_min_bytes is None or len(payload) < self.compress_min_bytes:
+            return payload, encoding
+        started = time.thread_time()
+        compressed = zlib.compress(payload)
+        spent = time.thread_time() - started
+        with self.compression_lock:
+            self.compression_stats["compress_cpu_seconds"] += spent
+            # Incompressible data is kept as it is.
+            if len(compressed) >= len(payload):
+                return payload, encoding
+            self.compression_stats["compressed_values"] += 1
+            self.compression_stats["raw_bytes"] += len(payload)
+            self.compression_stats["compressed_bytes"] += len(compressed)
+        return compressed, DEFLATE
+
+    def decompress(self, payload, encoding):
+        if encoding != DEFLATE:
+            return payload
+        started = time.thread_time()
+        raw = zlib.decompress(payload)
+        spent = time.thread_time() - started
+        with self.compression_lock:
+            self.compression_stats["decompress_cpu_seconds"] += spent
+        return raw
+
+    # Inserting value based of its hashed id to the correct node id. Returns the status code for the client.
+    def put_action(self, key, payload, encoding=IDENTITY, ttl=None):
         hashed_key = hash_sha1(key)
+        # Compressed once at the entry node, it stays compressed in transit and at rest.
+        payload, encoding = self.compress(payload, encoding)
         # Finding the correct successor to forward the the value to 
-        correct_node = self.find_successor(hashed_key)
+        try:
+            correct_node = self.find_successor(hashed_key)
+        except requests.exceptions.RequestException as e:
+            print(f"Lookup for PUT key: {key} failed: {e}")
+            return self._failed_status()
+        status = self._put_at(correct_node, key, payload, encoding, ttl)
+        # The membership table can still list a node that failed since the last gossip round. Then suspect it and route again.
+        if status in (502, 503) and self.one_hop and self.membership.suspect(correct_node.address):
+            try:
+                status = self._put_at(self.find_successor(hashed_key), key, payload, encoding, ttl)
+            except requests.exceptions.RequestException as e:
+                print(f"Lookup for PUT key: {key} failed: {e}")
+                return self._failed_status()
+        return status
 
+    # A call to another node failed: 504 if it was because the deadline ran out, else 502.
+    def _failed_status(self):
+        if deadline_passed():
+            self.deadline_stats["timed_out"] += 1
+            return 504
+        return 502
+
+    def _put_at(self, correct_node, key, payload, encoding, ttl):
         # When found match. 
         if correct_node.node_id == self.node_id:
+            # In worker mode the key may be held by another worker of this node.
+            holder = self.workers.holder_of(key) if self.workers is not None else None
+            if holder is not None:
+                return self._forward_put(holder, key, payload, encoding, ttl, WORKER_LOCAL)
             print(f"Storing key: {key} and value on node: {self.node_id}")
-            self.data[key] = value
+            self.load.record(hash_sha1(key))
+            if not self.data.put(key, payload, encoding, ttl):
+                print(f"Refused key: {key}, value is larger than the storage quota")
+                return 507
+            return 200
         # If isnt found means we need to forward it in the network to the correct node and insert it. 
         else:
-            try:
+            return self._forward_put(correct_node.address, key, payload, encoding, ttl)
+
+    def _forward_put(self, address, key, payload, encoding, ttl, extra_headers=None):
+        try:
+            print(
+                f"Forwarding PUT to: {address} with key: {key}")
+            headers = dict(extra_headers or {}, **{'Content-Type': 'text/plain'})
+            if encoding != IDENTITY:
+                headers['Content-Encoding'] = encoding
+            if ttl is not None:
+                headers['X-TTL'] = str(ttl)
+            response = self._request(
+                'PUT', address, f"/storage/{key}", data=payload, headers=headers, timeout=8)
+            if response.status_code == 200:
                 print(
-                    f"Forwarding PUT to: {correct_node.address} with key: {key}")
-                connection = http.client.HTTPConnection(
-                    correct_node.address, timeout=8)
-                headers = {'Content-Type': 'text/plain'}
-                connection.request(
-                    "PUT", f"/storage/{key}", body=value.encode('utf-8'), headers=headers)
-                response = connection.getresponse()
-                if response.status == 200:
-                    print(
-                        f"PUT request successfully forwarded to {correct_node.address}")
-                else:
-                    print(
-                        f"Failed to PUT key: {key} to node {correct_node.address} with status {response.status}")
-            except (http.client.HTTPException, socket.timeout) as e:
-                print(f"Error forwarding PUT request: {e}")
-            finally:
-                connection.close()
+                    f"PUT request successfully forwarded to {address}")
+            else:
+                print(
+                    f"Failed to PUT key: {key} to node {address} with status {response.status_code}")
+            return response.status_code
+        except requests.exceptions.RequestException as e:
+            print(f"Error forwarding PUT request: {e}")
+            return self._failed_status()
     
-    # Retrieving value based of its hased it from the correct node. 
+    # Retrieving value based of its hased it from the correct node. Returns (status, (payload, encoding) or None),
+    # the status for the client as for PUT: 404 for a missing key, 502 or 504 when a lookup or forward failed.
+    # Concurrent GETs for the same key share one lookup and one forwarded request.
     def get_action(self, key):
+        try:
+            return self.get_flights.do(key, lambda: self._get_action(key))
+        except DeadlineExceeded:
+            # The deadline passed waiting for a concurrent GET of the key.
+            return self._failed_status(), None
+
+    def _get_action(self, key):
         hashed_key = hash_sha1(key)
 
-        correct_node = self.find_successor(hashed_key)
+        try:
+            correct_node = self.find_successor(hashed_key)
+            status, entry = self._get_at(correct_node, key)
+            # Same as for PUT, a failed node still in the membership table is suspected and the key routed again.
+            if status in (502, 503) and self.one_hop and self.membership.suspect(correct_node.address):
+                status, entry = self._get_at(self.find_successor(hashed_key), key)
+        except requests.exceptions.RequestException as e:
+            print(f"Lookup for GET key: {key} failed: {e}")
+            return self._failed_status(), None
+        return status, entry
 
+    # Returns (status, (payload, encoding, version) or None). The version is None if the owner didn't send it.
+    def _get_at(self, correct_node, key):
         if correct_node.node_id == self.node_id:
-            return self.data.get(key)
+            holder = self.workers.holder_of(key) if self.workers is not None else None
+            if holder is not None:
+                return self._forward_get(holder, key, WORKER_LOCAL)
+            self.load.record(hash_sha1(key))
+            entry = self.data.get(key)
+            # Right after a relocation the successor may still hold keys of our new range.
+            if entry is None and self._migrating():
+                self.rebalance_stats["migration_reads"] += 1
+                status, entry = self._fetch_from(self.successor.address, key)
+                if status == 200:
+                    return status, entry
+            return (200 if entry is not None else 404), entry
+        elif self.hedge:
+            return self._hedged_get(correct_node, key)
         else:
-            try:
+            return self._forward_get(correct_node.address, key)
+
+    # Hedged read: when the owner hasn't answered within the hedge delay, the same key is also read from the
+    # owner's successor, which holds keys during handoff, and the first of the two to find the key answers.
+    # Both reads run on HEDGE_POOL, the hedge is only sent once the delay has passed. The successor's copy can
+    # be older than the owner's: when both have answered the newer version wins, and an owner that answers after
+    # a hedge won is checked for a newer version, counted as a stale win.
+    def _hedged_get(self, correct_node, key):
+        policy = self.hedge_policy
+        policy.on_read()
+        started = time.monotonic()
+        owner = HEDGE_POOL.submit(in_context(lambda: self._forward_get(correct_node.address, key)))
+        owner.add_done_callback(lambda _: policy.record(time.monotonic() - started))
+        alternate = self._alternate_holder(correct_node)
+        if (alternate is None or concurrent.futures.wait([owner], timeout=policy.delay).done
+                or not policy.try_hedge()):
+            return owner.result()
+        hedge = HEDGE_POOL.submit(in_context(lambda: self._fetch_from(alternate, key)))
+
+        concurrent.futures.wait([owner, hedge], return_when=concurrent.futures.FIRST_COMPLETED)
+        if owner.done():
+            status, entry = owner.result()
+            if status == 200 and not hedge.done():
+                return status, entry
+            hedged = hedge.result()
+            if hedged[0] == 200 and (status != 200 or newer(hedged[1], entry)):
+                policy.hedge_won()
+                return hedged
+            return status, entry
+        hedged = hedge.result()
+        if hedged[0] != 200:
+            return owner.result()
+        policy.hedge_won()
+        owner.add_done_callback(lambda answered: policy.owner_answered(hedged[1], answered.result()))
+        return hedged
+
+    # The owner's successor from the membership table, None when the table can't be trusted.
+    def _alternate_holder(self, owner):
+        if not self.membership.is_fresh():
+            return None
+        address = self.membership.successor_of((owner.node_id + 1) % HASH_SPACE)
+        return None if address == owner.address else address
+
+    # Reads a key straight from a node's store, without routing. Returns (status, (payload, encoding, version) or None).
+    def _fetch_from(self, address, key):
+        headers = None
+        if address == self.address:
+            holder = self.workers.holder_of(key) if self.workers is not None else None
+            if holder is None:
+                entry = self.data.get(key)
+                return (200 if entry is not None else 404), entry
+            address, headers = holder, WORKER_LOCAL
+        try:
+            response = self._request('POST', address, '/fetch', headers=headers, json={'keys': [key]}, timeout=8)
+            if response.status_code != 200:
+                return response.status_code, None
+            items = response.json()['items']
+            if not items:
+                return 404, None
+            return 200, (base64.b64decode(items[0]['value']), items[0]['encoding'], items[0]['version'])
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching key: {key} from {address}: {e}")
+            return self._failed_status(), None
+
+    def _forward_get(self, address, key, extra_headers=None):
+        try:
+            print(
+                f"Forwarding GET request to: {address} for key: {key}")
+            # Ask for the stored form, the value is decompressed at the entry node if the client needs it.
+            response = self._request(
+                'GET', address, f"/storage/{key}", headers=dict(extra_headers or {}, **{'Accept-Encoding': DEFLATE}),
+                timeout=8, stream=True)
+            # Read the body as sent (not inflated by requests) and give the connection back to the pool.
+            response_body = response.raw.read(decode_content=False)
+            response.raw.release_conn()
+            if response.status_code == 200:
+                version = response.headers.get('X-Version')
+                return 200, (response_body, response.headers.get('Content-Encoding', IDENTITY),
+                             float(version) if version is not None else None)
+            else:
                 print(
-                    f"Forwarding GET request to: {correct_node.address} for key: {key}")
-                connection = http.client.HTTPConnection(
-                    correct_node.address, timeout=8)
-                connection.request("GET", f"/storage/{key}")
-                response = connection.getresponse()
-                response_body = response.read().decode("utf-8")
-                if response.status == 200:
-                    return response_body
+                    f"GET request failed with status {response.status_code} on node {address}")
+                return response.status_code, None
+        except requests.exceptions.RequestException as e:
+            print(f"Error forwarding GET request: {e}")
+            return self._failed_status(), None
+
+
+    # One page of a scan of our own store: with a prefix in key order, else in ring order of the hashed IDs.
+    # Returns the keys and the cursor for the next page, None on the last page.
+    def scan_local(self, start, end, prefix=None, after=None, limit=SCAN_PAGE):
+        if prefix is None:
+            keys = self.data.scan_ids(start, end, after, limit)
+        else:
+            keys = self.data.scan_prefix(prefix, start, end, after, limit)
+        return keys, (keys[-1] if len(keys) == limit else None)
+
+    # The scanned entries as JSON lines, SCAN_CHUNK per chunk. Keys deleted since the page was taken are left out.
+    def scan_lines(self, keys, keys_only=False):
+        for i in range(0, len(keys), SCAN_CHUNK):
+            batch = keys[i:i + SCAN_CHUNK]
+            if keys_only:
+                items = [{'key': key, 'id': hash_sha1(key)} for key in batch if key in self.data]
+            else:
+                items = [dict(item, id=hash_sha1(item['key'])) for item in self._export_items(batch)]
+            yield b''.join(json.dumps(item).encode('utf-8') + b'\n' for item in items)
+
+    # Ring-wide scan of the IDs [start, end). Starts at the node that owns start and walks the successors in order,
+    # scanning on each node, page by page, only the part of the range it owns. Yields JSON lines in chunks,
+    # ending with a summary line, or an error line if a node on the way fails.
+    def scan_ring(self, start, end, prefix=None, keys_only=False):
+        arc = (end - start) % HASH_SPACE or HASH_SPACE
+        position, covered, nodes, found = start, 0, 0, 0
+        try:
+            address = first = self.find_successor(start).address
+            while covered < arc:
+                if address == self.address:
+                    node_id, successor = self.node_id, self.successor.address
                 else:
-                    print(
-                        f"GET request failed with status {response.status} on node {correct_node.address}")
-                    return None
-            except (http.client.HTTPException, socket.timeout) as e:
-                print(f"Error forwarding GET request: {e}")
-                return None
-            finally:
-                connection.close()
+                    info = self._request('GET', address, '/node-info', timeout=5).json()
+                    node_id, successor = info['node_hash'], info['successor']
+                # The node owns the IDs from position up to and including its own ID.
+                step = min((node_id + 1 - position) % HASH_SPACE or HASH_SPACE, arc - covered)
+                segment_end = (position + step) % HASH_SPACE
+                after = None
+                while True:
+                    keys, lines, after = self._scan_page(address, position, segment_end, prefix, after, keys_only)
+                    found += keys
+                    yield from lines
+                    if after is None:
+                        break
+                # The first node's range can wrap past the start, then the walk ends on it again. It is one node.
+                if covered == 0 or address != first:
+                    nodes += 1
+                covered += step
+                position, address = segment_end, successor
+        except requests.exceptions.RequestException as e:
+            yield json.dumps({'error': f"Scan stopped at {address}: {e}", 'nodes': nodes, 'keys': found}).encode() + b'\n'
+            return
+        yield json.dumps({'nodes': nodes, 'keys': found}).encode('utf-8') + b'\n'
+
+    # One page of a scan of this node: keys and chunks of JSON lines, and the cursor of the next page. In worker mode
+    # every worker scans its own page and the pages are merged in scan order, so the first limit entries are the same
+    # as from one store. Own only scans this worker.
+    def scan_page(self, start, end, prefix=None, after=None, limit=SCAN_PAGE, keys_only=False, own=False):
+        keys, cursor = self.scan_local(start, end, prefix, after, limit)
+        if self.workers is None or own:
+            return len(keys), self.scan_lines(keys, keys_only), cursor
+        lines = [line for chunk in self.scan_lines(keys, keys_only) for line in chunk.splitlines()]
+        more = cursor is not None
+        for address in self.workers.others():
+            _, chunks, next_page = self._scan_page(address, start, end, prefix, after, keys_only, limit, WORKER_LOCAL)
+            lines += [line for chunk in chunks for line in chunk.splitlines()]
+            more = more or next_page is not None
+        items = [json.loads(line) for line in lines]
+        if prefix is None:
+            items.sort(key=lambda item: ((item['id'] - start) % HASH_SPACE, item['key']))
+        else:
+            items.sort(key=lambda item: item['key'])
+        items = items[:limit]
+        cursor = items[-1]['key'] if items and (more or len(items) == limit) else None
+        return len(items), [b''.join(json.dumps(item).encode('utf-8') + b'\n' for item in items)], cursor
+
+    # One page of a scan on a node. Returns (keys found, chunks of JSON lines, cursor of the next page).
+    def _scan_page(self, address, start, end, prefix, after, keys_only, limit=None, headers=None):
+        if address == self.address:
+            found, chunks, cursor = self.scan_page(start, end, prefix, after, keys_only=keys_only)
+            return found, list(chunks), cursor
+        params = {'start': start, 'end': end}
+        for name, value in (('prefix', prefix), ('after', after), ('limit', limit),
+                            ('keys_only', 1 if keys_only else None)):
+            if value is not None:
+                params[name] = value
+        response = self._request('GET', address, f"/storage?{urlencode(params)}", headers=headers, timeout=30)
+        if response.status_code != 200:
+            raise requests.exceptions.HTTPError(f"status {response.status_code}", response=response)
+        lines = response.content.splitlines(keepends=True)
+        # The last line is the cursor, the others are the entries.
+        return len(lines) - 1, [b''.join(lines[:-1])], json.loads(lines[-1])['next']
+
+# Runs a handler inside a trace span. Requests that carry a trace ID continue that trace, client
+# storage requests start a new one here at the entry node. Other untraced requests (maintenance) are not recorded.
+def traced(handler):
+    @functools.wraps(handler)
+    def wrapper(self):
+        trace_id = self.headers.get('X-Trace-Id')
+        if trace_id is None and self.path.startswith('/storage'):
+            trace_id = secrets.token_hex(16)
+        if trace_id is None:
+            return handler(self)
+
+        span_id = new_span_id()
+        _trace.trace_id, _trace.span_id = trace_id, span_id
+        self.status_code = None
+        started_wall, started = time.time(), time.monotonic()
+        try:
+            return handler(self)
+        finally:
+            _trace.trace_id, _trace.span_id = None, None
+            self.server.node.record_span(trace_id, span_id, self.headers.get('X-Parent-Span'),
+                                         f"{self.command} {urlsplit(self.path).path}",
+                                         started_wall, time.monotonic() - started, self.status_code)
+    return wrapper
+
+
+# Runs a handler under the deadline the caller sent in X-Timeout-Ms, milliseconds from now. Calls to other nodes
+# get what is left of it as their timeout and pass that on, so no hop keeps working after the client gave up.
+# A node doesn't make a call once less than a millisecond is left, so a budget that isn't positive is refused.
+def deadline_bound(handler):
+    @functools.wraps(handler)
+    def wrapper(self):
+        budget = self.headers.get('X-Timeout-Ms')
+        if budget is None:
+            return handler(self)
+        try:
+            budget = float(budget) / 1000
+        except ValueError:
+            budget = None
+        if budget is None or not math.isfinite(budget) or budget <= 0:
+            self.send_error(400, "Bad Request - X-Timeout-Ms must be a positive number of milliseconds")
+            return
+        _deadline.at = time.monotonic() + budget
+        try:
+            return handler(self)
+        finally:
+            _deadline.at = None
+    return wrapper
+
+
+# Admission control, before any work is done. A client request is charged to the client's token bucket for the
+# endpoint and answered 429 when it is empty. Each lane has a limit of requests in flight, over it the request is
+# answered 503. Maintenance calls between nodes are never limited, so the ring keeps working under client load.
+def admitted(handler):
+    @functools.wraps(handler)
+    def wrapper(self):
+        admission = self.server.node.admission
+        lane = self._lane()
+        if lane == CLIENT:
+            retry = admission.take(self.client_address[0], endpoint_class(self.path))
+            if retry is not None:
+                self._send(429, json.dumps({"error": "Too Many Requests - Rate limit exceeded"}).encode(),
+                           'application/json', {'Retry-After': str(math.ceil(retry))})
+                return
+        if not admission.enter(lane):
+            self._send(503, json.dumps({"error": "Service Unavailable - Node is overloaded"}).encode(),
+                       'application/json', {'Retry-After': '1'})
+            return
+        try:
+            return handler(self)
+        finally:
+            admission.leave(lane)
+    return wrapper
 
 
 # HTTP request handler for the DHT.
 class DHTHandler(BaseHTTPRequestHandler):
-    def send_error(self, status_code, message):
+    # Keep-alive: clients and other nodes can send many requests over one connection.
+    # Every response must therefore carry a Content-Length, see _send.
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, without TCP_NODELAY the body waits for the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # Idle keep-alive connections are closed after the server's idle timeout.
+        self.timeout = self.server.idle_timeout
+        super().setup()
+        self.requests_served = 0
+        # Nothing parsed yet. An over-long request line is answered by send_error before parse_request runs.
+        self.headers = None
+        self.body = None
+        self.sender_trusted = None
+        _serving.active = True
+        with self.server.connections_lock:
+            self.server.open_connections += 1
+
+    def finish(self):
+        super().finish()
+        with self.server.connections_lock:
+            self.server.open_connections -= 1
+
+    def parse_request(self):
+        # Forget the previous request on this connection, a malformed request has no headers.
+        self.headers = None
+        self.body = None
+        self.sender_trusted = None
+        return super().parse_request()
+
+    def send_response(self, code, message=None):
+        self.status_code = code
+        super().send_response(code, message)
+        # Hand the trace ID back, so a client can look up its request in /debug/traces.
+        trace_id, _ = current_trace()
+        if trace_id is not None:
+            self.send_header('X-Trace-Id', trace_id)
+        # Calls from other nodes get our routing hint back, see Node.absorb_hint. Only nodes we trust, it shows
+        # our neighbours.
+        node = self.server.node
+        if (self.headers is not None and 'X-From-Node' in self.headers and not node.crashed
+                and not self._worker_local() and self._from_node()):
+            self.send_header('X-Routing-Hint', node.routing_hint())
+
+    # Reads the request body once, later calls get the same bytes.
+    def _read_body(self):
+        if self.body is None:
+            length = int(self.headers.get('Content-Length', 0)) if self.headers else 0
+            self.body = self.rfile.read(length)
+        return self.body
+
+    def _read_json(self):
+        return json.loads(self._read_body())
+
+    # Sends a complete response. The request body is always consumed first, so the next request on
+    # the connection starts in the right place, and the connection is closed when over the limits.
+    def _send(self, status_code, body=b'', content_type=None, headers=None):
+        self._read_body()
+        self.requests_served += 1
+        self.send_response(status_code)
+        if content_type:
+            self.send_header('Content-type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', len(body))
+        if (self.requests_served >= self.server.max_requests_per_connection
+                or self.server.open_connections > self.server.max_connections):
+            self.send_header('Connection', 'close')
+        try:
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The caller gave up, for example when its deadline passed. Nobody is left to answer.
+            self.close_connection = True
+
+    # Streams a response with chunked transfer encoding, so a large answer doesn't have to be built in memory first.
+    def _send_chunked(self, status_code, chunks, content_type):
+        self._read_body()
+        self.requests_served += 1
         self.send_response(status_code)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps({"error": message}).encode())
+        self.send_header('Content-type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        if (self.requests_served >= self.server.max_requests_per_connection
+                or self.server.open_connections > self.server.max_connections):
+            self.send_header('Connection', 'close')
+        try:
+            self.end_headers()
+            for chunk in chunks:
+                if chunk:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def _send_json(self, status_code, data):
+        self._send(status_code, json.dumps(data).encode('utf-8'), 'application/json')
+
+    def send_error(self, status_code, message=None, explain=None):
+        self._send_json(status_code, {"error": message})
+
+    # Profiling and thread dumps show the nodes internals, so they need the debug token.
+    def _debug_authorized(self):
+        token = self.server.node.debug_token
+        if token is None:
+            self.send_error(403, "Forbidden - Debug endpoints are disabled, start the node with --debug-token")
+            return False
+        supplied = self.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+            self.send_error(401, "Unauthorized - Missing or wrong debug token")
+            return False
+        return True
+
+    # The query of a scan: start and end IDs (the whole ring by default), prefix, after (the cursor), limit
+    # and keys_only. Answers 400 and returns None if they don't parse.
+    def _scan_params(self):
+        query = parse_qs(urlsplit(self.path).query)
+        try:
+            start = int(query.get('start', [0])[0]) % HASH_SPACE
+            end = int(query.get('end', [start])[0]) % HASH_SPACE
+            limit = min(max(int(query.get('limit', [SCAN_PAGE])[0]), 1), SCAN_MAX_PAGE)
+        except ValueError:
+            self.send_error(400, "Bad Request - start, end and limit must be integers")
+            return None
+        keys_only = query.get('keys_only', ['0'])[0] not in ('0', 'false', '')
+        return start, end, query.get('prefix', [None])[0], query.get('after', [None])[0], limit, keys_only
+
+    def _send_text(self, text):
+        self._send(200, text.encode("utf-8"), "text/plain; charset=utf-8")
+
+    # The admission lane of the request. A call from a node is a maintenance call or a forwarded storage request,
+    # anything else is a client request.
+    def _lane(self):
+        if self._from_node():
+            return MAINTENANCE if urlsplit(self.path).path in MAINTENANCE_PATHS else FORWARDED
+        return CLIENT
+
+    # True if the request comes from a node. Calls inside the process (host mode) and on a worker's private address
+    # only come from nodes. Otherwise the connection must come from the host of the node X-From-Node names. With a
+    # cluster secret the call must carry the sender's signature, without one the sender must be a node we know.
+    # Decided once per request, admission and the routing hint both ask.
+    def _from_node(self):
+        if self.sender_trusted is None:
+            self.sender_trusted = self._check_from_node()
+        return self.sender_trusted
+
+    def _check_from_node(self):
+        node = self.server.node
+        if self.client_address[0] == 'loopback' or self.server.private:
+            return True
+        sender = self.headers.get('X-From-Node')
+        if sender is None or self.client_address[0] not in host_addresses(sender.rpartition(':')[0]):
+            return False
+        if node.cluster_secret is None:
+            return sender == node.address or sender in NODE_IDS
+        expected = node_signature(node.cluster_secret, sender, self.command, self.path)
+        return hmac.compare_digest(self.headers.get('X-Node-Signature', '').encode(), expected.encode())
+
+    # Worker mode: a call from another worker of this node, answered from this worker's own keys.
+    # Only taken on the private address, where clients and other nodes don't connect.
+    def _worker_local(self):
+        return self.server.private and self.headers.get('X-Worker-Local') is not None
+
+    # Worker mode: calls that change or need more than the routing state are passed on to the primary worker,
+    # which runs the routing and membership. Returns True if the request was passed on.
+    def _proxied_to_primary(self):
+        node = self.server.node
+        path = urlsplit(self.path).path
+        if (node.workers is None or node.workers.is_primary() or self._worker_local()
+                or path in WORKER_PATHS or path.startswith(('/storage/', '/debug/'))):
+            return False
+        # The client's headers go along, so the primary sees the same request. Its answer comes back with
+        # everything but the headers of the connection to it, Retry-After on a 503 for example.
+        headers = {name: value for name, value in self.headers.items() if name.lower() not in PROXY_REQUEST_SKIP}
+        try:
+            response = node._request(self.command, node.workers.addresses[0], self.path, headers=headers,
+                                     data=self._read_body(), timeout=60)
+        except requests.exceptions.RequestException as e:
+            self.send_error(node._failed_status(), f"Primary worker failed - {e}")
+            return True
+        relayed = {name: value for name, value in response.headers.items() if name.lower() not in PROXY_RESPONSE_SKIP}
+        self._send(response.status_code, response.content, response.headers.get('Content-Type'), relayed)
+        return True
 
+    @admitted
+    @traced
+    @deadline_bound
     def do_PUT(self):
+        if self._proxied_to_primary():
+            return
         # If node is crashed it can't perform any put requests. 
         if self.server.node.crashed:
             self.send_error(503, "Service Unavailable - Node is crashed")
             return
         if self.path.startswith('/storage/'):
             key = self.path.split('/storage/')[1]
-            value = self.rfile.read(
-                int(self.headers.get('Content-length'))).decode('utf-8')
+            payload = self._read_body()
+            encoding = self.headers.get('Content-Encoding', IDENTITY)
+            if encoding not in (IDENTITY, DEFLATE):
+                self.send_error(415, f"Unsupported Media Type - Content-Encoding {encoding}")
+                return
+            # Stored as sent, so a broken body from a client would only fail later, on a GET that has to inflate
+            # it. Bodies from nodes were deflated by Node.compress and aren't checked again.
+            if encoding == DEFLATE and not self._from_node() and not valid_deflate(payload):
+                self.send_error(400, "Bad Request - Body is not valid deflate data")
+                return
             print(f"PUT request received for key: {key}")
-            self.server.node.put_action(key, value)
-            self.send_response(200)
-            self.end_headers()
+            ttl = self.headers.get('X-TTL')
+            try:
+                ttl = float(ttl) if ttl is not None else None
+            except ValueError:
+                ttl = math.nan
+            # The timer wheel can only place a finite time, inf and nan are refused like any other bad TTL.
+            if ttl is not None and not (math.isfinite(ttl) and ttl >= 0):
+                self.send_error(400, "Bad Request - X-TTL must be a finite, non-negative number of seconds")
+                return
+            node = self.server.node
+            if self._worker_local():
+                status = node._put_at(node, key, payload, encoding, ttl)
+            else:
+                status = node.put_action(key, payload, encoding, ttl)
+            if status == 507:
+                self.send_error(507, "Insufficient Storage - Value exceeds the node storage quota")
+                return
+            if status != 200:
+                self.send_error(status, f"PUT failed for key: {key}")
+                return
+            self._send(200)
         else:
             self.send_error(404, "Not Found - This API doesn't exist")
 
+    @admitted
+    @traced
+    @deadline_bound
     def do_POST(self):
+        if self._proxied_to_primary():
+            return
         # If node is crashed it can only perform POST recover call, rest POST calls is blocked. 
         if self.server.node.crashed and self.path != '/sim-recover':
             self.send_error(503, "Service Unavailable - Node is crashed")
@@ -427,30 +3155,21 @@ class DHTHandler(BaseHTTPRequestHandler):
         # Join call
         if self.path.startswith("/join"):
             node_url = self.path.split("nprime=")
-            if node_url:
+            if len(node_url) == 2:
                 print(
                     f"\nNode: {self.server.node.address} joining network via {node_url[1]}")
                 self.server.node.join(node_url[1])
                 response_message = (
                     f"Node: {self.server.node.address} joined {node_url[1]} network successfully")
-                self.send_response(200)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(response_message.encode())
+                self._send(200, response_message.encode(), 'text/plain')
             else:
                 self.send_error(400, "Bad Request - /join")
         # Notify call, mostly used inside the methods to update. 
         elif self.path.startswith("/notify"):
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            new_node = json.loads(post_data.decode('utf-8')).get('node')
+            new_node = self._read_json().get('node')
             if new_node is not None:
                 self.server.node.notify(new_node)
-                response_message = {"status": "success"}
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps(response_message).encode())
+                self._send_json(200, {"status": "success"})
             else:
                 self.send_error(
                     400, "Bad Request - /notify Error: Invalid node data")
@@ -463,61 +3182,117 @@ class DHTHandler(BaseHTTPRequestHandler):
                 response_message = {
                     "message": f"Node: {self.server.node.address} has left the network"
                 }
-                self.send_response(200)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(json.dumps(response_message).encode())
+                self._send(200, json.dumps(response_message).encode(), 'text/plain')
             else: 
                 self.send_error(400, "Bad request - Node has already left network")
         # Call to update the nodes sucessor in the network 
         elif self.path == "/update_successor":
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data)
-            self.server.node.successor = Node(data['successor'])
-            response_message = {"status": "success"}
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(response_message).encode())
+            data = self._read_json()
+            node = self.server.node
+            node._set_successor(Peer(data['successor']) if data['successor'] else node)
+            self._send_json(200, {"status": "success"})
         # Call to update the nodes predecessor in the network 
         elif self.path == "/update_predecessor":
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data)
-            self.server.node.predecessor = Node(
-                data['predecessor']) if data['predecessor'] else None
-            response_message = {"status": "success"}
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(response_message).encode())
+            data = self._read_json()
+            self.server.node._set_predecessor(Peer(
+                data['predecessor']) if data['predecessor'] else None)
+            self._send_json(200, {"status": "success"})
+        # Subscribes the sender to our neighbour changes, answered with our neighbours.
+        elif self.path == "/subscribe":
+            self._send_json(200, self.server.node.subscribe(self._read_json()['node']))
+        # A neighbour pushes its changed neighbours.
+        elif self.path == "/neighbours":
+            subscribed = self.server.node.on_neighbours(self._read_json())
+            self._send_json(200, {"subscribed": subscribed})
         # Call for forward it to the right sucessor. 
         elif self.path.startswith('/find_successor'):
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data)
+            data = self._read_json()
             hashed_key = data['hashed_key']
-            successor = self.server.node.find_successor(hashed_key)
+            try:
+                successor = self.server.node.find_successor(hashed_key)
+            except requests.exceptions.RequestException as e:
+                self.send_error(self.server.node._failed_status(), f"Lookup failed - {e}")
+                return
             successor_info = {
                 'node_id': successor.node_id,
                 'node_address': successor.address
             }
-            json_data = json.dumps(successor_info).encode('utf-8')
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Content-length', len(json_data))
-            self.end_headers()
-            self.wfile.write(json_data)
+            self._send_json(200, successor_info)
+        # Merkle tree hashes, used by anti-entropy.
+        elif self.path == "/merkle":
+            data = self._read_json()
+            hashes = self.server.node.tree_hashes(data['level'], data['indices'], own=self._worker_local())
+            self._send_json(200, {'hashes': hashes})
+        # Key digests in the given Merkle leaves, limited to a range.
+        elif self.path == "/merkle/leaves":
+            data = self._read_json()
+            digests = self.server.node.leaf_digests(data['leaves'], data['start'], data['end'],
+                                                    own=self._worker_local())
+            self._send_json(200, {'digests': digests})
+        # Local read of stored entries, nothing is dropped.
+        elif self.path == "/fetch":
+            items = self.server.node.fetch_items(self._read_json()['keys'], own=self._worker_local())
+            self._send_json(200, {'items': items})
+        # Our predecessor has stored the keys it fetched, the copies of the versions it took are dropped.
+        elif self.path == "/release":
+            data = self._read_json()
+            dropped = self.server.node.release_items(data['versions'], data['taken_by'], own=self._worker_local())
+            self._send_json(200, {'dropped': dropped})
+        # Stores entries handed over by other nodes, keeping their versions.
+        elif self.path == "/transfer":
+            stored, stored_bytes = self.server.node.import_items(self._read_json()['items'], own=self._worker_local())
+            self._send_json(200, {'stored': stored, 'bytes': stored_bytes})
+        # Bulk load of snapshot records, straight into our store without routing.
+        elif self.path == "/import":
+            body = io.BytesIO(self._read_body())
+            if body.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                self.send_error(400, "Bad Request - Body is not a snapshot")
+                return
+            try:
+                stored, stored_bytes, skipped = self.server.node.import_snapshot(
+                    unpack_entries(body), own=self._worker_local())
+            except (ValueError, IndexError, UnicodeDecodeError) as e:
+                self.send_error(400, f"Bad Request - Broken snapshot record: {e}")
+                return
+            except requests.exceptions.RequestException as e:
+                self.send_error(self.server.node._failed_status(), f"Import failed - {e}")
+                return
+            self._send_json(200, {'stored': stored, 'bytes': stored_bytes, 'skipped': skipped})
+        # Membership events piggybacked on gossip, answered with our own pending events.
+        elif self.path == "/gossip":
+            membership = self.server.node.membership
+            membership.merge(self._read_json()['events'])
+            self._send_json(200, {'events': membership.take_events()})
+        # Full membership table exchange: merge the sender's table and answer with ours.
+        elif self.path == "/membership":
+            membership = self.server.node.membership
+            membership.merge(self._read_json()['members'])
+            self._send_json(200, {'members': membership.entries()})
+        # Moves the node to another ID, picked by the rebalancer.
+        elif self.path == "/relocate":
+            node = self.server.node
+            node_id = self._read_json().get('node_id')
+            if not isinstance(node_id, int) or not 0 <= node_id < HASH_SPACE:
+                self.send_error(400, f"Bad Request - node_id must be an integer in [0, {HASH_SPACE})")
+                return
+            if any(member_id == node_id for member_id, _ in node.membership.ring):
+                self.send_error(409, f"Conflict - ID {node_id} is taken")
+                return
+            try:
+                summary = node.relocate(node_id)
+            except requests.exceptions.RequestException as e:
+                self.send_error(node._failed_status(), f"Relocation failed - {e}")
+                return
+            if summary is None:
+                self.send_error(409, "Conflict - Node is not part of a ring, or runs in worker mode")
+                return
+            self._send_json(200 if summary['complete'] else 500, summary)
         # Simulates a crash of a node. 
         elif self.path == "/sim-crash":
             self.server.node.crash_node()
             response_message = {
                 "status": "success", "message": f"Node {self.server.node.address} simulated crash."}
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(response_message).encode())
+            self._send_json(200, response_message)
         # Recovers the crashed node. 
         elif self.path == "/sim-recover":
             if self.server.node.crashed:
@@ -527,10 +3302,7 @@ class DHTHandler(BaseHTTPRequestHandler):
                 if status is False: 
                     response_message = {
                     "status": "failed", "message": f"Node {self.server.node.address} Failed via backup and bootstrap."}
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps(response_message).encode())
+                self._send_json(200, response_message)
             else:
                 self.send_error(400, "Bad Request - Node is not crashed")
 
@@ -539,20 +3311,19 @@ class DHTHandler(BaseHTTPRequestHandler):
             return
 
     # Do GET for network and storage
+    @admitted
+    @traced
+    @deadline_bound
     def do_GET(self):
+        if self._proxied_to_primary():
+            return
         # If node is crashed it cant perform any GET calls. 
         if self.server.node.crashed:
             self.send_error(503, "Service Unavailable - Node is crashed")
             return
         # Retrieve info about the node. 
         if self.path == "/node-info":
-            node_info = self.server.node.get_node_info()
-            json_data = json.dumps(node_info).encode("utf-8")
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.send_header("Content-length", len(json_data))
-            self.end_headers()
-            self.wfile.write(json_data)
+            self._send_json(200, self.server.node.get_node_info())
         # Used to get the sucessor predecessor. 
         elif self.path.startswith('/predecessor'):
             if self.server.node.predecessor:
@@ -560,76 +3331,398 @@ class DHTHandler(BaseHTTPRequestHandler):
                     'node_id': self.server.node.predecessor.node_id,
                     'node_address': self.server.node.predecessor.address
                 }
-                json_data = json.dumps(predecessor_info).encode('utf-8')
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Content-length', len(json_data))
-                self.end_headers()
-                self.wfile.write(json_data)
+                self._send_json(200, predecessor_info)
             else:
                 print("No predecessor found.")
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({}).encode('utf-8'))
+                self._send_json(200, {})
+        # Scan of this node's keys, one page streamed as JSON lines, the last line holds the cursor of the next page.
+        elif urlsplit(self.path).path == "/storage":
+            scan = self._scan_params()
+            if scan is None:
+                return
+            start, end, prefix, after, limit, keys_only = scan
+            _, chunks, cursor = self.server.node.scan_page(start, end, prefix, after, limit, keys_only,
+                                                           own=self._worker_local())
+            lines = itertools.chain(chunks, [json.dumps({'next': cursor}).encode() + b'\n'])
+            self._send_chunked(200, lines, 'application/x-ndjson')
+        # Snapshot of this node's keys as binary records, by default the keys of its own range (predecessor, self].
+        elif urlsplit(self.path).path == "/snapshot":
+            node = self.server.node
+            query = parse_qs(urlsplit(self.path).query)
+            if 'start' in query:
+                scan = self._scan_params()
+                if scan is None:
+                    return
+                start, end = scan[:2]
+            elif node.predecessor is not None:
+                start, end = (node.predecessor.node_id + 1) % HASH_SPACE, (node.node_id + 1) % HASH_SPACE
+            else:
+                start = end = 0
+            self._send_chunked(200, node.snapshot_chunks(start, end, own=self._worker_local()),
+                               'application/octet-stream')
+        # Scan of the whole ring, walking the successors, streamed as JSON lines.
+        elif urlsplit(self.path).path == "/scan":
+            scan = self._scan_params()
+            if scan is None:
+                return
+            start, end, prefix, _, _, keys_only = scan
+            self._send_chunked(200, self.server.node.scan_ring(start, end, prefix, keys_only), 'application/x-ndjson')
         # Retrieve value from node hash table. 
         elif self.path.startswith("/storage/"):
             key = self.path.split("/storage/")[1]
-            value = self.server.node.get_action(key)
-            if value:
-                self.send_response(200)
-                self.send_header(
-                    "Content-type", "text/plain; charset=utf-8")
-                self.send_header("Content-length",
-                                 len(value.encode("utf-8")))
-                self.end_headers()
-                self.wfile.write(value.encode("utf-8"))
-            else:
+            node = self.server.node
+            status, entry = node._get_at(node, key) if self._worker_local() else node.get_action(key)
+            if status == 200:
+                payload, encoding, version = entry
+                # Only decompress for clients that can't take the stored encoding.
+                if encoding != IDENTITY and not accepts_encoding(self.headers.get('Accept-Encoding'), encoding):
+                    payload, encoding = self.server.node.decompress(payload, encoding), IDENTITY
+                headers = {"Content-Encoding": encoding} if encoding != IDENTITY else {}
+                # The write time, so a node reading the key from two places can keep the newer copy.
+                if version is not None:
+                    headers["X-Version"] = repr(version)
+                self._send(200, payload, "text/plain; charset=utf-8", headers)
+            elif status == 504:
+                self.send_error(504, f"Gateway Timeout - Deadline passed looking up key: {key}")
+            elif status == 404:
                 self.send_error(
                     404, f"Not Found - /storage Key: {key} not found")
+            else:
+                self.send_error(status, f"Failed to look up key: {key}")
+        # Latest trace spans recorded on this node, optionally for one trace.
+        elif self.path.startswith("/debug/traces"):
+            query = parse_qs(urlsplit(self.path).query)
+            trace_id = query.get('trace_id', [None])[0]
+            try:
+                limit = int(query.get('limit', [0])[0])
+                if limit < 0:
+                    raise ValueError(limit)
+            except ValueError:
+                self.send_error(400, "Bad Request - limit must be a non-negative integer")
+                return
+            spans = self.server.node.get_traces(trace_id, limit or None)
+            self._send_json(200, {'node': self.server.node.address, 'spans': spans})
+        # Sampling profile of all threads for N seconds, as collapsed stacks or a top-style table.
+        elif self.path.startswith("/debug/profile"):
+            if not self._debug_authorized():
+                return
+            query = parse_qs(urlsplit(self.path).query)
+            try:
+                seconds = float(query.get('seconds', [5])[0])
+            except ValueError:
+                self.send_error(400, "Bad Request - seconds must be a number")
+                return
+            seconds = min(max(seconds, 0), PROFILE_MAX_SECONDS)
+            counts = sample_stacks(seconds)
+            if query.get('format', ['collapsed'])[0] == 'top':
+                self._send_text(format_top(counts))
+            else:
+                self._send_text(format_collapsed(counts))
+        # Stack of every thread right now.
+        elif self.path == "/debug/stacks":
+            if not self._debug_authorized():
+                return
+            self._send_text(thread_dump())
+        # Keys, bytes and request rate per slice of our range, for the rebalancer.
+        elif self.path == "/load":
+            self._send_json(200, self.server.node.get_load(own=self._worker_local()))
+        # Storage and request statistics.
+        elif self.path == "/stats":
+            self._send_json(200, self.server.node.get_stats())
         # Ping to check if node is alive. 
         elif self.path.startswith('/ping'):
-            self.send_response(200)
-            self.end_headers()
+            self._send(200)
 
         else:
             self.send_error(404, "Not Found - This API doesn't exist")
 
 
-def run_server(node):
-    host, port = node.address.split(":")
-    port = int(port)
-    server = HTTPServer((host, port), DHTHandler)
-    server.node = node
-    threading.Thread(target=server.serve_forever, daemon=True).start()
-    print(f"Node {node.address} hashed {node.node_id} is running...")
+# Host mode: a call to a node in the same process skips the network. The request is serialized as it would be
+# on the wire and handled by that node's own DHTHandler, reading from and writing to memory instead of a socket,
+# so routing, tracing and deadlines work exactly as between processes. A call made while handling a request, such
+# as the next hop of a lookup, runs on the calling thread. Waiting on a HOST_POOL thread for it instead, calls
+# nested O(log N) deep under concurrent lookups could take every thread of the pool and stall until they time out.
+# Only calls from other threads, the maintenance tasks and hedges, go to HOST_POOL.
+class LoopbackAdapter(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter mounted on SESSION for the address of every node in the process.
 
-    # Task that are called periodcally, follows Chord paper logic
-    def task_stabilize():
-        while True:
-            time.sleep(7)
-            node.stabilize()
+    Attributes:
+        server (ThreadingHTTPServer): The server of the node the calls go to.
+    """
+
+    def __init__(self, server):
+        super().__init__()
+        self.server = server
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if isinstance(timeout, tuple):
+            timeout = timeout[1]
+        if getattr(_serving, 'active', False):
+            if getattr(_serving, 'depth', 0) >= LOOPBACK_MAX_DEPTH:
+                raise RoutingLoop(f"Call to {self.server.node.address} nested {LOOPBACK_MAX_DEPTH} deep", request=request)
+            data = self._handle(self._serialize(request))
+        else:
+            future = HOST_POOL.submit(self._handle, self._serialize(request))
+            try:
+                data = future.result(timeout=timeout)
+            except concurrent.futures.TimeoutError:
+                raise requests.exceptions.ReadTimeout(
+                    f"Call to {self.server.node.address} timed out after {timeout} seconds", request=request)
+        reply = http.client.HTTPResponse(_Reply(data), method=request.method)
+        reply.begin()
+        body = reply.read()
+        # The body is already de-chunked, urllib3 must not try again.
+        headers = [(name, value) for name, value in reply.getheaders() if name.lower() != 'transfer-encoding']
+        response = urllib3.HTTPResponse(body=io.BytesIO(body), headers=headers, status=reply.status,
+                                        reason=reply.reason, preload_content=False, decode_content=False)
+        return self.build_response(request, response)
+
+    def _serialize(self, request):
+        body = request.body or b''
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        headers = dict(request.headers, Host=self.server.node.address)
+        headers['Content-Length'] = str(len(body))
+        head = [f"{request.method} {request.path_url} HTTP/1.1"] + [f"{name}: {value}" for name, value in headers.items()]
+        return ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body
+
+    # Runs one request through the handler, like a connection that is closed after it. The trace and deadline of
+    # the request the calling thread is handling are put back afterwards, the called handler sets its own.
+    def _handle(self, raw):
+        saved = current_trace() + (getattr(_deadline, 'at', None), getattr(_serving, 'active', False),
+                                   getattr(_serving, 'depth', 0))
+        _trace.trace_id, _trace.span_id, _deadline.at, _serving.active = None, None, None, True
+        _serving.depth = saved[-1] + 1
+        try:
+            handler = DHTHandler.__new__(DHTHandler)
+            handler.server = self.server
+            handler.client_address = ('loopback', 0)
+            handler.request = None
+            handler.rfile = io.BytesIO(raw)
+            handler.wfile = io.BytesIO()
+            handler.requests_served = 0
+            handler.headers = None
+            handler.body = None
+            handler.sender_trusted = None
+            handler.close_connection = True
+            handler.handle_one_request()
+            return handler.wfile.getvalue()
+        finally:
+            _trace.trace_id, _trace.span_id, _deadline.at, _serving.active, _serving.depth = saved
 
-    def task_fix_finger():
-        while True:
-            time.sleep(3)
-            node.fix_fingers()
 
-    def task_check_pred():
+# The buffered reply of a loopback call, in the shape http.client.HTTPResponse reads from.
+class _Reply:
+    def __init__(self, data):
+        self.data = data
+
+    def makefile(self, mode):
+        return io.BytesIO(self.data)
+
+
+# Host mode: runs the maintenance tasks of all nodes in the process from one timer thread on a small pool, instead
+# of six sleeping threads per node. A task is scheduled again when its run is done, so it never overlaps itself.
+class Scheduler:
+    """
+    Timer heap of periodic tasks.
+
+    Attributes:
+        queue (list): Heap of (due time, sequence number, interval, task).
+        pool (ThreadPoolExecutor): Runs the tasks that are due.
+    """
+
+    def __init__(self, workers=HOST_MAINTENANCE_WORKERS):
+        self.queue = []
+        self.condition = threading.Condition()
+        self.sequence = itertools.count()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="maintenance")
+
+    # Runs task every interval seconds. The first run is at a random offset, so the nodes' rounds are spread out.
+    def every(self, interval, task):
+        self._schedule(time.monotonic() + random.uniform(0, interval), interval, task)
+
+    def _schedule(self, due, interval, task):
+        with self.condition:
+            heapq.heappush(self.queue, (due, next(self.sequence), interval, task))
+            self.condition.notify()
+
+    def _run(self, interval, task):
+        try:
+            task()
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self._schedule(time.monotonic() + interval, interval, task)
+
+    def run_forever(self):
         while True:
-            time.sleep(5)
-            node.check_predecessor()
+            with self.condition:
+                while not self.queue or self.queue[0][0] > time.monotonic():
+                    self.condition.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+                _, _, interval, task = heapq.heappop(self.queue)
+            self.pool.submit(self._run, interval, task)
+
+
+# The periodic tasks of a node, as (name, seconds between runs, task). Follows Chord paper logic.
+def maintenance_tasks(node):
+    return [
+        ("stabilize", STABILIZE_INTERVAL, node.stabilize),
+        ("fix_fingers", FIX_FINGERS_INTERVAL, node.fix_fingers),
+        ("check_predecessor", CHECK_PREDECESSOR_INTERVAL, node.check_predecessor),
+        ("expire", WHEEL_RESOLUTION, node.data.expire),
+        ("anti_entropy", ANTI_ENTROPY_INTERVAL, node.anti_entropy),
+        ("membership", MEMBERSHIP_INTERVAL, node.gossip_membership),
+    ]
+
+
+def run_periodically(interval, task):
+    while True:
+        time.sleep(interval)
+        # One failed round must not end the loop, as in Scheduler._run.
+        try:
+            task()
+        except Exception:
+            traceback.print_exc()
+
+
+def make_server(node, idle_timeout=IDLE_TIMEOUT, max_connections=MAX_CONNECTIONS,
+                max_requests_per_connection=MAX_REQUESTS_PER_CONNECTION, reuse_port=False, sock=None):
+    host, port = node.address.split(":")
+    port = int(port)
+    server = ThreadingHTTPServer((host, port), DHTHandler, bind_and_activate=False)
+    if sock is not None:
+        # A socket bound and listening already, the private address of a worker.
+        server.socket.close()
+        server.socket, server.server_address = sock, sock.getsockname()
+    else:
+        # Worker mode: every worker binds the node's address, the kernel spreads the connections over them.
+        server.allow_reuse_port = reuse_port
+        try:
+            server.server_bind()
+            server.server_activate()
+        except OSError:
+            server.server_close()
+            raise
+    server.private = sock is not None
+    server.node = node
+    server.idle_timeout = idle_timeout
+    server.max_connections = max_connections
+    server.max_requests_per_connection = max_requests_per_connection
+    server.open_connections = 0
+    server.connections_lock = threading.Lock()
+    return server
 
-    threading.Thread(target=task_stabilize, daemon=True).start()
-    threading.Thread(target=task_fix_finger, daemon=True).start()
-    threading.Thread(target=task_check_pred, daemon=True).start()
 
+def wait_for_interrupt(servers):
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
         print("Shutting down the server")
-        server.shutdown()
+        for server in servers:
+            server.server_close()
+
+
+def run_server(node, idle_timeout=IDLE_TIMEOUT, max_connections=MAX_CONNECTIONS,
+               max_requests_per_connection=MAX_REQUESTS_PER_CONNECTION):
+    server = make_server(node, idle_timeout, max_connections, max_requests_per_connection)
+    threading.Thread(target=server.serve_forever, name="server", daemon=True).start()
+    print(f"Node {node.address} hashed {node.node_id} is running...")
+
+    # Task that are called periodcally, one thread each.
+    for name, interval, task in maintenance_tasks(node):
+        threading.Thread(target=run_periodically, args=(interval, task), name=name, daemon=True).start()
+
+    wait_for_interrupt([server])
+
+
+# Host mode: one thread accepts the connections of all the servers in the process, where each server would
+# otherwise run its own serve_forever loop.
+def serve_all(servers):
+    with selectors.DefaultSelector() as selector:
+        for server in servers:
+            selector.register(server, selectors.EVENT_READ)
+        while True:
+            for key, _ in selector.select():
+                key.fileobj._handle_request_noblock()
+
+
+# Host mode: many nodes in one process, each on its own port. They share the connection pool, one accepting thread
+# and one maintenance scheduler, and calls between them stay in the process.
+def run_host(nodes, idle_timeout=IDLE_TIMEOUT, max_connections=MAX_CONNECTIONS,
+             max_requests_per_connection=MAX_REQUESTS_PER_CONNECTION):
+    servers = [make_server(node, idle_timeout, max_connections, max_requests_per_connection) for node in nodes]
+    for server in servers:
+        SESSION.mount(f"http://{server.node.address}/", LoopbackAdapter(server))
+    threading.Thread(target=serve_all, args=(servers,), name="server", daemon=True).start()
+
+    scheduler = Scheduler()
+    for node in nodes:
+        for _, interval, task in maintenance_tasks(node):
+            scheduler.every(interval, task)
+    threading.Thread(target=scheduler.run_forever, name="scheduler", daemon=True).start()
+    print(f"Host running {len(nodes)} nodes: {' '.join(node.address for node in nodes)}")
+
+    wait_for_interrupt(servers)
+
+
+# Worker mode: the tasks of a worker. The primary runs the node's maintenance and publishes its routing state,
+# the others load that state and only expire and hand off their own keys. They exit with the primary.
+def worker_tasks(node):
+    if node.workers.is_primary():
+        return maintenance_tasks(node) + [("routing", ROUTING_SYNC_INTERVAL, node.publish_routing)]
+    primary = os.getppid()
+    return [
+        ("routing", ROUTING_SYNC_INTERVAL, node.load_routing),
+        ("expire", WHEEL_RESOLUTION, node.data.expire),
+        ("anti_entropy", ANTI_ENTROPY_INTERVAL, node.anti_entropy),
+        ("primary", 1, lambda: os.getppid() == primary or os._exit(0)),
+    ]
+
+
+# Worker mode: serves one node with several processes, so it can use more than one core. The private sockets and the
+# shared memory for the routing state are set up before forking, so every worker knows them. Worker 0 is this process.
+def run_workers(node_of, count, idle_timeout=IDLE_TIMEOUT, max_connections=MAX_CONNECTIONS,
+                max_requests_per_connection=MAX_REQUESTS_PER_CONNECTION):
+    sockets = []
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(ThreadingHTTPServer.request_queue_size)
+        sockets.append(sock)
+    addresses = [f"127.0.0.1:{sock.getsockname()[1]}" for sock in sockets]
+    routing = SharedRouting()
+
+    index, children = 0, []
+    for i in range(1, count):
+        pid = os.fork()
+        if pid == 0:
+            index, children = i, []
+            break
+        children.append(pid)
+    for i, sock in enumerate(sockets):
+        if i != index:
+            sock.close()
+
+    node = node_of()
+    node.workers = WorkerGroup(index, addresses, routing)
+    servers = [make_server(node, idle_timeout, max_connections, max_requests_per_connection, reuse_port=True),
+               make_server(node, idle_timeout, max_connections, max_requests_per_connection, sock=sockets[index])]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, name="server", daemon=True).start()
+    for name, interval, task in worker_tasks(node):
+        threading.Thread(target=run_periodically, args=(interval, task), name=name, daemon=True).start()
+    print(f"Node {node.address} hashed {node.node_id} worker {index} of {count} is running on {addresses[index]}...")
+
+    try:
+        wait_for_interrupt(servers)
+    finally:
+        if index == 0:
+            for pid in children:
+                os.kill(pid, signal.SIGTERM)
+            routing.memory.close()
+            routing.memory.unlink()
 
 
 def arg_parser():
@@ -637,14 +3730,65 @@ def arg_parser():
         prog="server", description="DHT server/client")
     parser.add_argument("current_node", type=str,
                         help="address (host:port) of this node")
+    parser.add_argument("--max-bytes", type=int, default=None,
+                        help="storage quota in bytes, least recently used keys are evicted when full")
+    parser.add_argument("--compress-min-bytes", type=int, default=None,
+                        help="deflate values of at least this many bytes, off by default")
+    parser.add_argument("--debug-token", default=os.environ.get("DHT_DEBUG_TOKEN"),
+                        help="bearer token that enables /debug/profile and /debug/stacks (or set DHT_DEBUG_TOKEN)")
+    parser.add_argument("--cluster-secret", default=os.environ.get("DHT_CLUSTER_SECRET"),
+                        help="secret shared by all nodes that signs their calls to each other (or set DHT_CLUSTER_SECRET)")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                        help="seconds before an idle keep-alive connection is closed")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS,
+                        help="open connections above this are closed after their current response")
+    parser.add_argument("--max-requests-per-connection", type=int, default=MAX_REQUESTS_PER_CONNECTION,
+                        help="requests served on one keep-alive connection before it is closed")
+    parser.add_argument("--one-hop", action="store_true",
+                        help="route lookups straight to the owner from the gossiped membership table")
+    parser.add_argument("--hedge", action="store_true",
+                        help="hedge slow forwarded reads with a second read from the owner's successor")
+    parser.add_argument("--hedge-budget", type=float, default=HEDGE_BUDGET,
+                        help="hedge requests allowed per forwarded read, on average")
+    parser.add_argument("--host-nodes", type=int, default=1,
+                        help="run this many nodes in one process, on consecutive ports from the given one")
+    parser.add_argument("--rate-limits", type=parse_rates, default=RATE_LIMITS,
+                        help="requests per second allowed per client for each endpoint class, 0 for no limit")
+    parser.add_argument("--max-client-inflight", type=int, default=MAX_CLIENT_INFLIGHT,
+                        help="client requests in flight, above this new ones are answered 503")
+    parser.add_argument("--max-node-inflight", type=int, default=MAX_NODE_INFLIGHT,
+                        help="storage requests forwarded by other nodes in flight, above this new ones are answered 503")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="serve the node with this many processes sharing its port (SO_REUSEPORT)")
     return parser
 
 
-def main(args):
-    current_node_addr = args.current_node
-    node = Node(current_node_addr)
+def new_node(address, args):
+    node = Node(address, max_bytes=args.max_bytes, compress_min_bytes=args.compress_min_bytes)
+    node.debug_token = args.debug_token
+    node.cluster_secret = args.cluster_secret
+    node.one_hop = args.one_hop
+    node.hedge = args.hedge
+    node.hedge_policy.budget = args.hedge_budget
+    node.admission = Admission(args.rate_limits, {CLIENT: args.max_client_inflight,
+                                                  FORWARDED: args.max_node_inflight, MAINTENANCE: None})
     node.create()
-    run_server(node)
+    return node
+
+
+def main(args):
+    if args.workers > 1:
+        if args.host_nodes > 1:
+            raise SystemExit("--workers and --host-nodes can't be combined")
+        run_workers(lambda: new_node(args.current_node, args), args.workers, args.idle_timeout,
+                    args.max_connections, args.max_requests_per_connection)
+        return
+    host, port = args.current_node.split(":")
+    nodes = [new_node(f"{host}:{int(port) + i}", args) for i in range(max(args.host_nodes, 1))]
+    if len(nodes) == 1:
+        run_server(nodes[0], args.idle_timeout, args.max_connections, args.max_requests_per_connection)
+    else:
+        run_host(nodes, args.idle_timeout, args.max_connections, args.max_requests_per_connection)
 
 
 if __name__ == "__main__":
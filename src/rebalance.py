@@ -0,0 +1,151 @@
+import argparse
+import http.client
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from main import HASH_SPACE, in_range
+
+METRICS = ("requests", "keys", "bytes")
+
+
+def call(node_address, method, path, body=None, timeout=5):
+    """One JSON call to a node, returns (status, decoded body or None)."""
+    conn = http.client.HTTPConnection(node_address, timeout=timeout)
+    conn.request(method, path, body=json.dumps(body) if body is not None else None,
+                 headers={'Content-Type': 'application/json'})
+    res = conn.getresponse()
+    data = res.read()
+    conn.close()
+    try:
+        return res.status, json.loads(data)
+    except ValueError:
+        return res.status, None
+
+
+def fetch_load(node_address):
+    """Fetch /load from one node, None if it doesn't answer."""
+    try:
+        status, load = call(node_address, "GET", "/load")
+        return load if status == 200 else None
+    except Exception as e:
+        logging.debug(f"Error fetching load from {node_address}: {e}")
+        return None
+
+
+def fetch_loads(nodes):
+    """Fetch the load of every node at once, leaving out the ones that don't answer or are not in a ring."""
+    with ThreadPoolExecutor(max_workers=min(64, max(len(nodes), 1))) as pool:
+        loads = pool.map(fetch_load, nodes)
+    return [load for load in loads if load and load['predecessor_id'] is not None]
+
+
+def amount(item, metric):
+    """The load of a node or of one of its buckets by the chosen metric."""
+    return item['request_rate'] if metric == "requests" else item[metric]
+
+
+def split_point(load, metric):
+    """
+    The ID that splits the node's range (predecessor, node] in two halves of about equal load.
+    Walks the buckets from the start of the range and cuts at the end of the bucket where half the
+    load is reached. When the range lies inside one bucket, it is cut in the middle.
+    """
+    start, end = (load['predecessor_id'] + 1) % HASH_SPACE, load['node_id']
+    width = load['bucket_width']
+    arc = (end - start) % HASH_SPACE
+    middle = (start + arc // 2) % HASH_SPACE
+
+    buckets = {b['bucket']: amount(b, metric) for b in load['buckets']}
+    total = sum(buckets.values())
+    first, last = start // width, end // width
+    count = (last - first) % (HASH_SPACE // width) + 1
+    if count < 2 or total <= 0:
+        return middle
+    running = 0
+    for i in range(count):
+        b = (first + i) % (HASH_SPACE // width)
+        running += buckets.get(b, 0)
+        if running >= total / 2:
+            cut = ((b + 1) * width - 1) % HASH_SPACE
+            # The new node must land strictly inside the range, before the hot node itself.
+            return cut if in_range(cut, start, end) else middle
+    return middle
+
+
+def plan(loads, metric, threshold):
+    """
+    Pick one move: the least loaded node takes over half of the most loaded node's range.
+    Returns (node to move, new ID, hot node), or None when no node is above threshold times the mean.
+    """
+    if len(loads) < 3:
+        return None
+    mean = sum(amount(load, metric) for load in loads) / len(loads)
+    hot = max(loads, key=lambda load: amount(load, metric))
+    if mean <= 0 or amount(hot, metric) <= threshold * mean:
+        return None
+    cold = min((load for load in loads if load is not hot), key=lambda load: amount(load, metric))
+    new_id = split_point(hot, metric)
+    taken = {load['node_id'] for load in loads}
+    if new_id in taken:
+        return None
+    return cold['node'], new_id, hot['node']
+
+
+def main():
+    # Set up logging
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(
+        description="Move lightly loaded nodes into the hot ranges of the ring.")
+    parser.add_argument("nodes", type=str, nargs='*', help="List of node addresses, defaults to nodes.txt")
+    parser.add_argument("--nodes-file", default="nodes.txt", help="File with node addresses")
+    parser.add_argument("--metric", choices=METRICS, default="requests",
+                        help="Balance request rate, key count or stored bytes")
+    parser.add_argument("--threshold", type=float, default=1.5,
+                        help="Move nodes while the hottest node has more than this times the mean load")
+    parser.add_argument("--rounds", type=int, default=1, help="Most relocations to make")
+    parser.add_argument("--interval", type=float, default=60,
+                        help="Seconds to wait between rounds, so request rates reflect the last move")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the moves")
+    args = parser.parse_args()
+
+    nodes = args.nodes
+    if not nodes:
+        with open(args.nodes_file) as f:
+            nodes = f.read().split()
+
+    for round_number in range(args.rounds):
+        if round_number:
+            time.sleep(args.interval)
+        loads = fetch_loads(nodes)
+        for load in sorted(loads, key=lambda load: load['node_id']):
+            logging.info(f"{load['node']} ID {load['node_id']}: {load['keys']} keys, {load['bytes']} bytes, "
+                         f"{load['request_rate']:.1f} requests/s")
+        move = plan(loads, args.metric, args.threshold)
+        if move is None:
+            logging.info(f"Ring is balanced by {args.metric} within {args.threshold}x the mean.")
+            return
+        node, new_id, hot = move
+        logging.info(f"Moving {node} to ID {new_id}, to take over half of the range of {hot}.")
+        if args.dry_run:
+            return
+        started = time.time()
+        try:
+            status, summary = call(node, "POST", "/relocate", {'node_id': new_id}, timeout=300)
+        except Exception as e:
+            logging.error(f"Relocating {node} failed: {e}")
+            return
+        if status != 200:
+            # A relocation that failed part way reports where the node ended up.
+            detail = f": {summary['error']}, node at ID {summary['node_id']}" if summary and 'complete' in summary else ""
+            logging.error(f"Relocating {node} failed with status {status}{detail}")
+            return
+        logging.info(f"Relocated {node} in {time.time() - started:.1f} seconds: "
+                     f"{summary['moved_out']} keys moved out, {summary['pulled']} pulled in.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import argparse
+import http.client
+import logging
+import random
+import sys
+import threading
+import time
+
+from main import HASH_SPACE
+from rebalance import call
+
+
+def storage(node_address, method, key, body=None):
+    """One PUT or GET of a key, returns (status, seconds taken). Errors count as status None."""
+    started = time.monotonic()
+    try:
+        conn = http.client.HTTPConnection(node_address, timeout=30)
+        conn.request(method, f"/storage/{key}", body=body)
+        res = conn.getresponse()
+        res.read()
+        conn.close()
+        return res.status, time.monotonic() - started
+    except Exception as e:
+        logging.error(f"{method} {key} at {node_address} failed: {e}")
+        return None, time.monotonic() - started
+
+
+def reader(nodes, keys, stop, results, lock):
+    """Reads random existing keys through random nodes until stopped."""
+    while not stop.is_set():
+        key = random.choice(keys)
+        node = random.choice(nodes)
+        status, seconds = storage(node, "GET", key)
+        with lock:
+            results.append((status, seconds, node, key))
+
+
+def main():
+    # Set up logging
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(
+        description="Relocate a node while other clients read, and check that every read still finds its key.")
+    parser.add_argument("nodes", type=str, nargs='*', help="List of node addresses, defaults to nodes.txt")
+    parser.add_argument("--nodes-file", default="nodes.txt", help="File with node addresses")
+    parser.add_argument("--node", help="Node to relocate, a random one by default")
+    parser.add_argument("--node-id", type=int, help="ID to move the node to, a random one by default")
+    parser.add_argument("--keys", type=int, default=200, help="Keys written before the relocation")
+    parser.add_argument("--readers", type=int, default=4, help="Threads reading during the relocation")
+    parser.add_argument("--slow", type=float, default=1.0, help="Reads taking longer than this many seconds are reported")
+    args = parser.parse_args()
+
+    nodes = args.nodes
+    if not nodes:
+        with open(args.nodes_file) as f:
+            nodes = f.read().split()
+    if len(nodes) < 2:
+        logging.error("At least 2 nodes are required.")
+        sys.exit(1)
+
+    keys = [f"relocate-test-{i}" for i in range(args.keys)]
+    for key in keys:
+        status, _ = storage(random.choice(nodes), "PUT", key, key.encode())
+        if status != 200:
+            logging.error(f"PUT {key} failed with status {status}")
+            sys.exit(1)
+    logging.info(f"Wrote {len(keys)} keys.")
+
+    node = args.node or random.choice(nodes)
+    node_id = args.node_id if args.node_id is not None else random.randrange(HASH_SPACE)
+    stop, lock, results = threading.Event(), threading.Lock(), []
+    readers = [threading.Thread(target=reader, args=(nodes, keys, stop, results, lock))
+               for _ in range(args.readers)]
+    for thread in readers:
+        thread.start()
+    # Some reads before the move, so readers are busy when it starts.
+    time.sleep(1)
+    logging.info(f"Moving {node} to ID {node_id}.")
+    started = time.time()
+    relocated, summary = call(node, "POST", "/relocate", {'node_id': node_id}, timeout=300)
+    logging.info(f"Relocation answered {relocated} after {time.time() - started:.1f} seconds: {summary}")
+    # And some after, while the ring settles around the new ID.
+    time.sleep(2)
+    stop.set()
+    for thread in readers:
+        thread.join()
+
+    failed = [result for result in results if result[0] != 200]
+    slow = [result for result in results if result[1] > args.slow]
+    logging.info(f"{len(results)} reads, {len(failed)} failed, {len(slow)} took more than {args.slow} seconds.")
+    for status, seconds, address, key in failed[:20]:
+        logging.error(f"GET {key} at {address}: status {status} after {seconds:.2f} seconds")
+    if relocated != 200 or failed or slow:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
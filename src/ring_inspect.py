@@ -0,0 +1,141 @@
+import argparse
+import http.client
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from main import M, HASH_SPACE, in_range
+
+def fetch_node_info(node_address, timeout=5):
+    """Fetch /node-info from one node, None if it doesn't answer."""
+    try:
+        conn = http.client.HTTPConnection(node_address, timeout=timeout)
+        conn.request("GET", "/node-info")
+        res = conn.getresponse()
+        data = res.read()
+        conn.close()
+        if res.status != 200:
+            return None
+        return json.loads(data)
+    except Exception as e:
+        logging.debug(f"Error fetching node info from {node_address}: {e}")
+        return None
+
+
+def fetch_snapshot(nodes, timeout=5):
+    """Fetch the state of every node at once. Returns address -> node info (None for unresponsive nodes)."""
+    with ThreadPoolExecutor(max_workers=min(64, max(len(nodes), 1))) as pool:
+        infos = pool.map(lambda node: fetch_node_info(node, timeout), nodes)
+    return dict(zip(nodes, infos))
+
+
+def ideal_topology(snapshot):
+    """
+    Compute the correct successor, predecessor and fingers of every node from the sorted node hashes.
+    Finger k of node n may be any node in [n + 2^k, n + 2^(k+1)), since nodes prefer low-latency fingers.
+    If that interval is empty the only correct finger is the successor of n + 2^k.
+    """
+    ring = sorted((info['node_hash'], address) for address, info in snapshot.items() if info)
+    ideal = {}
+
+    def successor_of(identifier):
+        # First node with an ID >= identifier, wrapping around the ring.
+        for node_id, address in ring:
+            if node_id >= identifier:
+                return address
+        return ring[0][1]
+
+    for i, (node_id, address) in enumerate(ring):
+        fingers = []
+        for k in range(M):
+            start = (node_id + 2**k) % HASH_SPACE
+            end = (node_id + 2**(k + 1)) % HASH_SPACE if k + 1 < M else node_id
+            in_interval = {a for n, a in ring if n != node_id and in_range(n, start, end)}
+            fingers.append(in_interval or {successor_of(start)})
+        ideal[address] = {
+            'successor': ring[(i + 1) % len(ring)][1],
+            'predecessor': ring[(i - 1) % len(ring)][1],
+            'fingers': fingers,
+        }
+    return ideal
+
+
+def diff_snapshot(snapshot):
+    """Compare every node with the ideal topology. Returns address -> list of problems (empty when correct)."""
+    ideal = ideal_topology(snapshot)
+    diffs = {}
+    for address, info in snapshot.items():
+        if info is None:
+            diffs[address] = ["not responding"]
+            continue
+        expected = ideal[address]
+        problems = []
+        if len(ideal) > 1 and info['successor'] != expected['successor']:
+            problems.append(f"successor is {info['successor']}, expected {expected['successor']}")
+        if len(ideal) > 1 and info['predecessor'] != expected['predecessor']:
+            problems.append(f"predecessor is {info['predecessor']}, expected {expected['predecessor']}")
+        for k, (actual, allowed) in enumerate(zip(info.get('fingers', []), expected['fingers'])):
+            if actual not in allowed:
+                problems.append(f"finger {k} is {actual}, expected one of {sorted(allowed)}")
+        diffs[address] = problems
+    return diffs
+
+
+def wait_for_convergence(nodes, timeout=300, interval=0.5):
+    """
+    Poll all nodes concurrently until every one of them matches the ideal topology.
+    Returns (converged, seconds waited, last per-node diff).
+    """
+    start = time.time()
+    while True:
+        diffs = diff_snapshot(fetch_snapshot(nodes))
+        wrong = {address: problems for address, problems in diffs.items() if problems}
+        elapsed = time.time() - start
+        if not wrong:
+            logging.info(f"Ring converged after {elapsed:.1f} seconds ({len(nodes)} nodes).")
+            return True, elapsed, diffs
+        if elapsed > timeout:
+            logging.error(f"Ring did not converge within {timeout} seconds, {len(wrong)} nodes differ.")
+            return False, elapsed, diffs
+        logging.info(f"{len(wrong)}/{len(nodes)} nodes not converged yet, "
+                     f"{sum(len(p) for p in wrong.values())} differences.")
+        time.sleep(interval)
+
+
+def report(diffs):
+    for address, problems in sorted(diffs.items()):
+        if not problems:
+            logging.info(f"{address}: ok")
+        for problem in problems:
+            logging.warning(f"{address}: {problem}")
+
+
+def main():
+    # Set up logging
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(
+        description="Fetch the state of every node and compare it with the ideal Chord ring.")
+    parser.add_argument("nodes", type=str, nargs='*', help="List of node addresses, defaults to nodes.txt")
+    parser.add_argument("--nodes-file", default="nodes.txt", help="File with node addresses")
+    parser.add_argument("--watch", action="store_true", help="Poll until the ring has converged")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for convergence with --watch")
+    parser.add_argument("--interval", type=float, default=0.5, help="Seconds between polls with --watch")
+    args = parser.parse_args()
+
+    nodes = args.nodes
+    if not nodes:
+        with open(args.nodes_file) as f:
+            nodes = f.read().split()
+
+    if args.watch:
+        _, _, diffs = wait_for_convergence(nodes, args.timeout, args.interval)
+    else:
+        diffs = diff_snapshot(fetch_snapshot(nodes))
+    report(diffs)
+
+
+if __name__ == "__main__":
+    main()
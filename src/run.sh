@@ -2,36 +2,43 @@
 
 # Check if the number of servers to start is provided
 if [ -z "$1" ]; then
-    echo "Usage: $0 <number_of_servers>"
+    echo "Usage: $0 <number_of_servers> [nodes_per_process]"
     exit 1
 fi
 
 NUM_SERVERS=$1
+# With more than one node per process, each process runs that many nodes on consecutive ports (host mode)
+NODES_PER_PROCESS=${2:-1}
 
 # Get the list of available nodes
 NODES=$(sh /share/ifi/available-nodes.sh)
 NODES_ARRAY=($NODES)
 NUM_NODES=${#NODES_ARRAY[@]}
 
-# Function to generate a random port number between 49152 and 65535
+# Function to generate a random port number between 49152 and 65535, leaving room for the consecutive ports of a process
 generate_random_port() {
-    shuf -i 49152-65535 -n 1
+    shuf -i 49152-$((65535 - NODES_PER_PROCESS)) -n 1
 }
 
-# Prepare the host:port combinations first
+# Prepare the host:port combinations first, one process per NODES_PER_PROCESS nodes
 HOST_PORTS=()
-for ((i=0; i<NUM_SERVERS; i++)); do
-    NODE_INDEX=$((i % NUM_NODES))
+PROCESSES=()
+for ((i=0; i<NUM_SERVERS; i+=NODES_PER_PROCESS)); do
+    NODE_INDEX=$(((i / NODES_PER_PROCESS) % NUM_NODES))
     NODE=${NODES_ARRAY[$NODE_INDEX]}
     PORT=$(generate_random_port)
-    HOST_PORT="$NODE:$PORT"
-    HOST_PORTS+=("$HOST_PORT")
+    COUNT=$((NUM_SERVERS - i < NODES_PER_PROCESS ? NUM_SERVERS - i : NODES_PER_PROCESS))
+    PROCESSES+=("$NODE:$PORT:$COUNT")
+    for ((j=0; j<COUNT; j++)); do
+        HOST_PORTS+=("$NODE:$((PORT + j))")
+    done
 done
 
-# Now deploy each server, only passing the host:port of the current node
-for HOST_PORT in "${HOST_PORTS[@]}"; do
-    # Start the server on the current node with just the current node's address
-    ssh -f "${HOST_PORT%%:*}" "python3 $PWD/main.py $HOST_PORT"
+# Now deploy each process, passing the host:port of its first node and how many nodes it runs
+for PROCESS in "${PROCESSES[@]}"; do
+    COUNT=${PROCESS##*:}
+    HOST_PORT=${PROCESS%:*}
+    ssh -f "${HOST_PORT%%:*}" "python3 $PWD/main.py $HOST_PORT --host-nodes $COUNT"
 done
 
 # Sleep  seconds before printing out the servers it connected to
@@ -0,0 +1,262 @@
+import argparse
+import bisect
+import gzip
+import hashlib
+import http.client
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:  # Keys are then hashed and placed one at a time.
+    np = None
+
+from main import HASH_SPACE, SNAPSHOT_MAGIC, hash_sha1, pack_entry, unpack_entries
+
+CHUNK_BYTES = 8 << 20  # Records sent to a node per /import call.
+COPY_BYTES = 1 << 20
+HASH_BATCH = 1 << 16  # Records hashed and assigned to their owners at once.
+
+
+def call(node_address, method, path, body=None, timeout=60, headers=None):
+    """One call to a node, returns (status, headers, body)."""
+    conn = http.client.HTTPConnection(node_address, timeout=timeout)
+    conn.request(method, path, body=body, headers=headers or {})
+    res = conn.getresponse()
+    data = res.read()
+    conn.close()
+    return res.status, res, data
+
+
+def open_snapshot(path, mode):
+    """Snapshot files ending in .gz are gzip compressed."""
+    return gzip.open(path, mode) if path.endswith(".gz") else open(path, mode)
+
+
+def ring_of(nodes):
+    """Sorted (node ID, address) of the nodes that answer /node-info."""
+    def info(node):
+        try:
+            status, _, data = call(node, "GET", "/node-info", timeout=5)
+            return (json.loads(data)['node_hash'], node) if status == 200 else None
+        except Exception as e:
+            logging.warning(f"Skipping {node}: {e}")
+            return None
+    with ThreadPoolExecutor(max_workers=min(64, max(len(nodes), 1))) as pool:
+        return sorted(entry for entry in pool.map(info, nodes) if entry)
+
+
+def hash_keys(keys):
+    """
+    The ring IDs of many keys at once, the same as hash_sha1 of each. With NumPy the digests are joined
+    into one buffer and their last 8 bytes read as big-endian integers in one step, instead of a hex
+    string and an int() per key. HASH_SPACE is a power of two, so the low bits are all that count.
+    """
+    if np is None:
+        return [hash_sha1(key) for key in keys]
+    digests = b''.join(hashlib.sha1(key.encode()).digest() for key in keys)
+    tails = np.frombuffer(digests, dtype=np.uint8).reshape(-1, 20)[:, 12:]
+    return np.ascontiguousarray(tails).view('>u8').ravel() % HASH_SPACE
+
+
+def assign_owners(keys, ring_ids):
+    """
+    Group keys by the node that owns them in a ring snapshot: the first node ID at or after the key's ID,
+    wrapping past the last node to the first. Returns the positions of the keys per node, in ring order.
+    """
+    ids = hash_keys(keys)
+    if np is None:
+        groups = [[] for _ in ring_ids]
+        for position, key_id in enumerate(ids):
+            groups[bisect.bisect_left(ring_ids, key_id) % len(ring_ids)].append(position)
+        return groups
+    owners = np.searchsorted(ring_ids, ids) % len(ring_ids)
+    order = np.argsort(owners, kind='stable')
+    return np.split(order, np.cumsum(np.bincount(owners, minlength=len(ring_ids)))[:-1])
+
+
+def export_node(node, part_path, timeout):
+    """Stream the node's own range from /snapshot into a part file. Returns the bytes written."""
+    conn = http.client.HTTPConnection(node, timeout=timeout)
+    try:
+        conn.request("GET", "/snapshot")
+        res = conn.getresponse()
+        if res.status != 200:
+            raise RuntimeError(f"status {res.status}")
+        if res.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise RuntimeError("not a snapshot")
+        written = 0
+        with open(part_path, "wb") as part:
+            while True:
+                data = res.read(COPY_BYTES)
+                if not data:
+                    return written
+                part.write(data)
+                written += len(data)
+    finally:
+        conn.close()
+
+
+def export(nodes, path, timeout):
+    """
+    Snapshot the ring: every node streams the keys of its own range to a part file, all nodes at once,
+    and the parts are joined into one file. Take it while the ring is stable, a key that moves during
+    the export can be missed or written twice.
+    """
+    started = time.time()
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as parts_dir:
+        parts = {node: os.path.join(parts_dir, f"{i}.part") for i, node in enumerate(nodes)}
+
+        def run(node):
+            try:
+                size = export_node(node, parts[node], timeout)
+                logging.info(f"{node}: {size} bytes")
+                return size
+            except Exception as e:
+                logging.error(f"Export from {node} failed: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=min(64, max(len(nodes), 1))) as pool:
+            sizes = dict(zip(nodes, pool.map(run, nodes)))
+        failed = [node for node, size in sizes.items() if size is None]
+        if failed:
+            logging.error(f"No snapshot written, {len(failed)} nodes failed: {' '.join(failed)}")
+            return False
+        with open_snapshot(path, "wb") as out:
+            out.write(SNAPSHOT_MAGIC)
+            for node in nodes:
+                with open(parts[node], "rb") as part:
+                    shutil.copyfileobj(part, out, COPY_BYTES)
+    logging.info(f"Exported {sum(sizes.values())} bytes from {len(nodes)} nodes to {path} "
+                 f"in {time.time() - started:.1f} seconds")
+    return True
+
+
+class Importer:
+    """
+    Splits a snapshot by owner, HASH_BATCH records at a time, and sends each node its records in chunks of
+    about CHUNK_BYTES, with up to `parallel` chunks in flight. A node that pushes back (429 or 503) is retried
+    after its Retry-After.
+    """
+
+    def __init__(self, ring, parallel, timeout, retries=10):
+        self.ids = [node_id for node_id, _ in ring]
+        if np is not None:
+            self.ids = np.array(self.ids, dtype=np.uint64)
+        self.addresses = [address for _, address in ring]
+        self.pool = ThreadPoolExecutor(max_workers=parallel)
+        self.slots = threading.Semaphore(parallel * 2)
+        self.timeout = timeout
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.totals = {"records": 0, "stored": 0, "skipped": 0, "bytes": 0, "failed": 0}
+
+    def send(self, node, records, count):
+        body = SNAPSHOT_MAGIC + b''.join(records)
+        for _ in range(self.retries):
+            try:
+                status, res, data = call(node, "POST", "/import", body, self.timeout,
+                                         {'Content-Type': 'application/octet-stream'})
+            except Exception as e:
+                logging.warning(f"Import to {node} failed: {e}")
+                time.sleep(1)
+                continue
+            if status in (429, 503):
+                time.sleep(float(res.getheader('Retry-After', 1)))
+                continue
+            if status != 200:
+                logging.error(f"Import to {node} failed with status {status}: {data[:200]!r}")
+                break
+            result = json.loads(data)
+            with self.lock:
+                self.totals["stored"] += result['stored']
+                self.totals["skipped"] += result['skipped']
+                self.totals["bytes"] += result['bytes']
+            return
+        with self.lock:
+            self.totals["failed"] += count
+
+    def submit(self, node, records):
+        self.slots.acquire()
+        future = self.pool.submit(self.send, node, records, len(records))
+        future.add_done_callback(lambda _: self.slots.release())
+
+    def run(self, stream):
+        buffers = {address: [] for address in self.addresses}
+        sizes = dict.fromkeys(self.addresses, 0)
+        entries = unpack_entries(stream)
+        while True:
+            batch = list(itertools.islice(entries, HASH_BATCH))
+            if not batch:
+                break
+            self.totals["records"] += len(batch)
+            groups = assign_owners([entry[0] for entry in batch], self.ids)
+            for node, positions in zip(self.addresses, groups):
+                for i in positions:
+                    record = pack_entry(*batch[i])
+                    buffers[node].append(record)
+                    sizes[node] += len(record)
+                    if sizes[node] >= CHUNK_BYTES:
+                        self.submit(node, buffers[node])
+                        buffers[node], sizes[node] = [], 0
+        for node, records in buffers.items():
+            if records:
+                self.submit(node, records)
+        self.pool.shutdown(wait=True)
+        return self.totals
+
+
+def restore(nodes, path, parallel, timeout):
+    """Bulk load a snapshot into the ring, each record straight into the node that owns its key."""
+    ring = ring_of(nodes)
+    if not ring:
+        logging.error("No node answered.")
+        return False
+    started = time.time()
+    with open_snapshot(path, "rb") as stream:
+        if stream.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            logging.error(f"{path} is not a snapshot.")
+            return False
+        totals = Importer(ring, parallel, timeout).run(stream)
+    elapsed = time.time() - started
+    logging.info(f"Imported {totals['records']} records into {len(ring)} nodes in {elapsed:.1f} seconds "
+                 f"({totals['records'] / max(elapsed, 1e-9):.0f} records/s): {totals['stored']} stored, "
+                 f"{totals['skipped']} skipped (older or expired), {totals['failed']} failed.")
+    return totals["failed"] == 0
+
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(
+        description="Export the keys of the whole ring to a snapshot file, or bulk load a snapshot into the ring.")
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("file", help="Snapshot file, gzip compressed if it ends in .gz")
+    parser.add_argument("nodes", type=str, nargs='*', help="List of node addresses, defaults to nodes.txt")
+    parser.add_argument("--nodes-file", default="nodes.txt", help="File with node addresses")
+    parser.add_argument("--parallel", type=int, default=16, help="Import chunks in flight at once")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for a node")
+    args = parser.parse_args()
+
+    nodes = args.nodes
+    if not nodes:
+        with open(args.nodes_file) as f:
+            nodes = f.read().split()
+
+    if args.command == "export":
+        ok = export(nodes, args.file, args.timeout)
+    else:
+        ok = restore(nodes, args.file, args.parallel, args.timeout)
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import http.client
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+def fetch_spans(node_address, trace_id=None, timeout=5):
+    """Fetch the spans a node has recorded, optionally for one trace only."""
+    path = "/debug/traces" + (f"?trace_id={trace_id}" if trace_id else "")
+    try:
+        conn = http.client.HTTPConnection(node_address, timeout=timeout)
+        conn.request("GET", path)
+        res = conn.getresponse()
+        data = res.read()
+        conn.close()
+        if res.status != 200:
+            return []
+        return json.loads(data)['spans']
+    except Exception as e:
+        logging.error(f"Error fetching traces from {node_address}: {e}")
+        return []
+
+
+def collect_traces(nodes, trace_id=None):
+    """Fetch spans from every node at once and group them by trace ID."""
+    with ThreadPoolExecutor(max_workers=min(64, max(len(nodes), 1))) as pool:
+        results = pool.map(lambda node: fetch_spans(node, trace_id), nodes)
+    traces = {}
+    for spans in results:
+        for span in spans:
+            traces.setdefault(span['trace_id'], []).append(span)
+    return traces
+
+
+def timeline(spans):
+    """
+    Render one trace as an indented tree of spans, children under the call that caused them.
+    Offsets are relative to the earliest span, so they depend on the node clocks being in sync.
+    """
+    children = {}
+    span_ids = {span['span_id'] for span in spans}
+    roots = []
+    for span in sorted(spans, key=lambda s: s['start']):
+        if span['parent_id'] in span_ids:
+            children.setdefault(span['parent_id'], []).append(span)
+        else:
+            roots.append(span)
+    origin = min(span['start'] for span in spans)
+
+    lines = []
+
+    def walk(span, depth):
+        offset = (span['start'] - origin) * 1000
+        lines.append(f"{offset:9.1f} ms {span['duration_ms']:9.1f} ms  {'  ' * depth}"
+                     f"{span['name']} [{span['node']}] -> {span['status']}")
+        for child in children.get(span['span_id'], []):
+            walk(child, depth + 1)
+
+    for root in roots:
+        walk(root, 0)
+    return lines
+
+
+def root_duration(spans):
+    """Duration of the span that started the trace (the one at the entry node)."""
+    span_ids = {span['span_id'] for span in spans}
+    roots = [span for span in spans if span['parent_id'] not in span_ids]
+    return max(span['duration_ms'] for span in roots or spans)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(
+        description="Stitch the trace spans of all nodes into full request timelines.")
+    parser.add_argument("nodes", type=str, nargs='*', help="List of node addresses, defaults to nodes.txt")
+    parser.add_argument("--nodes-file", default="nodes.txt", help="File with node addresses")
+    parser.add_argument("--trace-id", help="Show only this trace (the X-Trace-Id response header)")
+    parser.add_argument("--slowest", type=int, default=5, help="Show the N slowest traces")
+    args = parser.parse_args()
+
+    nodes = args.nodes
+    if not nodes:
+        with open(args.nodes_file) as f:
+            nodes = f.read().split()
+
+    traces = collect_traces(nodes, args.trace_id)
+    if not traces:
+        logging.info("No traces found.")
+        return
+
+    slowest = sorted(traces.items(), key=lambda item: root_duration(item[1]), reverse=True)[:args.slowest]
+    for trace_id, spans in slowest:
+        logging.info(f"Trace {trace_id}: {root_duration(spans):.1f} ms, {len(spans)} spans")
+        logging.info("   offset    duration  span")
+        for line in timeline(spans):
+            logging.info(line)
+        logging.info("")
+
+
+if __name__ == "__main__":
+    main()